@@ -3,8 +3,13 @@ Configuration management for the Hemoglobin Estimation API.
 Uses Pydantic Settings for environment variable management.
 """
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import List, Literal, Optional
+import os
+
+# Set once storage directories exist, so repeat calls in a worker are no-ops
+_dirs_created = False
 
 
 class Settings(BaseSettings):
@@ -19,16 +24,38 @@ class Settings(BaseSettings):
     # Server
     host: str = "0.0.0.0"
     port: int = 8000
+    # Browser origins allowed by CORS; explicit, since browsers ignore "*" for
+    # credentialed requests. In .env, a JSON list
+    cors_origins: List[str] = [
+        "http://localhost:3000",
+        "http://127.0.0.1:3000",
+        "http://localhost:5173",  # Vite default
+        "http://127.0.0.1:5173"
+    ]
     
     # File Storage
     upload_dir: Path = Path("./data/uploads")
     processed_dir: Path = Path("./data/processed")
     model_dir: Path = Path("./data/models")
     max_upload_size_mb: int = 8
+    upload_max_dim: int = 2048  # Decode large JPEGs at a reduced scale no smaller than this (0 = full size)
+    detection_max_dim: int = 512  # Hand / nail polish checks run on a copy downscaled to this (0 = full size)
+    embed_images_base64: bool = False  # Inline images in scan responses (else served by URL)
     
     # Model Paths
     unet_model_path: Path = Path("./data/models/unet_v1.0.0.h5")
     hb_model_path: Path = Path("./data/models/hb_predictor_v1.0.0.h5")
+    unet_jit_compile: bool = False  # XLA-compile UNet inference (benchmark per host)
+    gradcam_jit_compile: bool = False  # XLA-compile the Grad-CAM gradient step
+    gradcam_layer: str = ""  # Grad-CAM target layer; empty uses the last conv layer
+    warmup_models: bool = True  # Load models and trace inference at startup
+    hb_backbone: str = "mobilenet_v3_small"  # CNN backbone for newly built Hb models
+    hb_mixed_precision: str = ""  # e.g. "mixed_float16" (GPU) or "mixed_bfloat16"; empty keeps float32
+    
+    # Quantized Serving (int8 TFLite, falls back to Keras FP32 when disabled or missing)
+    use_tflite: bool = False
+    unet_tflite_path: Path = Path("./data/models/unet_v1.0.0_int8.tflite")
+    hb_tflite_path: Path = Path("./data/models/hb_predictor_v1.0.0_int8.tflite")
     
     # Quality Control Thresholds
     qc_min_sharpness: float = 30.0
@@ -36,17 +63,33 @@ class Settings(BaseSettings):
     qc_max_brightness: float = 220.0
     qc_min_contrast: float = 15.0
     qc_max_glare_coverage: float = 0.15
+    qc_max_dim: int = 0  # QC metrics on a copy downscaled to this, e.g. 512 (0 = decoded size); recalibrate sharpness/contrast thresholds when set
     
     # Preprocessing
     target_size: int = 512
     roi_size: int = 256
+    resize_interpolation: Literal["lanczos4", "cubic", "area", "linear"] = "lanczos4"  # Image and ROI resizing
     random_seed: int = 42
+    use_clahe: bool = True  # CLAHE on L* (else one global histogram equalization LUT, faster)
+    skin_tone_kmeans: bool = False  # Tone cluster from per-image k-means instead of L* bins
+    
+    # Feature Extraction
+    frangi_pyramid: bool = False  # Filter larger Frangi scales on a pyrDown octave (faster, approximate vascular features)
     
     # Prediction
     mc_dropout_passes: int = 10
     uncertainty_threshold: float = 0.7
     confidence_level: float = 0.95
     
+    # Concurrency
+    cpu_workers: int = 0  # Threads for CPU-bound scan stages (0 = CPU count)
+    feature_workers: int = 3  # Threads running the feature extractors of one scan (1 = sequential)
+    
+    # Inference batching (concurrent requests share one forward pass)
+    inference_max_batch_size: int = 8
+    inference_max_wait_ms: float = 5.0
+    inference_timeout_s: float = 60.0  # Max wait for a batched forward pass
+    
     # Anemia Thresholds (WHO guidelines, g/dL)
     anemia_threshold_normal: float = 12.0
     anemia_threshold_mild: float = 11.0
@@ -62,6 +105,7 @@ class Settings(BaseSettings):
     # Monitoring
     enable_metrics: bool = True
     metrics_port: int = 9090
+    metrics_cache_ttl: float = 1.0  # Seconds to reuse /metrics output (0 = off)
     
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -69,13 +113,29 @@ class Settings(BaseSettings):
         case_sensitive=False
     )
     
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Create directories if they don't exist
-        self.upload_dir.mkdir(parents=True, exist_ok=True)
-        self.processed_dir.mkdir(parents=True, exist_ok=True)
-        self.model_dir.mkdir(parents=True, exist_ok=True)
+    def ensure_dirs(self):
+        """Create storage directories (and shared parents) in a single pass."""
+        global _dirs_created
+        if _dirs_created:
+            return
+        
+        dirs = {self.upload_dir, self.processed_dir, self.model_dir}
+        # De-duplicate shared parents, then create shallowest first
+        paths = {p for d in dirs for p in (d, *d.parents) if p != Path(p.anchor) and str(p) != '.'}
+        for path in sorted(paths, key=lambda p: len(p.parts)):
+            try:
+                os.mkdir(path)
+            except FileExistsError:
+                pass
+        
+        _dirs_created = True
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get cached settings instance (environment is parsed once)."""
+    return Settings()
 
 
 # Global settings instance
-settings = Settings()
+settings = get_settings()
@@ -1,30 +1,29 @@
 """
 Database CRUD operations.
 """
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from app.database.models import ScanRecord
-from app.schemas import ScanResponse
+from app.schemas import INLINE_IMAGE_FIELDS, ScanResponse
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
-def create_scan_record(db: Session, scan_data: ScanResponse) -> ScanRecord:
+def _scan_record_values(scan_data: ScanResponse) -> Dict[str, Any]:
     """
-    Create a new scan record in database.
+    Map scan response data to ScanRecord column values.
     
     Args:
-        db: Database session
         scan_data: Scan response data
         
     Returns:
-        Created ScanRecord
+        Dict of column name to value
     """
-    # Convert to dict with JSON-safe datetime serialization
-    response_dict = scan_data.model_dump(mode='json')
+    prediction = scan_data.prediction
     
-    record = ScanRecord(
+    return dict(
         scan_id=scan_data.scan_id,
         timestamp=scan_data.timestamp,
         qc_pass=scan_data.quality.quality_pass,
@@ -33,24 +32,60 @@ def create_scan_record(db: Session, scan_data: ScanResponse) -> ScanRecord:
         qc_contrast=scan_data.quality.contrast,
         tone_cluster=scan_data.preprocessing.tone_cluster if scan_data.preprocessing else None,
         glare_coverage=scan_data.preprocessing.glare_mask_coverage if scan_data.preprocessing else None,
-        hb_value=scan_data.prediction.hb_g_per_dl if scan_data.prediction else None,
-        hb_ci_lower=scan_data.prediction.hb_ci_95[0] if scan_data.prediction and scan_data.prediction.hb_ci_95 else None,
-        hb_ci_upper=scan_data.prediction.hb_ci_95[1] if scan_data.prediction and scan_data.prediction.hb_ci_95 else None,
-        uncertainty=scan_data.prediction.uncertainty if scan_data.prediction else None,
-        anemia_stage=scan_data.prediction.anemia_stage.value if scan_data.prediction and scan_data.prediction.anemia_stage else None,
-        risk_score=scan_data.prediction.risk_score if scan_data.prediction else None,
+        hb_value=prediction.hb_g_per_dl if prediction else None,
+        hb_ci_lower=prediction.hb_ci_95[0] if prediction and prediction.hb_ci_95 else None,
+        hb_ci_upper=prediction.hb_ci_95[1] if prediction and prediction.hb_ci_95 else None,
+        uncertainty=prediction.uncertainty if prediction else None,
+        anemia_stage=prediction.anemia_stage.value if prediction and prediction.anemia_stage else None,
+        risk_score=prediction.risk_score if prediction else None,
         model_version=f"unet_{scan_data.version.unet}_hb_{scan_data.version.hb_model}",
-        response_data=response_dict  # Use JSON-safe dict
+        # JSON-safe dict; images live on disk, not in the row
+        response_data=scan_data.model_dump(mode='json', exclude=INLINE_IMAGE_FIELDS)
     )
+
+
+def create_scan_record(db: Session, scan_data: ScanResponse) -> ScanRecord:
+    """
+    Create a new scan record in database.
+    
+    Args:
+        db: Database session
+        scan_data: Scan response data
+        
+    Returns:
+        Created ScanRecord
+    """
+    record = ScanRecord(**_scan_record_values(scan_data))
     
     db.add(record)
     db.commit()
-    db.refresh(record)
     
     logger.info(f"Created scan record: {scan_data.scan_id}")
     return record
 
 
+def create_scan_records_bulk(db: Session, scan_data_list: List[ScanResponse]) -> int:
+    """
+    Insert many scan records in a single statement and transaction.
+    
+    Args:
+        db: Database session
+        scan_data_list: Scan response data
+        
+    Returns:
+        Number of records inserted
+    """
+    if not scan_data_list:
+        return 0
+    
+    records = [_scan_record_values(scan_data) for scan_data in scan_data_list]
+    db.execute(insert(ScanRecord), records)
+    db.commit()
+    
+    logger.info(f"Created {len(records)} scan records")
+    return len(records)
+
+
 def get_scan_record(db: Session, scan_id: str) -> Optional[ScanRecord]:
     """
     Retrieve scan record by ID.
@@ -62,7 +97,7 @@ def get_scan_record(db: Session, scan_id: str) -> Optional[ScanRecord]:
     Returns:
         ScanRecord if found, None otherwise
     """
-    record = db.query(ScanRecord).filter(ScanRecord.scan_id == scan_id).first()
+    record = db.get(ScanRecord, scan_id)
     
     if record:
         logger.info(f"Retrieved scan record: {scan_id}")
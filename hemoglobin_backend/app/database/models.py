@@ -1,46 +1,49 @@
 """
 Database models for scan storage.
 """
-from sqlalchemy import Column, String, Float, Integer, DateTime, Boolean, JSON, create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import JSON, String, Float, Integer, DateTime, Boolean, create_engine, event, inspect
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
 from datetime import datetime
+from typing import Optional
 from app.config import settings
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    """Declarative base for ORM models."""
+    pass
 
 
 class ScanRecord(Base):
     """Database model for scan records."""
     __tablename__ = "scans"
     
-    scan_id = Column(String, primary_key=True, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    scan_id: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+    timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Quality metrics
-    qc_pass = Column(Boolean)
-    qc_sharpness = Column(Float)
-    qc_brightness = Column(Float)
-    qc_contrast = Column(Float)
+    qc_pass: Mapped[Optional[bool]] = mapped_column(Boolean)
+    qc_sharpness: Mapped[Optional[float]] = mapped_column(Float)
+    qc_brightness: Mapped[Optional[float]] = mapped_column(Float)
+    qc_contrast: Mapped[Optional[float]] = mapped_column(Float)
     
     # Preprocessing
-    tone_cluster = Column(Integer, nullable=True)
-    glare_coverage = Column(Float, nullable=True)
+    tone_cluster: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    glare_coverage: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     
     # Prediction
-    hb_value = Column(Float, nullable=True)
-    hb_ci_lower = Column(Float, nullable=True)
-    hb_ci_upper = Column(Float, nullable=True)
-    uncertainty = Column(Float, nullable=True)
-    anemia_stage = Column(String, nullable=True)
-    risk_score = Column(Float, nullable=True)
+    hb_value: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    hb_ci_lower: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    hb_ci_upper: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    uncertainty: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    anemia_stage: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    risk_score: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     
     # Metadata
-    device_model = Column(String, nullable=True)
-    model_version = Column(String)
+    device_model: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    model_version: Mapped[Optional[str]] = mapped_column(String)
     
     # Full response (JSON)
-    response_data = Column(JSON)
+    response_data: Mapped[Optional[dict]] = mapped_column(JSON)
 
 
 # Create engine and session
@@ -49,12 +52,25 @@ engine = create_engine(
     connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
 )
 
+if "sqlite" in settings.database_url:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Use WAL so readers and writers don't block, and skip per-commit fsync."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
 def init_db():
-    """Initialize database tables."""
-    Base.metadata.create_all(bind=engine)
+    """Initialize database tables (a single table probe when they already exist)."""
+    if not inspect(engine).has_table(ScanRecord.__tablename__):
+        Base.metadata.create_all(bind=engine)
 
 
 def get_db():
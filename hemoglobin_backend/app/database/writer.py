@@ -0,0 +1,242 @@
+"""
+Batched, asynchronous persistence of scan records.
+"""
+import asyncio
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from fastapi import BackgroundTasks
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.database.models import SessionLocal
+from app.database.crud import create_scan_record, create_scan_records_bulk
+from app.schemas import ScanResponse
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ScanRecordWriter:
+    """
+    Buffer scan records and insert them in batches.
+    
+    Records are flushed when max_batch_size is reached or flush_interval
+    seconds after the first buffered record, whichever comes first. Records
+    waiting to be flushed stay readable through get_pending().
+    
+    If a bulk insert fails, the batch is inserted record by record so one
+    bad row doesn't take the others with it. Records that still fail are
+    retried up to max_retries times, retry_delay seconds apart; duplicate
+    scan IDs (IntegrityError) are not retried.
+    """
+    
+    def __init__(
+        self,
+        max_batch_size: int = 32,
+        flush_interval: float = 0.05,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        session_factory: Callable[[], Session] = SessionLocal
+    ):
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, ScanResponse] = {}
+        self._attempts: Dict[str, int] = {}
+    
+    @property
+    def running(self) -> bool:
+        """Whether the background flush task is active."""
+        return self._task is not None and not self._task.done()
+    
+    async def start(self):
+        """Start the background flush task (call from app startup)."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Scan record writer started")
+    
+    async def stop(self):
+        """Flush buffered records and stop the background task."""
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Scan record writer stopped")
+    
+    async def submit(self, scan_data: ScanResponse, background_tasks: Optional[BackgroundTasks] = None):
+        """
+        Queue a scan record for insertion.
+        
+        When the writer isn't running (e.g. the app was started without
+        lifespan events) the record is written by background_tasks after
+        the response is sent, or before returning if none are given.
+        
+        Args:
+            scan_data: Scan response data
+            background_tasks: Request background tasks
+        """
+        self._pending[scan_data.scan_id] = scan_data
+        
+        if not self.running:
+            if background_tasks is not None:
+                background_tasks.add_task(self._write_detached, scan_data)
+            else:
+                await self._write_detached(scan_data)
+            return
+        
+        await self._queue.put(scan_data)
+    
+    def get_pending(self, scan_id: str) -> Optional[ScanResponse]:
+        """
+        Get a scan that has been submitted but not yet flushed.
+        
+        Args:
+            scan_id: Scan ID
+        
+        Returns:
+            ScanResponse if still buffered, None otherwise
+        """
+        return self._pending.get(scan_id)
+    
+    async def _run(self):
+        """Collect records into batches and flush them off the event loop."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                failed = await run_in_threadpool(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} scan records: {e}", exc_info=True)
+                failed = [(scan_data, e) for scan_data in batch]
+            
+            # Requeue before marking the batch done so stop() keeps waiting
+            requeued = self._requeue_failed(failed)
+            for scan_data in batch:
+                if id(scan_data) not in requeued:
+                    self._pending.pop(scan_data.scan_id, None)
+                    self._attempts.pop(scan_data.scan_id, None)
+                self._queue.task_done()
+            
+            if requeued:
+                await asyncio.sleep(self.retry_delay)
+    
+    def _requeue_failed(self, failed: List[Tuple[ScanResponse, Exception]]) -> Set[int]:
+        """
+        Put failed records back on the queue while they have retries left.
+        
+        Args:
+            failed: (record, error) pairs from the last flush
+        
+        Returns:
+            ids (id()) of the requeued record objects
+        """
+        requeued = set()
+        for scan_data, error in failed:
+            attempts = self._attempts.get(scan_data.scan_id, 0) + 1
+            if self._give_up(scan_data, error, attempts):
+                continue
+            self._attempts[scan_data.scan_id] = attempts
+            self._queue.put_nowait(scan_data)
+            requeued.add(id(scan_data))
+        return requeued
+    
+    def _give_up(self, scan_data: ScanResponse, error: Exception, attempts: int) -> bool:
+        """
+        Whether a failed record should be dropped (logging either outcome).
+        
+        Args:
+            scan_data: Record that failed
+            error: Error raised by the insert
+            attempts: Failed attempts so far, including this one
+        
+        Returns:
+            True if the record is dropped, False if it should be retried
+        """
+        if isinstance(error, IntegrityError) or attempts > self.max_retries:
+            logger.error(
+                f"Dropping scan record {scan_data.scan_id} after {attempts} failed attempt(s): {error}",
+                exc_info=error
+            )
+            return True
+        
+        logger.warning(f"Scan record {scan_data.scan_id} failed (attempt {attempts}), retrying: {error}")
+        return False
+    
+    async def _write_detached(self, scan_data: ScanResponse):
+        """Write one record outside the flush task, retrying failures."""
+        try:
+            attempts = 0
+            while True:
+                try:
+                    await run_in_threadpool(self._write_one, scan_data)
+                    return
+                except Exception as e:
+                    attempts += 1
+                    if self._give_up(scan_data, e, attempts):
+                        return
+                await asyncio.sleep(self.retry_delay)
+        finally:
+            self._pending.pop(scan_data.scan_id, None)
+    
+    def _write_batch(self, batch: List[ScanResponse]) -> List[Tuple[ScanResponse, Exception]]:
+        """
+        Insert a batch of records in one transaction.
+        
+        If the bulk insert fails, the records are inserted one at a time.
+        
+        Args:
+            batch: Records to insert
+        
+        Returns:
+            (record, error) for each record that could not be inserted
+        """
+        db = self.session_factory()
+        try:
+            create_scan_records_bulk(db, batch)
+            return []
+        except Exception as e:
+            logger.warning(f"Bulk insert of {len(batch)} scan records failed, inserting one by one: {e}")
+        finally:
+            db.close()
+        
+        failed = []
+        for scan_data in batch:
+            try:
+                self._write_one(scan_data)
+            except Exception as e:
+                failed.append((scan_data, e))
+        return failed
+    
+    def _write_one(self, scan_data: ScanResponse):
+        """Insert a single record."""
+        db = self.session_factory()
+        try:
+            create_scan_record(db, scan_data)
+        finally:
+            db.close()
+
+
+# Global scan record writer
+scan_record_writer = ScanRecordWriter()
@@ -3,9 +3,9 @@ FastAPI application entry point.
 """
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
-from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-import time
+from fastapi.responses import ORJSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from time import perf_counter
 
 import os
 # Disable oneDNN optimizations to fix MKL error on Windows
@@ -16,8 +16,11 @@ os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 from app.config import settings
 from app.routes import scan
 from app.database.models import init_db
+from app.database.writer import scan_record_writer
+from app.services.warmup import warm_up_models
+from app.utils.concurrency import get_cpu_executor, run_cpu_bound, shutdown_cpu_executor
 from app.utils.logger import setup_logger
-from app.utils.monitoring import drift_detector
+from app.utils.monitoring import drift_detector, get_metrics
 
 logger = setup_logger(__name__)
 
@@ -27,19 +30,14 @@ app = FastAPI(
     version=settings.app_version,
     description="Clinical-grade hemoglobin estimation API using nail-bed images",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-        "http://localhost:5173",  # Vite default
-        "http://127.0.0.1:5173",
-        "*"  # Keep wildcard for now as fallback, but specific origins are preferred for credentials
-    ],
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -49,10 +47,10 @@ app.add_middleware(
 # Request timing middleware
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    """Add processing time to response headers."""
-    start_time = time.time()
+    """Add processing time (seconds) to response headers."""
+    start_time = perf_counter()
     response = await call_next(request)
-    process_time = time.time() - start_time
+    process_time = perf_counter() - start_time
     response.headers["X-Process-Time"] = str(process_time)
     return response
 
@@ -62,7 +60,7 @@ async def add_process_time_header(request: Request, call_next):
 async def global_exception_handler(request: Request, exc: Exception):
     """Global exception handler."""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": "Internal server error",
@@ -77,10 +75,21 @@ async def startup_event():
     """Initialize services on startup."""
     logger.info(f"Starting {settings.app_name} v{settings.app_version}")
     
+    # Create storage directories
+    settings.ensure_dirs()
+    
     # Initialize database
     init_db()
+    await scan_record_writer.start()
     logger.info("Database initialized")
     
+    # Thread pool for CPU-bound scan stages
+    get_cpu_executor()
+    
+    # Load models and trace their graphs before the first scan
+    if settings.warmup_models:
+        await run_cpu_bound(warm_up_models)
+    
     # Set baseline drift detection (example values - replace with actual training stats)
     drift_detector.set_baseline('mean_L', mean=180.0, std=15.0)
     drift_detector.set_baseline('ratio_R_G', mean=1.05, std=0.1)
@@ -95,6 +104,11 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown."""
     logger.info("Application shutting down")
+    
+    # Flush buffered scan records
+    await scan_record_writer.stop()
+    
+    shutdown_cpu_executor()
 
 
 # Include routers
@@ -106,13 +120,13 @@ app.include_router(scan.router)
 async def metrics():
     """Prometheus metrics endpoint."""
     if not settings.enable_metrics:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=404,
             content={"error": "Metrics disabled"}
         )
     
     return Response(
-        content=generate_latest(),
+        content=get_metrics(),
         media_type=CONTENT_TYPE_LATEST
     )
 
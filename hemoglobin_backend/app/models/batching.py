@@ -0,0 +1,187 @@
+"""
+Micro-batching of concurrent model inference calls.
+"""
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+Outputs = Union[np.ndarray, Tuple[np.ndarray, ...]]
+
+
+class InferenceBatcher:
+    """
+    Coalesce concurrent inference calls into one forward pass.
+    
+    Callers block in __call__ while a single worker thread collects up to
+    max_batch_size submissions (waiting at most max_wait_ms after the first),
+    concatenates them along the batch axis, runs infer_fn once and hands each
+    caller back its own slice of the outputs. Any error while running the
+    batch or splitting its outputs is raised in every caller of that batch.
+    """
+    
+    def __init__(
+        self,
+        infer_fn: Callable[..., Outputs],
+        name: str,
+        max_batch_size: int = None,
+        max_wait_ms: float = None,
+        timeout_s: Optional[float] = None
+    ):
+        """
+        Initialize batcher.
+        
+        Args:
+            infer_fn: Function mapping input batches to an output batch or a
+                tuple of output batches
+            name: Name used for the worker thread and logs
+            max_batch_size: Maximum submissions per forward pass
+            max_wait_ms: Maximum time to wait for more submissions
+            timeout_s: Maximum time a caller waits for its result
+        """
+        self.infer_fn = infer_fn
+        self.name = name
+        self.max_batch_size = max_batch_size or settings.inference_max_batch_size
+        self.max_wait = (settings.inference_max_wait_ms if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.timeout = settings.inference_timeout_s if timeout_s is None else timeout_s
+        self._queue: queue.Queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+    
+    def __call__(self, *inputs: np.ndarray) -> Outputs:
+        """
+        Run inference on one submission.
+        
+        Args:
+            inputs: Input batches (all with the same leading dimension)
+        
+        Returns:
+            This submission's outputs, structured like infer_fn's
+        
+        Raises:
+            TimeoutError: If no result arrives within the timeout
+        """
+        self._ensure_worker()
+        
+        future = Future()
+        self._queue.put((inputs, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Skipped by the worker if it hasn't picked the submission up yet
+            future.cancel()
+            raise TimeoutError(f"{self.name}: no inference result after {self.timeout:.0f}s")
+    
+    def _ensure_worker(self):
+        """Start the worker thread on first use."""
+        if self._worker is not None:
+            return
+        
+        with self._start_lock:
+            if self._worker is None:
+                worker = threading.Thread(
+                    target=self._run,
+                    name=f"{self.name}-batcher",
+                    daemon=True
+                )
+                worker.start()
+                self._worker = worker
+    
+    def _run(self):
+        """Collect submissions into batches and run them."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(self._queue.get(timeout=timeout))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Keep the worker alive; _process resolves its own errors
+                logger.error(f"{self.name}: batch failed: {e}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def _process(self, batch: List[Tuple[Sequence[np.ndarray], Future]]):
+        """
+        Run one forward pass and distribute the results.
+        
+        Args:
+            batch: (inputs, future) submissions
+        """
+        # Drop submissions whose caller timed out before they were picked up
+        batch = [(inputs, future) for inputs, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        
+        inputs_list = [inputs for inputs, _ in batch]
+        futures = [future for _, future in batch]
+        
+        try:
+            results = self._run_and_split(inputs_list)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        
+        if len(batch) > 1:
+            logger.debug(f"{self.name}: ran {len(batch)} requests in one batch")
+        
+        for future, result in zip(futures, results):
+            future.set_result(result)
+    
+    def _run_and_split(self, inputs_list: List[Sequence[np.ndarray]]) -> List[Outputs]:
+        """
+        Run the forward pass on the concatenated inputs and split the outputs.
+        
+        Args:
+            inputs_list: Inputs of each submission
+        
+        Returns:
+            Each submission's outputs, structured like infer_fn's
+        
+        Raises:
+            ValueError: If an output's leading dimension doesn't match the batch
+        """
+        if len(inputs_list) == 1:
+            stacked = inputs_list[0]
+        else:
+            stacked = [np.concatenate(arrays, axis=0) for arrays in zip(*inputs_list)]
+        
+        outputs = self.infer_fn(*stacked)
+        
+        is_tuple = isinstance(outputs, (tuple, list))
+        outputs = tuple(np.asarray(output) for output in outputs) if is_tuple else (np.asarray(outputs),)
+        
+        sizes = [len(inputs[0]) for inputs in inputs_list]
+        total = sum(sizes)
+        for output in outputs:
+            if output.ndim == 0 or output.shape[0] != total:
+                raise ValueError(
+                    f"{self.name}: output of shape {output.shape} doesn't match the batch of {total}"
+                )
+        
+        split_points = np.cumsum(sizes)[:-1]
+        parts = [np.split(output, split_points) for output in outputs]
+        
+        results = []
+        for i in range(len(inputs_list)):
+            result = tuple(part[i] for part in parts)
+            results.append(result if is_tuple else result[0])
+        return results
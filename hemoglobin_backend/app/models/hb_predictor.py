@@ -5,26 +5,47 @@ import tensorflow as tf
 import keras
 from keras import layers
 import numpy as np
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Union
 from app.config import settings
+from app.schemas import FEATURE_VECTOR_FIELDS, MODEL_FEATURE_DIM, Features
+from app.models.batching import InferenceBatcher
+from app.models.quantization import load_tflite_runner
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
-def build_cnn_backbone(input_shape: Tuple[int, int, int] = (256, 256, 3)) -> keras.Model:
+_CNN_BACKBONES = {
+    'mobilenet_v3_small': lambda **kwargs: keras.applications.MobileNetV3Small(minimalistic=True, **kwargs),
+    'efficientnet_v2_b0': keras.applications.EfficientNetV2B0,
+    'efficientnet_b0': keras.applications.EfficientNetB0,
+}
+
+
+def build_cnn_backbone(
+    input_shape: Tuple[int, int, int] = (256, 256, 3),
+    backbone: str = None
+) -> keras.Model:
     """
     Build CNN backbone for image feature extraction.
-    Using EfficientNetB0 as base.
+    Using MobileNetV3Small (minimalistic) as base by default.
     
     Args:
         input_shape: Input image shape
+        backbone: One of 'mobilenet_v3_small', 'efficientnet_v2_b0',
+            'efficientnet_b0' (defaults to settings.hb_backbone)
         
     Returns:
         Feature extraction model
     """
-    base_model = keras.applications.EfficientNetB0(
+    backbone = backbone or settings.hb_backbone
+    if backbone not in _CNN_BACKBONES:
+        raise ValueError(f"Unknown CNN backbone: {backbone}. Choose from {sorted(_CNN_BACKBONES)}")
+    
+    base_model = _CNN_BACKBONES[backbone](
         include_top=False,
         weights='imagenet',
         input_shape=input_shape,
@@ -62,17 +83,23 @@ def build_mlp_backbone(input_dim: int = 18) -> keras.Model:
 
 def build_hb_predictor(
     image_shape: Tuple[int, int, int] = (256, 256, 3),
-    tabular_dim: int = 18
+    tabular_dim: int = 18,
+    n_heads: int = 5
 ) -> keras.Model:
     """
     Build complete hemoglobin prediction model with dual pathways.
     
+    The Hb regression output is an ensemble of independently initialized
+    heads over the shared fusion features; the spread across heads gives
+    the prediction uncertainty from a single forward pass.
+    
     Args:
         image_shape: Input image shape
         tabular_dim: Number of tabular features
+        n_heads: Number of Hb regression heads in the ensemble
         
     Returns:
-        Compiled model with regression and classification heads
+        Compiled model with regression (batch, n_heads) and classification heads
     """
     # Image pathway
     image_input = keras.Input(shape=image_shape, name='image_input')
@@ -88,12 +115,21 @@ def build_hb_predictor(
     combined = layers.concatenate([image_features, tabular_features])
     
     x = layers.Dense(128, activation='relu')(combined)
-    x = layers.Dropout(0.4)(x, training=True)  # Always on for MC Dropout
+    x = layers.Dropout(0.4)(x)
     x = layers.Dense(64, activation='relu')(x)
-    x = layers.Dropout(0.4)(x, training=True)
+    x = layers.Dropout(0.4)(x)
     
-    # Regression head (Hb in g/dL)
-    hb_output = layers.Dense(1, activation='linear', name='hb_regression')(x)
+    # Regression ensemble (Hb in g/dL), one differently seeded head per member
+    hb_heads = [
+        layers.Dense(
+            1,
+            activation='linear',
+            kernel_initializer=keras.initializers.GlorotUniform(seed=settings.random_seed + i),
+            name=f'hb_head_{i}'
+        )(x)
+        for i in range(n_heads)
+    ]
+    hb_output = layers.Concatenate(name='hb_regression')(hb_heads)
     
     # Classification head (anemia stage: 0=normal, 1=mild, 2=moderate, 3=severe)
     anemia_output = layers.Dense(4, activation='softmax', name='anemia_classification')(x)
@@ -123,75 +159,206 @@ def build_hb_predictor(
     return model
 
 
+def apply_mixed_precision(model: keras.Model, policy_name: str) -> keras.Model:
+    """
+    Rebuild a model under a mixed-precision dtype policy, reusing its weights.
+    
+    Inputs and output heads stay float32 so callers keep feeding and
+    receiving float32 tensors; the variables themselves remain float32.
+    
+    Args:
+        model: Loaded float32 model
+        policy_name: 'mixed_float16' (GPU) or 'mixed_bfloat16' (CPU with BF16 support)
+        
+    Returns:
+        Model computing in reduced precision
+    """
+    keep_float32 = set(model.output_names) | {f'hb_head_{i}' for i in range(model.output_shape[0][-1])}
+    
+    def set_policy(config: dict):
+        for layer in config.get('layers', []):
+            layer_config = layer['config']
+            if (
+                layer['class_name'] != 'InputLayer'
+                and layer_config.get('name') not in keep_float32
+                and 'dtype' in layer_config
+            ):
+                layer_config['dtype'] = policy_name
+            set_policy(layer_config)  # Nested backbones
+    
+    config = model.get_config()
+    set_policy(config)
+    mixed_model = model.__class__.from_config(config)
+    mixed_model.set_weights(model.get_weights())
+    
+    logger.info(f"Hb model running with {policy_name} policy")
+    return mixed_model
+
+
 class HbPredictor:
     """Wrapper class for hemoglobin prediction with uncertainty."""
     
+    # (feature group, feature name) in model input order
+    _FEATURE_SPEC = FEATURE_VECTOR_FIELDS[:MODEL_FEATURE_DIM]
+    
     def __init__(self, model_path: Path = None):
         """
         Initialize Hb predictor.
         
+        Weights are loaded on first use (see ensure_model), so constructing
+        the predictor does not touch the filesystem or build a graph.
+        
         Args:
             model_path: Path to trained model weights
         """
         self.model = None
         self.model_path = model_path or settings.hb_model_path
         self.is_trained = False
+        self.tflite_runner = None
+        self._forward = None
+        self._batcher = InferenceBatcher(self._run_batch, name="hb")
+        self._local = threading.local()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+    
+    def ensure_model(self):
+        """Load the trained model (or select mock predictions) on first use."""
+        if self._loaded:
+            return
         
-        if self.model_path.exists():
-            self.load_model()
-        else:
-            logger.warning(f"Hb model not found at {self.model_path}. Using feature-based mock predictions.")
-            self.model = None
-            self.is_trained = False
+        with self._load_lock:
+            if self._loaded:
+                return
+            
+            if self.model_path.exists():
+                self.load_model()
+            else:
+                logger.warning(f"Hb model not found at {self.model_path}. Using feature-based mock predictions.")
+                self.model = None
+                self.is_trained = False
+            
+            # Quantized serving path (Keras model is kept for Grad-CAM)
+            self.tflite_runner = load_tflite_runner(settings.hb_tflite_path)
+            if self.tflite_runner is not None:
+                self.is_trained = True
+            
+            self._loaded = True
+    
+    def warmup(self):
+        """Load the model and run one blank forward pass to trace its graph."""
+        self.ensure_model()
+        if not self.is_trained:
+            return
+        
+        image_batch = np.zeros((1, settings.roi_size, settings.roi_size, 3), dtype=np.float32)
+        feature_batch = np.zeros((1, len(self._FEATURE_SPEC)), dtype=np.float32)
+        self._batcher(image_batch, feature_batch)
     
     def load_model(self):
         """Load trained model weights."""
         try:
             self.model = keras.models.load_model(str(self.model_path))
+            if settings.hb_mixed_precision:
+                self.model = apply_mixed_precision(self.model, settings.hb_mixed_precision)
             self.is_trained = True
+            self._forward = self._build_forward()
             logger.info(f"Loaded Hb model from {self.model_path}")
         except Exception as e:
             logger.error(f"Failed to load Hb model: {e}")
             logger.warning("Falling back to feature-based mock predictions")
             self.model = None
             self.is_trained = False
+            self._forward = None
+    
+    def _build_forward(self):
+        """
+        Trace a single forward pass over a batch of inputs.
+        
+        The input signature is fixed on everything but the batch dimension,
+        so the graph is traced once and reused for every request.
+        
+        Returns:
+            tf.function mapping (image_batch, feature_batch) to model outputs
+        """
+        image_shape = tuple(self.model.inputs[0].shape[1:])
+        tabular_dim = self.model.inputs[1].shape[-1]
+        model = self.model
+        
+        @tf.function(
+            reduce_retracing=True,
+            input_signature=[
+                tf.TensorSpec(shape=(None, *image_shape), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, tabular_dim), dtype=tf.float32)
+            ]
+        )
+        def forward(image_batch, feature_batch):
+            # Legacy MC Dropout models build their fusion Dropout with
+            # training=True, so an inference-mode call stays stochastic
+            # while BatchNorm keeps its moving statistics.
+            return model([image_batch, feature_batch], training=False)
+        
+        return forward
     
-    def features_to_array(self, features: Dict) -> np.ndarray:
+    def _run_batch(
+        self,
+        image_batch: np.ndarray,
+        feature_batch: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Convert feature dict to numpy array.
+        Run one forward pass.
         
         Args:
-            features: Features object (as dict)
+            image_batch: ROI images (N, H, W, 3), float32, 0-1
+            feature_batch: Tabular features (N, 18)
+            
+        Returns:
+            Tuple of (hb_pred (N, heads), anemia_pred (N, 4))
+        """
+        if self.tflite_runner is not None:
+            outputs = self.tflite_runner(image_input=image_batch, tabular_input=feature_batch)
+            return outputs['hb_regression'], outputs['anemia_classification']
+        
+        if self._forward is None:
+            self._forward = self._build_forward()
+        hb_pred, anemia_pred = self._forward(
+            tf.constant(image_batch),
+            tf.constant(feature_batch)
+        )
+        return hb_pred.numpy(), anemia_pred.numpy()
+    
+    @property
+    def n_hb_heads(self) -> int:
+        """Number of Hb regression heads (1 for legacy MC Dropout models)."""
+        if self.tflite_runner is not None:
+            return int(self.tflite_runner.output_shapes['hb_regression'][-1])
+        return int(self.model.outputs[0].shape[-1])
+    
+    def features_to_array(self, features: Union[Dict, Features]) -> np.ndarray:
+        """
+        Convert features to the model's tabular input array.
+        
+        For a Features object this is a view of a freshly packed vector.
+        For a dict the returned array is a per-thread scratch buffer and is
+        overwritten by the next call on the same thread; copy it if it must
+        outlive the request.
+        
+        Args:
+            features: Features object, or the same as a dict
             
         Returns:
             Feature array (18,)
         """
-        color = features['color']
-        texture = features['texture']
-        vascular = features['vascular']
-        
-        feature_array = np.array([
-            color['mean_L'],
-            color['mean_a'],
-            color['mean_b'],
-            color['mean_R'],
-            color['mean_G'],
-            color['mean_B'],
-            color['ratio_R_G'],
-            color['ratio_R_B'],
-            texture['glcm_contrast'],
-            texture['glcm_homogeneity'],
-            texture['glcm_energy'],
-            texture['lbp_uniformity'],
-            texture['fft_highfreq_power'],
-            vascular['vessel_density'],
-            vascular['mean_thickness'],
-            vascular['orientation_entropy'],
-            color['std_L'],
-            color['ratio_a_L']
-        ], dtype=np.float32)
-        
-        return feature_array
+        if isinstance(features, Features):
+            return features.to_vector()[:MODEL_FEATURE_DIM]
+        
+        buf = getattr(self._local, 'feature_buf', None)
+        if buf is None:
+            buf = self._local.feature_buf = np.empty(len(self._FEATURE_SPEC), dtype=np.float32)
+        
+        for i, (group, name) in enumerate(self._FEATURE_SPEC):
+            buf[i] = features[group][name]
+        
+        return buf
     
     def predict_mock_from_features(
         self,
@@ -240,44 +407,45 @@ class HbPredictor:
         n_passes: int = None
     ) -> Tuple[float, float, float, np.ndarray]:
         """
-        Predict Hb with uncertainty using MC Dropout.
+        Predict Hb with uncertainty.
+        
+        Ensemble models give one sample per regression head from a single
+        forward pass. Legacy single-head models fall back to MC Dropout with
+        n_passes stochastic samples, run as one batch.
         
         Args:
             roi_image: ROI image (H, W, 3), RGB, 0-255
             features: Feature dict
-            n_passes: Number of MC dropout passes
+            n_passes: Number of MC dropout passes (single-head models only)
             
         Returns:
             Tuple of (hb_mean, hb_std, uncertainty, anemia_probs)
         """
+        self.ensure_model()
+        
         # Use mock predictions if model not trained
-        if not self.is_trained or self.model is None:
+        if not self.is_trained or (self.model is None and self.tflite_runner is None):
             logger.info("Using feature-based mock predictions (no trained model)")
             return self.predict_mock_from_features(features)
         
-        n_passes = n_passes or settings.mc_dropout_passes
+        if self.n_hb_heads > 1:
+            n_passes = 1
+        else:
+            n_passes = n_passes or settings.mc_dropout_passes
         
-        # Prepare inputs
-        image_norm = roi_image.astype(np.float32) / 255.0
-        image_batch = np.expand_dims(image_norm, axis=0)
+        # Prepare inputs: tile the sample so all passes run as one batch
+        image_norm = np.multiply(roi_image, np.float32(1.0 / 255.0), dtype=np.float32)
+        image_batch = np.broadcast_to(image_norm[None], (n_passes,) + image_norm.shape)
         
         feature_array = self.features_to_array(features)
-        feature_batch = np.expand_dims(feature_array, axis=0)
-        
-        # Multiple forward passes
-        hb_predictions = []
-        anemia_predictions = []
-        
-        for _ in range(n_passes):
-            hb_pred, anemia_pred = self.model.predict(
-                [image_batch, feature_batch],
-                verbose=0
-            )
-            hb_predictions.append(hb_pred[0, 0])
-            anemia_predictions.append(anemia_pred[0])
-        
-        # Compute statistics
-        hb_predictions = np.array(hb_predictions)
+        feature_batch = np.broadcast_to(feature_array[None], (n_passes,) + feature_array.shape)
+        
+        # Single forward pass over all samples (batched with concurrent requests)
+        hb_pred, anemia_pred = self._batcher(image_batch, feature_batch)
+        
+        # Compute statistics over all (pass, head) samples
+        hb_predictions = hb_pred.reshape(-1)
+        anemia_predictions = anemia_pred
         hb_mean = float(np.mean(hb_predictions))
         hb_std = float(np.std(hb_predictions))
         
@@ -295,12 +463,8 @@ class HbPredictor:
         return hb_mean, hb_std, uncertainty, anemia_probs
 
 
-# Global model instance
-_hb_model = None
-
+# Global model instance (weights load on first prediction)
+@lru_cache(maxsize=1)
 def get_hb_model() -> HbPredictor:
     """Get global Hb predictor instance."""
-    global _hb_model
-    if _hb_model is None:
-        _hb_model = HbPredictor()
-    return _hb_model
+    return HbPredictor()
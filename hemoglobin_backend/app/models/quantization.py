@@ -0,0 +1,274 @@
+"""
+Post-training int8 quantization and TFLite serving for the UNet and Hb models.
+"""
+import argparse
+import threading
+import cv2
+import numpy as np
+import tensorflow as tf
+import keras
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def convert_to_tflite(
+    model: keras.Model,
+    output_path: Path,
+    representative_dataset: Optional[Callable[[], Iterator[List[np.ndarray]]]] = None
+) -> Path:
+    """
+    Convert a Keras model to a quantized TFLite flatbuffer.
+    
+    With a representative dataset, weights and activations are quantized to
+    int8 (float ops are kept where no int8 kernel exists). Without one, only
+    weights are quantized (dynamic-range quantization).
+    
+    Args:
+        model: Trained Keras model
+        output_path: Path to save the .tflite file
+        representative_dataset: Generator factory yielding calibration inputs
+    
+    Returns:
+        Path to the saved model
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    
+    if representative_dataset is not None:
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS,
+            tf.lite.OpsSet.SELECT_TF_OPS  # Random ops in legacy MC Dropout models
+        ]
+    
+    tflite_model = converter.convert()
+    
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_bytes(tflite_model)
+    
+    logger.info(f"Saved quantized TFLite model to {output_path} ({len(tflite_model) / 1e6:.1f} MB)")
+    return output_path
+
+
+def _load_calibration_images(
+    image_dir: Path,
+    pattern: str,
+    image_size: Tuple[int, int],
+    limit: int
+) -> List[np.ndarray]:
+    """
+    Load calibration images as RGB uint8 arrays resized to the model input.
+    
+    Args:
+        image_dir: Directory with saved pipeline outputs
+        pattern: Glob pattern for the images to use
+        image_size: Target (height, width)
+        limit: Maximum number of images
+    
+    Returns:
+        List of images (H, W, 3), RGB, 0-255
+    """
+    images = []
+    for path in sorted(Path(image_dir).glob(pattern))[:limit]:
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        images.append(cv2.resize(image, (image_size[1], image_size[0])))
+    
+    if not images:
+        raise FileNotFoundError(f"No calibration images matching {pattern} in {image_dir}")
+    
+    logger.info(f"Loaded {len(images)} calibration images from {image_dir}")
+    return images
+
+
+def unet_calibration_dataset(
+    model: keras.Model,
+    image_dir: Path,
+    limit: int = 100
+) -> Callable[[], Iterator[List[np.ndarray]]]:
+    """
+    Build a representative dataset from saved preprocessed images.
+    
+    Args:
+        model: UNet model (used for the input shape)
+        image_dir: Directory with *_preprocessed.jpg files
+        limit: Maximum number of images
+    
+    Returns:
+        Generator factory for TFLiteConverter.representative_dataset
+    """
+    height, width = model.inputs[0].shape[1:3]
+    images = _load_calibration_images(image_dir, '*_preprocessed.jpg', (height, width), limit)
+    
+    def dataset():
+        for image in images:
+            yield [image[None].astype(np.float32) / 255.0]
+    
+    return dataset
+
+
+def hb_calibration_dataset(
+    model: keras.Model,
+    image_dir: Path,
+    limit: int = 100
+) -> Callable[[], Iterator[List[np.ndarray]]]:
+    """
+    Build a representative dataset from saved nail-bed ROI crops.
+    
+    Tabular inputs are computed from each crop with the serving feature
+    extractor, so calibration sees the same feature ranges as inference.
+    
+    Args:
+        model: Hb predictor model (used for the input shape)
+        image_dir: Directory with *_roi.png files
+        limit: Maximum number of images
+    
+    Returns:
+        Generator factory for TFLiteConverter.representative_dataset
+    """
+    from app.schemas import MODEL_FEATURE_DIM
+    from app.services.feature_extraction import extract_all_features
+    
+    height, width = model.inputs[0].shape[1:3]
+    images = _load_calibration_images(image_dir, '*_roi.png', (height, width), limit)
+    
+    samples = []
+    for image in images:
+        feature_array = extract_all_features(image).to_vector()[:MODEL_FEATURE_DIM]
+        samples.append((image[None].astype(np.float32) / 255.0, feature_array[None]))
+    
+    def dataset():
+        for image_batch, feature_batch in samples:
+            yield [image_batch, feature_batch]
+    
+    return dataset
+
+
+class TFLiteRunner:
+    """
+    Thread-safe wrapper around a TFLite interpreter for float inference.
+    
+    Uses the serving signature, so inputs and outputs are addressed by their
+    Keras layer names and input batch sizes are resized on demand.
+    """
+    
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        """
+        Load a TFLite model.
+        
+        Args:
+            model_path: Path to .tflite file
+            num_threads: Interpreter threads (None = TFLite default)
+        """
+        self.model_path = Path(model_path)
+        self.interpreter = tf.lite.Interpreter(
+            model_path=str(self.model_path),
+            num_threads=num_threads
+        )
+        self._runner = self.interpreter.get_signature_runner()
+        self.input_names = list(self._runner.get_input_details())
+        self.output_shapes = {
+            name: tuple(detail['shape'])
+            for name, detail in self._runner.get_output_details().items()
+        }
+        self._lock = threading.Lock()
+        
+        logger.info(f"Loaded TFLite model from {self.model_path}")
+    
+    def __call__(self, **inputs: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Run inference.
+        
+        Args:
+            inputs: Input batches keyed by Keras input layer name
+            
+        Returns:
+            Output arrays keyed by Keras output layer name
+        """
+        inputs = {
+            name: np.ascontiguousarray(array, dtype=np.float32)
+            for name, array in inputs.items()
+        }
+        with self._lock:
+            return self._runner(**inputs)
+
+
+def load_tflite_runner(model_path: Path) -> Optional[TFLiteRunner]:
+    """
+    Load a TFLite runner if quantized serving is enabled.
+    
+    Args:
+        model_path: Path to .tflite file
+    
+    Returns:
+        TFLiteRunner, or None to fall back to the Keras FP32 model
+    """
+    if not settings.use_tflite:
+        return None
+    
+    if not model_path.exists():
+        logger.warning(f"TFLite model not found at {model_path}. Using Keras FP32 model.")
+        return None
+    
+    try:
+        return TFLiteRunner(model_path)
+    except Exception as e:
+        logger.error(f"Failed to load TFLite model: {e}")
+        logger.warning("Falling back to Keras FP32 model")
+        return None
+
+
+def main():
+    """Export a trained model as an int8-quantized TFLite artifact."""
+    parser = argparse.ArgumentParser(description="Export int8-quantized TFLite models for serving")
+    parser.add_argument('model', choices=['unet', 'hb'], help="Model to export")
+    parser.add_argument(
+        '--calibration-dir',
+        type=Path,
+        default=settings.processed_dir,
+        help="Directory with saved *_preprocessed.jpg / *_roi.png images"
+    )
+    parser.add_argument('--limit', type=int, default=100, help="Maximum calibration images")
+    parser.add_argument(
+        '--dynamic-range',
+        action='store_true',
+        help="Quantize weights only (no calibration images needed)"
+    )
+    args = parser.parse_args()
+    
+    if args.model == 'unet':
+        from app.models.unet import combined_loss, dice_coefficient, iou_metric
+        model_path, output_path = settings.unet_model_path, settings.unet_tflite_path
+        custom_objects = {
+            'combined_loss': combined_loss,
+            'dice_coefficient': dice_coefficient,
+            'iou_metric': iou_metric
+        }
+        calibration_dataset = unet_calibration_dataset
+    else:
+        model_path, output_path = settings.hb_model_path, settings.hb_tflite_path
+        custom_objects = None
+        calibration_dataset = hb_calibration_dataset
+    
+    if not model_path.exists():
+        raise SystemExit(f"Trained model not found at {model_path}")
+    
+    model = keras.models.load_model(str(model_path), custom_objects=custom_objects)
+    
+    representative_dataset = None
+    if not args.dynamic_range:
+        representative_dataset = calibration_dataset(model, args.calibration_dir, args.limit)
+    
+    convert_to_tflite(model, output_path, representative_dataset)
+
+
+if __name__ == "__main__":
+    main()
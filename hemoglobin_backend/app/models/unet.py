@@ -12,8 +12,12 @@ import keras
 from keras import layers
 from typing import Tuple
 import numpy as np
+import threading
+from functools import lru_cache
 from pathlib import Path
 from app.config import settings
+from app.models.batching import InferenceBatcher
+from app.models.quantization import load_tflite_runner
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -67,13 +71,24 @@ def iou_metric(y_true, y_pred, threshold=0.5):
     return intersection / (union + 1e-6)
 
 
-def build_unet(input_shape: Tuple[int, int, int] = (512, 512, 3), num_classes: int = 1) -> keras.Model:
+def conv_block(x, filters: int):
+    """Two 3x3 ReLU convolutions."""
+    x = layers.Conv2D(filters, (3, 3), activation='relu', padding='same')(x)
+    return layers.Conv2D(filters, (3, 3), activation='relu', padding='same')(x)
+
+
+def build_unet(
+    input_shape: Tuple[int, int, int] = (512, 512, 3),
+    num_classes: int = 1,
+    filters: Tuple[int, ...] = (64, 128, 256, 512)
+) -> keras.Model:
     """
     Build UNet architecture for nail-bed segmentation.
     
     Args:
         input_shape: Input image shape (H, W, C)
         num_classes: Number of output classes (1 for binary)
+        filters: Encoder filter counts per level (bottleneck uses twice the last)
         
     Returns:
         Compiled Keras model
@@ -81,48 +96,23 @@ def build_unet(input_shape: Tuple[int, int, int] = (512, 512, 3), num_classes: i
     inputs = keras.Input(shape=input_shape)
     
     # Encoder
-    c1 = layers.Conv2D(64, (3, 3), activation='relu', padding='same')(inputs)
-    c1 = layers.Conv2D(64, (3, 3), activation='relu', padding='same')(c1)
-    p1 = layers.MaxPooling2D((2, 2))(c1)
-    
-    c2 = layers.Conv2D(128, (3, 3), activation='relu', padding='same')(p1)
-    c2 = layers.Conv2D(128, (3, 3), activation='relu', padding='same')(c2)
-    p2 = layers.MaxPooling2D((2, 2))(c2)
-    
-    c3 = layers.Conv2D(256, (3, 3), activation='relu', padding='same')(p2)
-    c3 = layers.Conv2D(256, (3, 3), activation='relu', padding='same')(c3)
-    p3 = layers.MaxPooling2D((2, 2))(c3)
-    
-    c4 = layers.Conv2D(512, (3, 3), activation='relu', padding='same')(p3)
-    c4 = layers.Conv2D(512, (3, 3), activation='relu', padding='same')(c4)
-    p4 = layers.MaxPooling2D((2, 2))(c4)
+    x = inputs
+    skips = []
+    for f in filters:
+        x = conv_block(x, f)
+        skips.append(x)
+        x = layers.MaxPooling2D((2, 2))(x)
     
     # Bottleneck
-    c5 = layers.Conv2D(1024, (3, 3), activation='relu', padding='same')(p4)
-    c5 = layers.Conv2D(1024, (3, 3), activation='relu', padding='same')(c5)
+    x = conv_block(x, filters[-1] * 2)
     
     # Decoder
-    u6 = layers.Conv2DTranspose(512, (2, 2), strides=(2, 2), padding='same')(c5)
-    u6 = layers.concatenate([u6, c4])
-    c6 = layers.Conv2D(512, (3, 3), activation='relu', padding='same')(u6)
-    c6 = layers.Conv2D(512, (3, 3), activation='relu', padding='same')(c6)
-    
-    u7 = layers.Conv2DTranspose(256, (2, 2), strides=(2, 2), padding='same')(c6)
-    u7 = layers.concatenate([u7, c3])
-    c7 = layers.Conv2D(256, (3, 3), activation='relu', padding='same')(u7)
-    c7 = layers.Conv2D(256, (3, 3), activation='relu', padding='same')(c7)
-    
-    u8 = layers.Conv2DTranspose(128, (2, 2), strides=(2, 2), padding='same')(c7)
-    u8 = layers.concatenate([u8, c2])
-    c8 = layers.Conv2D(128, (3, 3), activation='relu', padding='same')(u8)
-    c8 = layers.Conv2D(128, (3, 3), activation='relu', padding='same')(c8)
-    
-    u9 = layers.Conv2DTranspose(64, (2, 2), strides=(2, 2), padding='same')(c8)
-    u9 = layers.concatenate([u9, c1])
-    c9 = layers.Conv2D(64, (3, 3), activation='relu', padding='same')(u9)
-    c9 = layers.Conv2D(64, (3, 3), activation='relu', padding='same')(c9)
+    for f, skip in zip(reversed(filters), reversed(skips)):
+        x = layers.Conv2DTranspose(f, (2, 2), strides=(2, 2), padding='same')(x)
+        x = layers.concatenate([x, skip])
+        x = conv_block(x, f)
     
-    outputs = layers.Conv2D(num_classes, (1, 1), activation='sigmoid')(c9)
+    outputs = layers.Conv2D(num_classes, (1, 1), activation='sigmoid')(x)
     
     model = keras.Model(inputs=[inputs], outputs=[outputs])
     
@@ -143,17 +133,41 @@ class UNetSegmenter:
         """
         Initialize UNet segmenter.
         
+        Weights are loaded (or the placeholder built) on first use, see
+        ensure_model.
+        
         Args:
             model_path: Path to trained model weights
         """
         self.model = None
         self.model_path = model_path or settings.unet_model_path
+        self.tflite_runner = None
+        self._infer = None
+        self._batcher = InferenceBatcher(self._run_batch, name="unet")
+        self._loaded = False
+        self._load_lock = threading.Lock()
+    
+    def ensure_model(self):
+        """Load the model on first use."""
+        if self._loaded:
+            return
         
-        if self.model_path.exists():
-            self.load_model()
-        else:
-            logger.warning(f"UNet model not found at {self.model_path}. Using placeholder.")
-            self.model = build_unet()
+        with self._load_lock:
+            if self._loaded:
+                return
+            
+            # Quantized serving path; the Keras model is only needed as a fallback
+            self.tflite_runner = load_tflite_runner(settings.unet_tflite_path)
+            if self.tflite_runner is None:
+                if self.model_path.exists():
+                    self.load_model()
+                else:
+                    logger.warning(f"UNet model not found at {self.model_path}. Using placeholder.")
+                    self.model = build_unet()
+                
+                self._infer = self._build_infer()
+            
+            self._loaded = True
     
     def load_model(self):
         """Load trained model weights."""
@@ -172,6 +186,45 @@ class UNetSegmenter:
             logger.warning("Using untrained model")
             self.model = build_unet()
     
+    def _build_infer(self):
+        """
+        Trace batched inference once for the model's input shape.
+        
+        With settings.unet_jit_compile the graph is compiled by XLA, which
+        fuses the conv/BN/ReLU chains and skip concatenations into a few
+        kernels (compiled once per batch size seen).
+        
+        Returns:
+            tf.function mapping a (N, H, W, 3) batch to the predicted masks
+        """
+        input_shape = tuple(self.model.inputs[0].shape[1:])
+        model = self.model
+        
+        @tf.function(
+            input_signature=[tf.TensorSpec(shape=(None, *input_shape), dtype=tf.float32)],
+            jit_compile=settings.unet_jit_compile
+        )
+        def infer(image_batch):
+            return model(image_batch, training=False)
+        
+        return infer
+    
+    def _run_batch(self, image_batch: np.ndarray) -> np.ndarray:
+        """
+        Run one forward pass over a batch of normalized images.
+        
+        Args:
+            image_batch: Images (N, H, W, 3), float32, 0-1
+            
+        Returns:
+            Masks (N, H, W, 1)
+        """
+        if self.tflite_runner is not None:
+            outputs = self.tflite_runner(**{self.tflite_runner.input_names[0]: image_batch})
+            return next(iter(outputs.values()))
+        
+        return self._infer(tf.constant(image_batch)).numpy()
+    
     def predict(self, image: np.ndarray) -> np.ndarray:
         """
         Predict segmentation mask.
@@ -182,25 +235,23 @@ class UNetSegmenter:
         Returns:
             Binary mask (H, W), values 0-1
         """
+        self.ensure_model()
+        
         # Normalize to [0, 1]
-        image_norm = image.astype(np.float32) / 255.0
+        image_norm = np.multiply(image, np.float32(1.0 / 255.0), dtype=np.float32)
         
         # Add batch dimension
         image_batch = np.expand_dims(image_norm, axis=0)
         
-        # Predict
-        mask_pred = self.model.predict(image_batch, verbose=0)[0, :, :, 0]
+        # Predict (batched with concurrent requests)
+        mask_pred = self._batcher(image_batch)[0, :, :, 0]
         
         logger.debug(f"Predicted mask: shape={mask_pred.shape}, range=[{mask_pred.min():.3f}, {mask_pred.max():.3f}]")
         return mask_pred
 
 
-# Global model instance (lazy loaded)
-_unet_model = None
-
+# Global model instance (weights load on first prediction)
+@lru_cache(maxsize=1)
 def get_unet_model() -> UNetSegmenter:
     """Get global UNet model instance."""
-    global _unet_model
-    if _unet_model is None:
-        _unet_model = UNetSegmenter()
-    return _unet_model
+    return UNetSegmenter()
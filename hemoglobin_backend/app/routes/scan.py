@@ -1,27 +1,35 @@
 """
 API routes for scan endpoints.
 """
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Response
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, Depends, HTTPException, Response
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from pathlib import Path
-from PIL import Image
-import io
+import asyncio
+import aiofiles
+import threading
+from typing import Dict, Optional, Tuple
+import uuid
+import cv2
+import numpy as np
 import time
-import base64
+import pybase64
 from datetime import datetime
 
-from app.schemas import ScanResponse, ScanRequest, ErrorResponse
+from app.schemas import INLINE_IMAGE_FIELDS, ScanResponse, ScanRequest, ErrorResponse
 from app.database.models import get_db
-from app.database.crud import create_scan_record, get_scan_record
+from app.database.crud import get_scan_record
+from app.database.writer import scan_record_writer
 from app.services.validation import validate_upload, ValidationError
 from app.services.quality_control import assess_quality
 from app.services.preprocessing import preprocess_image
 from app.services.segmentation import segment_nail_bed
 from app.services.feature_extraction import extract_all_features
+from app.services.roi_context import ROIContext
 from app.services.prediction import predict_hemoglobin
 from app.services.explainability import generate_explainability
 from app.services.report_generator import create_clinical_report
+from app.utils.concurrency import run_cpu_bound
 from app.utils.security import generate_scan_id
 from app.utils.monitoring import (
     scan_requests_total,
@@ -37,39 +45,168 @@ logger = setup_logger(__name__)
 
 router = APIRouter(prefix="/api/v1", tags=["scans"])
 
+JPEG_QUALITY = 85
+
+# Per-thread RGB->BGR scratch buffer for JPEG encoding. Larger images get a
+# temporary array, so no worker thread holds more than the cap
+_bgr_buffers = threading.local()
+_BGR_BUFFER_MAX_BYTES = 4 * 1024 * 1024
+
+# Duration histogram per pipeline stage, resolved once rather than per request
+_STAGE_HISTS = {
+    stage: scan_duration_seconds.labels(stage=stage)
+    for stage in (
+        'validation', 'quality_control', 'preprocessing', 'segmentation',
+        'feature_extraction', 'prediction', 'explainability'
+    )
+}
+
+# Scan request counter per status, resolved once like the stage histograms
+_STATUS_COUNTERS = {
+    status: scan_requests_total.labels(status=status)
+    for status in ('success', 'high_uncertainty', 'qc_failed', 'validation_error', 'error')
+}
+
+# (report section, base64 field, image kind) for images re-attached on request
+_INLINE_IMAGES = (
+    ('preprocessing', 'original_image_base64', 'original'),
+    ('preprocessing', 'preprocessed_image_base64', 'preprocessed'),
+    ('segmentation', 'roi_image_base64', 'roi'),
+    ('explainability', 'gradcam_nail_overlay', 'gradcam'),
+    ('explainability', 'feature_importance_plot', 'importance')
+)
+
+
+def _to_bgr(image: np.ndarray) -> np.ndarray:
+    """
+    Convert an RGB image to BGR in a per-thread scratch buffer.
+    
+    The buffer grows to the largest image seen, up to
+    _BGR_BUFFER_MAX_BYTES, and is reused by later encodes on the same
+    thread. Larger images are converted into a new array instead.
+    
+    Args:
+        image: Image (H, W, 3), RGB, uint8
+        
+    Returns:
+        BGR image, possibly a view into the buffer that is valid until the
+        next call on this thread
+    """
+    if image.size > _BGR_BUFFER_MAX_BYTES:
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    
+    buffer = getattr(_bgr_buffers, 'buffer', None)
+    if buffer is None or buffer.size < image.size:
+        buffer = _bgr_buffers.buffer = np.empty(image.size, dtype=np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2BGR, dst=buffer[:image.size].reshape(image.shape))
+
+
+def _save_jpeg(
+    image: np.ndarray,
+    save_path: Optional[Path] = None,
+    return_base64: bool = False
+) -> Optional[str]:
+    """
+    Encode an image as JPEG once, optionally writing the bytes to disk.
+    
+    Args:
+        image: Image (H, W, 3), RGB, 0-255
+        save_path: Optional path to save the JPEG
+        return_base64: Whether to also return the JPEG base64-encoded
+        
+    Returns:
+        Base64-encoded JPEG if requested, None otherwise
+    """
+    ok, encoded = cv2.imencode('.jpg', _to_bgr(image), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    
+    if save_path is not None:
+        save_path.write_bytes(encoded)
+    
+    if return_base64:
+        return pybase64.b64encode_as_string(encoded)
+    return None
+
+
+def _json_response(scan_response: ScanResponse) -> Response:
+    """
+    Serialize a scan once in pydantic-core.
+    
+    Returning a Response skips FastAPI's re-validation and re-encoding of
+    the response model; the route's response_model still documents it.
+    
+    Args:
+        scan_response: Scan analysis results
+        
+    Returns:
+        JSON response
+    """
+    return Response(content=scan_response.model_dump_json(), media_type='application/json')
+
+
+def _save_image_bytes(images: Dict[str, bytes], image_paths: Dict[str, Tuple[Path, str]]):
+    """
+    Write already-encoded images to their scan files.
+    
+    Args:
+        images: Encoded image bytes by image kind
+        image_paths: Saved image files by kind, from _scan_image_paths
+    """
+    for kind, data in images.items():
+        image_paths[kind][0].write_bytes(data)
+
+
+def _scan_image_paths(scan_id: str) -> Dict[str, Tuple[Path, str]]:
+    """
+    Saved image files for a scan.
+    
+    Args:
+        scan_id: Scan identifier
+        
+    Returns:
+        Dict of image kind to (path, media type)
+    """
+    return {
+        'original': (settings.upload_dir / f"{scan_id}_original.jpg", 'image/jpeg'),
+        'preprocessed': (settings.processed_dir / f"{scan_id}_preprocessed.jpg", 'image/jpeg'),
+        'roi': (settings.processed_dir / f"{scan_id}_roi.png", 'image/png'),
+        'gradcam': (settings.processed_dir / f"{scan_id}_gradcam.jpg", 'image/jpeg'),
+        'importance': (settings.processed_dir / f"{scan_id}_importance.svg", 'image/svg+xml')
+    }
+
 
 @router.post("/scan", response_model=ScanResponse)
-async def create_scan(
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
-):
+async def create_scan(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     """
     Upload and analyze nail-bed image for hemoglobin estimation.
     
     Args:
+        background_tasks: Runs the record write if the batch writer isn't running
         file: Uploaded image file (JPEG/PNG)
-        db: Database session
         
     Returns:
         Complete scan analysis results
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     scan_id = generate_scan_id()
     
+    # Stage durations, observed together once the request finishes
+    timings: Dict[str, float] = {}
+    
     logger.info(f"Processing scan: {scan_id}, filename: {file.filename}")
     
     try:
-        # Read file
-        file_bytes = await file.read()
-        
-        # Validation
-        with scan_duration_seconds.labels(stage='validation').time():
-            pil_image, hand_info = validate_upload(file_bytes, file.filename)
-            logger.info(f"Hand detection: {hand_info}")
+        # Validation (reads the spooled upload file directly, not into memory)
+        t0 = time.perf_counter()
+        image_rgb, hand_info = await run_cpu_bound(validate_upload, file.file, file.filename)
+        timings['validation'] = time.perf_counter() - t0
+        logger.info(f"Hand detection: {hand_info}")
         
         # Quality Control
-        with scan_duration_seconds.labels(stage='quality_control').time():
-            qc_report = assess_quality(pil_image)
+        t0 = time.perf_counter()
+        qc_report = await run_cpu_bound(assess_quality, image_rgb)
+        timings['quality_control'] = time.perf_counter() - t0
         
         # If QC fails, return early
         if not qc_report.quality_pass:
@@ -82,63 +219,65 @@ async def create_scan(
             )
             
             # Save to database
-            create_scan_record(db, scan_response)
+            await scan_record_writer.submit(scan_response, background_tasks)
             
-            scan_requests_total.labels(status='qc_failed').inc()
+            _STATUS_COUNTERS['qc_failed'].inc()
             logger.warning(f"QC failed for scan {scan_id}")
-            return scan_response
+            return _json_response(scan_response)
         
-        # Preprocessing
-        with scan_duration_seconds.labels(stage='preprocessing').time():
-            # Save original
-            original_path = settings.upload_dir / f"{scan_id}_original.jpg"
-            pil_image.save(original_path)
-            
-            # Encode original image as base64
-            original_buffer = io.BytesIO()
-            pil_image.save(original_buffer, format='JPEG')
-            original_base64 = base64.b64encode(original_buffer.getvalue()).decode('utf-8')
-            
-            # Preprocess
-            preprocessed_path = settings.processed_dir / f"{scan_id}_preprocessed.jpg"
-            preprocessed_image, preprocessing_report = preprocess_image(
-                pil_image,
-                save_path=str(preprocessed_path)
-            )
-            
-            # Encode preprocessed image as base64
-            preprocessed_buffer = io.BytesIO()
-            Image.fromarray(preprocessed_image).save(preprocessed_buffer, format='JPEG')
-            preprocessed_base64 = base64.b64encode(preprocessed_buffer.getvalue()).decode('utf-8')
-        
-        # Segmentation
-        with scan_duration_seconds.labels(stage='segmentation').time():
-            roi_image, mask, segmentation_report = segment_nail_bed(
+        # Images are encoded once: saved to disk and, if embedding, returned as base64
+        embed_images = settings.embed_images_base64
+        image_paths = _scan_image_paths(scan_id)
+        
+        # Preprocessing (original is saved while the image is preprocessed)
+        t0 = time.perf_counter()
+        original_base64, (preprocessed_image, preprocessing_report) = await asyncio.gather(
+            run_cpu_bound(_save_jpeg, image_rgb, image_paths['original'][0], embed_images),
+            run_cpu_bound(preprocess_image, image_rgb, quality_report=qc_report)
+        )
+        timings['preprocessing'] = time.perf_counter() - t0
+        
+        # Segmentation (saves the ROI as PNG; preprocessed image is saved alongside)
+        t0 = time.perf_counter()
+        (roi_image, mask, segmentation_report), preprocessed_base64 = await asyncio.gather(
+            run_cpu_bound(
+                segment_nail_bed,
                 preprocessed_image,
                 save_dir=settings.processed_dir,
                 scan_id=scan_id
-            )
-            
-            # Encode ROI image as base64
-            roi_buffer = io.BytesIO()
-            Image.fromarray(roi_image).save(roi_buffer, format='JPEG')
-            roi_base64 = base64.b64encode(roi_buffer.getvalue()).decode('utf-8')
+            ),
+            run_cpu_bound(_save_jpeg, preprocessed_image, image_paths['preprocessed'][0], embed_images)
+        )
+        timings['segmentation'] = time.perf_counter() - t0
         
-        # Feature Extraction
-        with scan_duration_seconds.labels(stage='feature_extraction').time():
-            features = extract_all_features(roi_image, mask)
+        # Feature Extraction (ROI is encoded alongside if embedding). The ROI's
+        # color space conversions are kept for the explainability stage
+        t0 = time.perf_counter()
+        roi_ctx = ROIContext(roi_image)
+        if embed_images:
+            features, roi_base64 = await asyncio.gather(
+                run_cpu_bound(extract_all_features, roi_image, mask, roi_ctx),
+                run_cpu_bound(_save_jpeg, roi_image, None, True)
+            )
+        else:
+            features = await run_cpu_bound(extract_all_features, roi_image, mask, roi_ctx)
+            roi_base64 = None
+        timings['feature_extraction'] = time.perf_counter() - t0
         
         # Update drift detector
-        feature_dict = {
+        drift_detector.update({
             'mean_L': features.color.mean_L,
             'ratio_R_G': features.color.ratio_R_G,
             'vessel_density': features.vascular.vessel_density
-        }
-        drift_detector.update(feature_dict)
+        })
+        
+        # Dumped once, shared by prediction and explainability
+        feature_dict = features.model_dump()
         
         # Prediction
-        with scan_duration_seconds.labels(stage='prediction').time():
-            prediction = predict_hemoglobin(roi_image, features.dict())
+        t0 = time.perf_counter()
+        prediction = await run_cpu_bound(predict_hemoglobin, roi_image, feature_dict)
+        timings['prediction'] = time.perf_counter() - t0
         
         # Record uncertainty
         prediction_uncertainty.observe(prediction.uncertainty)
@@ -146,17 +285,35 @@ async def create_scan(
         # Explainability (only if prediction succeeded)
         explainability = None
         if prediction.hb_g_per_dl is not None:
-            with scan_duration_seconds.labels(stage='explainability').time():
-                explainability = generate_explainability(
-                    roi_image,
-                    features.dict(),
-                    prediction.hb_g_per_dl
-                )
-        
-        # Add base64 images to reports
-        preprocessing_report.original_image_base64 = f"data:image/jpeg;base64,{original_base64}"
-        preprocessing_report.preprocessed_image_base64 = f"data:image/jpeg;base64,{preprocessed_base64}"
-        segmentation_report.roi_image_base64 = f"data:image/jpeg;base64,{roi_base64}"
+            t0 = time.perf_counter()
+            explainability, explainability_images = await run_cpu_bound(
+                generate_explainability,
+                roi_image,
+                feature_dict,
+                prediction.hb_g_per_dl,
+                roi_ctx,
+                embed_images
+            )
+            
+            # Saved so stored scans can serve them without inlining
+            await run_cpu_bound(_save_image_bytes, explainability_images, image_paths)
+            timings['explainability'] = time.perf_counter() - t0
+        
+        # Add image URLs (and base64 images if embedding) to reports
+        image_url = f"{router.prefix}/image/{scan_id}"
+        preprocessing_report.original_image_url = f"{image_url}/original"
+        preprocessing_report.preprocessed_image_url = f"{image_url}/preprocessed"
+        segmentation_report.roi_image_url = f"{image_url}/roi"
+        if explainability is not None:
+            if 'gradcam' in explainability_images:
+                explainability.gradcam_overlay_url = f"{image_url}/gradcam"
+            if 'importance' in explainability_images:
+                explainability.feature_importance_plot_url = f"{image_url}/importance"
+        
+        if embed_images:
+            preprocessing_report.original_image_base64 = f"data:image/jpeg;base64,{original_base64}"
+            preprocessing_report.preprocessed_image_base64 = f"data:image/jpeg;base64,{preprocessed_base64}"
+            segmentation_report.roi_image_base64 = f"data:image/jpeg;base64,{roi_base64}"
         
         # Create response
         scan_response = ScanResponse(
@@ -170,50 +327,99 @@ async def create_scan(
         )
         
         # Save to database
-        create_scan_record(db, scan_response)
+        await scan_record_writer.submit(scan_response, background_tasks)
         
         # Metrics
         status = 'success' if prediction.hb_g_per_dl is not None else 'high_uncertainty'
-        scan_requests_total.labels(status=status).inc()
+        _STATUS_COUNTERS[status].inc()
         
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
         logger.info(f"Scan {scan_id} completed in {duration:.2f}s")
         
-        return scan_response
+        return _json_response(scan_response)
         
     except ValidationError as e:
-        scan_requests_total.labels(status='validation_error').inc()
+        _STATUS_COUNTERS['validation_error'].inc()
         logger.error(f"Validation error for scan {scan_id}: {e}")
         raise HTTPException(status_code=400, detail=str(e))
         
     except Exception as e:
-        scan_requests_total.labels(status='error').inc()
+        _STATUS_COUNTERS['error'].inc()
         logger.error(f"Error processing scan {scan_id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    finally:
+        for stage, elapsed in timings.items():
+            _STAGE_HISTS[stage].observe(elapsed)
 
 
-@router.get("/scan/{scan_id}", response_model=ScanResponse)
-async def get_scan(scan_id: str, db: Session = Depends(get_db)):
+def _load_scan(db: Session, scan_id: str) -> ScanResponse:
     """
-    Retrieve scan results by ID.
+    Load a scan from the write buffer or the database.
     
     Args:
-        scan_id: Scan identifier
         db: Database session
+        scan_id: Scan identifier
         
     Returns:
-        Scan analysis results
+        Stored scan analysis results
     """
+    scan_response = scan_record_writer.get_pending(scan_id)
+    if scan_response is not None:
+        # Same shape as the stored row
+        return ScanResponse.model_validate(scan_response.model_dump(exclude=INLINE_IMAGE_FIELDS))
+    
     record = get_scan_record(db, scan_id)
     
     if not record:
         raise HTTPException(status_code=404, detail=f"Scan {scan_id} not found")
     
-    # Reconstruct response from stored JSON
-    scan_response = ScanResponse(**record.response_data)
+    # Reconstruct response from stored JSON (rows written while the column
+    # was plain text may hold the serialized string instead of a dict)
+    if isinstance(record.response_data, str):
+        return ScanResponse.model_validate_json(record.response_data)
+    return ScanResponse.model_validate(record.response_data)
+
+
+async def _attach_images(scan_response: ScanResponse):
+    """
+    Fill in the base64 images of a stored scan from its saved files.
+    
+    Args:
+        scan_response: Scan loaded without inline images
+    """
+    image_paths = _scan_image_paths(scan_response.scan_id)
+    
+    for section_name, field, kind in _INLINE_IMAGES:
+        section = getattr(scan_response, section_name)
+        path, media_type = image_paths[kind]
+        if section is None or not path.exists():
+            continue
+        
+        async with aiofiles.open(path, 'rb') as f:
+            data = await f.read()
+        setattr(section, field, f"data:{media_type};base64,{pybase64.b64encode_as_string(data)}")
+
+
+@router.get("/scan/{scan_id}", response_model=ScanResponse)
+async def get_scan(scan_id: str, include_images: bool = False, db: Session = Depends(get_db)):
+    """
+    Retrieve scan results by ID.
+    
+    Args:
+        scan_id: Scan identifier
+        include_images: Whether to inline the saved images as base64
+        db: Database session
+        
+    Returns:
+        Scan analysis results
+    """
+    scan_response = _load_scan(db, scan_id)
+    if include_images:
+        await _attach_images(scan_response)
     
     logger.info(f"Retrieved scan: {scan_id}")
-    return scan_response
+    return _json_response(scan_response)
 
 
 @router.get("/report/{scan_id}")
@@ -229,18 +435,14 @@ async def get_report(scan_id: str, db: Session = Depends(get_db)):
         PDF file download
     """
     # Get scan data
-    record = get_scan_record(db, scan_id)
-    
-    if not record:
-        raise HTTPException(status_code=404, detail=f"Scan {scan_id} not found")
-    
-    scan_response = ScanResponse(**record.response_data)
+    scan_response = _load_scan(db, scan_id)
     
     # Generate report
     report_path = settings.processed_dir / f"{scan_id}_report.pdf"
     
     try:
-        create_clinical_report(scan_response, report_path)
+        # ReportLab rendering is CPU-bound; keep it off the event loop
+        await run_cpu_bound(create_clinical_report, scan_response, report_path)
         
         logger.info(f"Generated report for scan: {scan_id}")
         
@@ -255,6 +457,34 @@ async def get_report(scan_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
 
+@router.get("/image/{scan_id}/{kind}")
+async def get_scan_image(scan_id: str, kind: str):
+    """
+    Download a saved scan image.
+    
+    Args:
+        scan_id: Scan identifier
+        kind: 'original', 'preprocessed', 'roi', 'gradcam' or 'importance'
+        
+    Returns:
+        Image file
+    """
+    try:
+        uuid.UUID(scan_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail=f"Scan {scan_id} not found")
+    
+    image = _scan_image_paths(scan_id).get(kind)
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Unknown image type: {kind}")
+    
+    path, media_type = image
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"No {kind} image for scan {scan_id}")
+    
+    return FileResponse(path=str(path), media_type=media_type)
+
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint."""
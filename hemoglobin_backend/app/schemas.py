@@ -1,8 +1,9 @@
 """
 Pydantic schemas for request/response validation.
 """
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
+import numpy as np
 from datetime import datetime
 from enum import Enum
 
@@ -33,6 +34,8 @@ class PreprocessingReport(BaseModel):
     glare_mask_coverage: float = Field(..., description="Fraction of pixels with glare (0-1)")
     original_image_base64: Optional[str] = Field(None, description="Base64 encoded original image")
     preprocessed_image_base64: Optional[str] = Field(None, description="Base64 encoded preprocessed image")
+    original_image_url: Optional[str] = Field(None, description="URL of the saved original image")
+    preprocessed_image_url: Optional[str] = Field(None, description="URL of the saved preprocessed image")
 
 
 class SegmentationReport(BaseModel):
@@ -41,6 +44,7 @@ class SegmentationReport(BaseModel):
     mask_path: str = Field(..., description="Path to saved mask image")
     roi_path: str = Field(..., description="Path to extracted ROI image")
     roi_image_base64: Optional[str] = Field(None, description="Base64 encoded ROI nail bed image")
+    roi_image_url: Optional[str] = Field(None, description="URL of the saved ROI nail bed image")
 
 
 class ColorFeatures(BaseModel):
@@ -76,11 +80,74 @@ class VascularFeatures(BaseModel):
     orientation_entropy: float = Field(..., description="Vessel orientation diversity")
 
 
+# Feature vector layout as (group, name). The first MODEL_FEATURE_DIM entries
+# are the Hb model's tabular input, in its order
+FEATURE_VECTOR_FIELDS = (
+    ('color', 'mean_L'),
+    ('color', 'mean_a'),
+    ('color', 'mean_b'),
+    ('color', 'mean_R'),
+    ('color', 'mean_G'),
+    ('color', 'mean_B'),
+    ('color', 'ratio_R_G'),
+    ('color', 'ratio_R_B'),
+    ('texture', 'glcm_contrast'),
+    ('texture', 'glcm_homogeneity'),
+    ('texture', 'glcm_energy'),
+    ('texture', 'lbp_uniformity'),
+    ('texture', 'fft_highfreq_power'),
+    ('vascular', 'vessel_density'),
+    ('vascular', 'mean_thickness'),
+    ('vascular', 'orientation_entropy'),
+    ('color', 'std_L'),
+    ('color', 'ratio_a_L'),
+    ('texture', 'glcm_entropy'),
+    ('color', 'std_a'),
+    ('color', 'std_b')
+)
+MODEL_FEATURE_DIM = 18
+
+
 class Features(BaseModel):
     """Complete feature set."""
     color: ColorFeatures
     texture: TextureFeatures
     vascular: VascularFeatures
+    
+    def to_vector(self) -> np.ndarray:
+        """
+        Features as one contiguous vector in FEATURE_VECTOR_FIELDS order.
+        
+        Packed from the current field values on every call, so it always
+        reflects the features as they are now.
+        
+        Returns:
+            Feature vector (len(FEATURE_VECTOR_FIELDS),), float32
+        """
+        return np.array(
+            [getattr(getattr(self, group), name) for group, name in FEATURE_VECTOR_FIELDS],
+            dtype=np.float32
+        )
+    
+    @classmethod
+    def from_vector(cls, vector: np.ndarray) -> "Features":
+        """
+        Rebuild a feature set from a vector produced by to_vector.
+        
+        Args:
+            vector: Feature vector in FEATURE_VECTOR_FIELDS order
+            
+        Returns:
+            Features object
+        """
+        groups = {'color': {}, 'texture': {}, 'vascular': {}}
+        for (group, name), value in zip(FEATURE_VECTOR_FIELDS, vector, strict=True):
+            groups[group][name] = float(value)
+        return cls(
+            color=ColorFeatures(**groups['color']),
+            texture=TextureFeatures(**groups['texture']),
+            vascular=VascularFeatures(**groups['vascular'])
+        )
 
 
 class Prediction(BaseModel):
@@ -105,8 +172,10 @@ class FeatureImportance(BaseModel):
 class Explainability(BaseModel):
     """Explainability outputs."""
     gradcam_nail_overlay: Optional[str] = Field(None, description="Base64-encoded Grad-CAM overlay")
+    gradcam_overlay_url: Optional[str] = Field(None, description="URL of the saved Grad-CAM overlay")
     top_features: List[FeatureImportance] = Field(default_factory=list, description="Top contributing features")
     feature_importance_plot: Optional[str] = Field(None, description="Base64-encoded feature importance visualization")
+    feature_importance_plot_url: Optional[str] = Field(None, description="URL of the saved feature importance visualization")
     interpretation: Optional[str] = Field(None, description="Human-readable interpretation")
     method: Optional[str] = Field(None, description="Explainability method used")
 
@@ -131,6 +200,15 @@ class ScanResponse(BaseModel):
     version: VersionInfo = Field(default_factory=VersionInfo)
 
 
+# Base64 image fields per report section; the images are saved as files and
+# these fields are left out of the stored scan JSON
+INLINE_IMAGE_FIELDS = {
+    'preprocessing': {'original_image_base64', 'preprocessed_image_base64'},
+    'segmentation': {'roi_image_base64'},
+    'explainability': {'gradcam_nail_overlay', 'feature_importance_plot'}
+}
+
+
 class ScanRequest(BaseModel):
     """Optional metadata for scan request."""
     device_model: Optional[str] = None
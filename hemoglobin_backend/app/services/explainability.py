@@ -4,17 +4,103 @@ Explainability service with Grad-CAM and SHAP.
 import tensorflow as tf
 import numpy as np
 import cv2
-from typing import List, Optional
-import base64
-from io import BytesIO
-from PIL import Image
+from typing import Dict, List, Optional, Tuple
+import pybase64
+import weakref
+from functools import lru_cache
 from app.schemas import Explainability, FeatureImportance
+from app.config import settings
 from app.models.hb_predictor import get_hb_model
 from app.utils.logger import setup_logger
 from app.services.shap_explainer import get_shap_explainer
+from app.services.roi_context import ROIContext
 
 logger = setup_logger(__name__)
 
+JPEG_QUALITY = 85
+
+# Last conv layer name per model (entries go away with the model)
+_last_conv_layers = weakref.WeakKeyDictionary()
+
+# Traced Grad-CAM steps per model, {layer_name: step} (entries go away with the model)
+_gradcam_steps = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=8)
+def _colormap_lut(colormap: int) -> np.ndarray:
+    """RGB lookup table (256, 1, 3) for an OpenCV colormap, for cv2.LUT."""
+    ramp = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    return cv2.cvtColor(cv2.applyColorMap(ramp, colormap), cv2.COLOR_BGR2RGB)
+
+
+def _get_gradcam_step(model: tf.keras.Model, layer_name: str):
+    """
+    Build the Grad-CAM gradient model for a layer and trace its step once.
+    
+    Steps are kept in _gradcam_steps, keyed weakly by the model, so they are
+    released along with it.
+    
+    Args:
+        model: Trained model
+        layer_name: Target conv layer name
+        
+    Returns:
+        tf.function mapping (image, features) to the raw heatmap (H, W)
+    """
+    model_steps = _gradcam_steps.setdefault(model, {})
+    if layer_name in model_steps:
+        return model_steps[layer_name]
+    
+    grad_model = tf.keras.Model(
+        inputs=model.inputs,
+        outputs=[
+            model.get_layer(layer_name).output,
+            model.output[0]  # Regression output
+        ]
+    )
+    
+    @tf.function(reduce_retracing=True, jit_compile=settings.gradcam_jit_compile)
+    def gradcam_step(image, features):
+        # Normalize in-graph so the caller never materializes a float copy
+        image = tf.cast(image, tf.float32) * (1.0 / 255.0)
+        
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = grad_model([image, features], training=False)
+            loss = tf.reduce_mean(predictions[0])  # Mean over ensemble heads
+        
+        # Gradients of the loss w.r.t. conv layer output, globally average pooled
+        # (reduced in float32 when the model computes in mixed precision)
+        grads = tf.cast(tape.gradient(loss, conv_outputs), tf.float32)
+        conv_outputs = tf.cast(conv_outputs, tf.float32)
+        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+        
+        # Weight the channels by the gradients and average (broadcast)
+        return tf.reduce_mean(conv_outputs[0] * pooled_grads, axis=-1)
+    
+    model_steps[layer_name] = gradcam_step
+    return gradcam_step
+
+
+def _find_last_conv_layer(model: tf.keras.Model) -> Optional[str]:
+    """
+    Name of the model's last convolutional layer, resolved once per model.
+    
+    Args:
+        model: Trained model
+        
+    Returns:
+        Layer name, or None if the model has no convolutional layer
+    """
+    if model in _last_conv_layers:
+        return _last_conv_layers[model]
+    
+    layer_name = next(
+        (layer.name for layer in reversed(model.layers) if 'conv' in layer.name.lower()),
+        None
+    )
+    _last_conv_layers[model] = layer_name
+    return layer_name
+
 
 def compute_gradcam(
     model: tf.keras.Model,
@@ -27,64 +113,52 @@ def compute_gradcam(
     
     Args:
         model: Trained model
-        image: Input image (1, H, W, 3), normalized
+        image: Input image (1, H, W, 3), RGB, 0-255
         features: Tabular features (1, F)
-        layer_name: Target layer name (if None, uses last conv layer)
+        layer_name: Target layer name (if None, uses settings.gradcam_layer
+            or the last conv layer)
         
     Returns:
         Heatmap array (H, W)
     """
-    # Find last convolutional layer if not specified
+    # Configured layer, else the last convolutional layer
     if layer_name is None:
-        for layer in reversed(model.layers):
-            if 'conv' in layer.name.lower():
-                layer_name = layer.name
-                break
+        layer_name = settings.gradcam_layer or _find_last_conv_layer(model)
     
     if layer_name is None:
         logger.warning("No convolutional layer found for Grad-CAM")
         return np.zeros(image.shape[1:3])
     
-    # Create gradient model
-    grad_model = tf.keras.Model(
-        inputs=model.inputs,
-        outputs=[
-            model.get_layer(layer_name).output,
-            model.output[0]  # Regression output
-        ]
-    )
-    
-    # Compute gradients
-    with tf.GradientTape() as tape:
-        conv_outputs, predictions = grad_model([image, features])
-        loss = predictions[0, 0]
-    
-    # Get gradients of the loss w.r.t. conv layer output
-    grads = tape.gradient(loss, conv_outputs)
-    
-    # Global average pooling of gradients
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-    
-    # Weight the channels by the gradients
-    conv_outputs = conv_outputs[0]
-    pooled_grads = pooled_grads.numpy()
-    conv_outputs = conv_outputs.numpy()
-    
-    for i in range(pooled_grads.shape[0]):
-        conv_outputs[:, :, i] *= pooled_grads[i]
-    
-    # Average across channels
-    heatmap = np.mean(conv_outputs, axis=-1)
+    # Forward + backward pass in a cached, traced graph
+    gradcam_step = _get_gradcam_step(model, layer_name)
+    heatmap = gradcam_step(
+        tf.constant(image),
+        tf.constant(features, dtype=tf.float32)
+    ).numpy()
     
     # Normalize to [0, 1]
-    heatmap = np.maximum(heatmap, 0)
-    if heatmap.max() > 0:
-        heatmap /= heatmap.max()
+    np.maximum(heatmap, 0, out=heatmap)
+    heatmap_max = heatmap.max()
+    if heatmap_max > 0:
+        heatmap /= heatmap_max
     
     logger.debug(f"Computed Grad-CAM on layer: {layer_name}")
     return heatmap
 
 
+def warm_up_gradcam():
+    """Trace the Grad-CAM step for the Hb model once on a blank input."""
+    hb_model = get_hb_model()
+    hb_model.ensure_model()
+    if not hb_model.is_trained or hb_model.model is None:
+        return
+    
+    # Same dtypes as generate_explainability, so the traced graph is reused
+    image = np.zeros((1, settings.roi_size, settings.roi_size, 3), dtype=np.uint8)
+    features = np.zeros((1, len(hb_model._FEATURE_SPEC)), dtype=np.float32)
+    compute_gradcam(hb_model.model, image, features)
+
+
 def overlay_heatmap(
     image: np.ndarray,
     heatmap: np.ndarray,
@@ -109,9 +183,8 @@ def overlay_heatmap(
     # Convert to uint8
     heatmap_uint8 = (heatmap_resized * 255).astype(np.uint8)
     
-    # Apply colormap
-    heatmap_colored = cv2.applyColorMap(heatmap_uint8, colormap)
-    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+    # Apply colormap straight to RGB through a cached lookup table
+    heatmap_colored = cv2.LUT(cv2.merge((heatmap_uint8,) * 3), _colormap_lut(colormap))
     
     # Overlay
     overlaid = cv2.addWeighted(image, 1 - alpha, heatmap_colored, alpha, 0)
@@ -119,6 +192,27 @@ def overlay_heatmap(
     return overlaid
 
 
+def encode_jpeg(image: np.ndarray) -> bytes:
+    """
+    Encode a numpy image as JPEG.
+    
+    Args:
+        image: Image array (H, W, 3), RGB, 0-255
+        
+    Returns:
+        JPEG bytes
+    """
+    image = image.astype(np.uint8, copy=False)
+    ok, encoded = cv2.imencode(
+        '.jpg',
+        cv2.cvtColor(image, cv2.COLOR_RGB2BGR),
+        [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    )
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return encoded.tobytes()
+
+
 def image_to_base64(image: np.ndarray) -> str:
     """
     Convert numpy image to base64 string.
@@ -127,20 +221,19 @@ def image_to_base64(image: np.ndarray) -> str:
         image: Image array (H, W, 3), RGB, 0-255
         
     Returns:
-        Base64-encoded PNG string
+        Base64-encoded JPEG data URI
     """
-    pil_image = Image.fromarray(image.astype(np.uint8))
-    buffer = BytesIO()
-    pil_image.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
+    img_str = pybase64.b64encode_as_string(encode_jpeg(image))
+    return f"data:image/jpeg;base64,{img_str}"
 
 
 def generate_explainability(
     roi_image: np.ndarray,
     features: dict,
-    prediction: float
-) -> Explainability:
+    prediction: float,
+    ctx: Optional[ROIContext] = None,
+    embed_images: bool = True
+) -> Tuple[Explainability, Dict[str, bytes]]:
     """
     Generate complete explainability outputs using SHAP.
     
@@ -148,9 +241,12 @@ def generate_explainability(
         roi_image: ROI image (H, W, 3), RGB, 0-255
         features: Feature dictionary
         prediction: Predicted Hb value
+        ctx: Color space cache for the ROI, used by the mock Grad-CAM
+        embed_images: Whether to also inline the images as base64 data URIs
         
     Returns:
-        Explainability object
+        Explainability object, and the encoded images by kind
+        ('gradcam' JPEG, 'importance' SVG) for those that were generated
     """
     # Get SHAP explainer
     shap_explainer = get_shap_explainer()
@@ -159,7 +255,10 @@ def generate_explainability(
     shap_result = shap_explainer.calculate_feature_importance(features)
     
     # Generate visualization
-    feature_plot_base64 = shap_explainer.generate_visualization(shap_result['all_features'])
+    images = {}
+    feature_plot_svg = shap_explainer.render_visualization(shap_result['all_features'])
+    if feature_plot_svg:
+        images['importance'] = feature_plot_svg
     
     # Convert to FeatureImportance schema
     top_features = [
@@ -173,13 +272,12 @@ def generate_explainability(
     ]
     
     # Try to compute Grad-CAM (will use mock if model not trained)
-    gradcam_base64 = None
     try:
         hb_model = get_hb_model()
+        hb_model.ensure_model()
         if hb_model.is_trained and hb_model.model is not None:
             # Use real GradCAM with trained model
-            image_norm = roi_image.astype(np.float32) / 255.0
-            image_batch = np.expand_dims(image_norm, axis=0)
+            image_batch = roi_image[np.newaxis]  # View; normalized in the Grad-CAM graph
             feature_array = hb_model.features_to_array(features)
             feature_batch = np.expand_dims(feature_array, axis=0)
             
@@ -188,32 +286,40 @@ def generate_explainability(
         else:
             # Use mock GradCAM based on color analysis
             from app.services.mock_gradcam import generate_mock_gradcam_heatmap
-            heatmap = generate_mock_gradcam_heatmap(roi_image, features)
+            heatmap = generate_mock_gradcam_heatmap(roi_image, features, ctx)
             logger.info("Generated mock GradCAM (model not trained)")
         
         # Create overlay
         overlaid = overlay_heatmap(roi_image, heatmap, alpha=0.5)
-        gradcam_base64 = image_to_base64(overlaid)
+        images['gradcam'] = encode_jpeg(overlaid)
         
     except Exception as e:
         logger.error(f"GradCAM generation failed: {e}")
         # Even on error, try to create a simple visualization
         try:
             from app.services.mock_gradcam import generate_mock_gradcam_heatmap
-            heatmap = generate_mock_gradcam_heatmap(roi_image, features)
+            heatmap = generate_mock_gradcam_heatmap(roi_image, features, ctx)
             overlaid = overlay_heatmap(roi_image, heatmap, alpha=0.5)
-            gradcam_base64 = image_to_base64(overlaid)
+            images['gradcam'] = encode_jpeg(overlaid)
             logger.info("Generated fallback mock GradCAM")
         except Exception as e2:
             logger.error(f"Fallback GradCAM also failed: {e2}")
     
     explainability = Explainability(
-        gradcam_nail_overlay=gradcam_base64,
         top_features=top_features,
-        feature_importance_plot=feature_plot_base64,
         interpretation=shap_result['interpretation'],
         method=shap_result['method']
     )
     
+    if embed_images:
+        if 'gradcam' in images:
+            explainability.gradcam_nail_overlay = (
+                f"data:image/jpeg;base64,{pybase64.b64encode_as_string(images['gradcam'])}"
+            )
+        if 'importance' in images:
+            explainability.feature_importance_plot = (
+                f"data:image/svg+xml;base64,{pybase64.b64encode_as_string(images['importance'])}"
+            )
+    
     logger.info("Generated SHAP-based explainability outputs")
-    return explainability
+    return explainability, images
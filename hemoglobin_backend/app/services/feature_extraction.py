@@ -2,52 +2,65 @@
 Multi-modal feature extraction: color, texture, and vascularity.
 """
 import cv2
+import math
 import numpy as np
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
-from typing import Dict, Any
+import scipy.fft
+from scipy import ndimage as ndi
+from skimage.feature import graycomatrix
+from functools import lru_cache
+from typing import Dict, Any, Optional
+from app.services.roi_context import ROIContext
 from app.schemas import ColorFeatures, TextureFeatures, VascularFeatures, Features
+from app.config import settings
+from app.utils.concurrency import get_feature_executor
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# GLCM gray levels, with the (i - j)^2 weights for contrast and homogeneity
+GLCM_LEVELS = 16
+_glcm_i, _glcm_j = np.ogrid[:GLCM_LEVELS, :GLCM_LEVELS]
+_GLCM_CONTRAST_WEIGHTS = ((_glcm_i - _glcm_j) ** 2).astype(np.float64)[:, :, np.newaxis, np.newaxis]
+_GLCM_HOMOGENEITY_WEIGHTS = 1.0 / (1.0 + _GLCM_CONTRAST_WEIGHTS)
 
-def extract_color_features(roi: np.ndarray, mask: np.ndarray = None) -> ColorFeatures:
+# Vessel orientation bins over the arctan2 range [-pi, pi]
+ORIENTATION_BINS = 18
+_ORIENTATION_EDGES = np.linspace(-np.pi, np.pi, ORIENTATION_BINS + 1)
+_ORIENTATION_WIDTHS = np.diff(_ORIENTATION_EDGES)
+
+
+def extract_color_features(
+    roi: np.ndarray,
+    mask: np.ndarray = None,
+    lab: Optional[np.ndarray] = None
+) -> ColorFeatures:
     """
     Extract color-based features from ROI.
     
     Args:
         roi: ROI image (H, W, 3), RGB, 0-255
         mask: Optional binary mask to restrict analysis
+        lab: ROI already converted to LAB (converted here if omitted)
         
     Returns:
         ColorFeatures object
     """
-    # Convert to different color spaces
-    lab = cv2.cvtColor(roi, cv2.COLOR_RGB2LAB)
-    hsv = cv2.cvtColor(roi, cv2.COLOR_RGB2HSV)
+    if lab is None:
+        lab = cv2.cvtColor(roi, cv2.COLOR_RGB2LAB)
     
-    # Apply mask if provided
+    # Mask (if provided) is applied inside the reductions, no masked copies
     if mask is not None:
-        mask_resized = cv2.resize(mask, (roi.shape[1], roi.shape[0])) > 0
-        roi_masked = roi[mask_resized]
-        lab_masked = lab[mask_resized]
-    else:
-        roi_masked = roi.reshape(-1, 3)
-        lab_masked = lab.reshape(-1, 3)
+        if mask.shape[:2] != roi.shape[:2]:
+            mask = cv2.resize(mask, (roi.shape[1], roi.shape[0]))
+        mask = np.greater(mask, 0).view(np.uint8)  # 0/1 without a cast copy
     
     # RGB statistics
-    mean_R = float(np.mean(roi_masked[:, 0]))
-    mean_G = float(np.mean(roi_masked[:, 1]))
-    mean_B = float(np.mean(roi_masked[:, 2]))
-    
-    # LAB statistics
-    mean_L = float(np.mean(lab_masked[:, 0]))
-    mean_a = float(np.mean(lab_masked[:, 1]))
-    mean_b = float(np.mean(lab_masked[:, 2]))
+    mean_R, mean_G, mean_B, _ = cv2.mean(roi, mask=mask)
     
-    std_L = float(np.std(lab_masked[:, 0]))
-    std_a = float(np.std(lab_masked[:, 1]))
-    std_b = float(np.std(lab_masked[:, 2]))
+    # LAB statistics (one pass for mean and std per channel)
+    lab_mean, lab_std = cv2.meanStdDev(lab, mask=mask)
+    mean_L, mean_a, mean_b = (float(v) for v in lab_mean.ravel())
+    std_L, std_a, std_b = (float(v) for v in lab_std.ravel())
     
     # Color ratios
     ratio_R_G = mean_R / (mean_G + 1e-6)
@@ -73,23 +86,156 @@ def extract_color_features(roi: np.ndarray, mask: np.ndarray = None) -> ColorFea
     return features
 
 
-def extract_texture_features(roi: np.ndarray, mask: np.ndarray = None) -> TextureFeatures:
+def uniform_lbp_histogram(gray: np.ndarray, n_points: int, radius: float) -> np.ndarray:
+    """
+    Normalized histogram of uniform LBP codes.
+    
+    Same codes as skimage's local_binary_pattern(method='uniform') (bilinear
+    neighbor sampling, zero outside the image), computed one neighbor at a
+    time over the whole image and counted directly, without building the
+    float64 LBP image.
+    
+    Args:
+        gray: Grayscale image (H, W)
+        n_points: Number of circularly symmetric neighbors
+        radius: Radius of the neighbor circle
+        
+    Returns:
+        Code frequencies (n_points + 2,), summing to 1
+    """
+    image = gray.astype(np.float64)
+    h, w = image.shape
+    pad = int(np.ceil(radius))
+    padded = np.zeros((h + 2 * pad, w + 2 * pad))
+    padded[pad:pad + h, pad:pad + w] = image
+    
+    def shifted(dy: int, dx: int) -> np.ndarray:
+        return padded[pad + dy:pad + dy + h, pad + dx:pad + dx + w]
+    
+    angles = 2 * np.pi * np.arange(n_points, dtype=np.float64) / n_points
+    offsets_r = np.round(-radius * np.sin(angles), 5)
+    offsets_c = np.round(radius * np.cos(angles), 5)
+    rows = np.arange(h, dtype=np.float64)
+    cols = np.arange(w, dtype=np.float64)
+    
+    top = np.empty((h, w))
+    bottom = np.empty((h, w))
+    scratch = np.empty((h, w))
+    bit = np.empty((h, w), dtype=bool)
+    prev = np.empty((h, w), dtype=bool)
+    ones = np.zeros((h, w), dtype=np.uint8)
+    changes = np.zeros((h, w), dtype=np.uint8)
+    
+    for k, (r, c) in enumerate(zip(offsets_r, offsets_c)):
+        min_r, max_r = int(np.floor(r)), int(np.ceil(r))
+        min_c, max_c = int(np.floor(c)), int(np.ceil(c))
+        
+        if min_r == max_r and min_c == max_c:
+            np.greater_equal(shifted(min_r, min_c), image, out=bit)
+        else:
+            # Interpolation weights from absolute coordinates, as skimage does
+            # (keeps the >= comparison bit-identical)
+            sample_r = rows + r
+            sample_c = cols + c
+            dr = (sample_r - np.floor(sample_r))[:, np.newaxis]
+            dc = sample_c - np.floor(sample_c)
+            
+            np.multiply(1 - dc, shifted(min_r, min_c), out=top)
+            np.multiply(dc, shifted(min_r, max_c), out=scratch)
+            top += scratch
+            np.multiply(1 - dc, shifted(max_r, min_c), out=bottom)
+            np.multiply(dc, shifted(max_r, max_c), out=scratch)
+            bottom += scratch
+            top *= 1 - dr
+            bottom *= dr
+            top += bottom
+            top -= image
+            np.greater_equal(top, 0, out=bit)
+        
+        # Count set bits and 0/1 transitions between consecutive neighbors
+        ones += bit
+        if k:
+            np.not_equal(bit, prev, out=prev)
+            changes += prev
+        bit, prev = prev, bit
+    
+    # Uniform patterns are labeled by their number of set bits, the rest share one label
+    codes = np.where(changes <= 2, ones, n_points + 1)
+    return np.bincount(codes.ravel(), minlength=n_points + 2) / codes.size
+
+
+@lru_cache(maxsize=16)
+def _high_frequency_weights(h: int, w: int) -> np.ndarray:
+    """
+    Half-spectrum weights for high_frequency_power, per image size.
+    
+    Args:
+        h: Image height
+        w: Image width
+        
+    Returns:
+        Read-only weights (H, W // 2 + 1)
+    """
+    radius = min(h, w) // 4
+    
+    # Integer frequencies of the half spectrum (rows in fftshift's range)
+    freq_y = np.fft.fftfreq(h, 1.0 / h)[:, np.newaxis]
+    freq_x = np.arange(w // 2 + 1)
+    
+    column_weights = np.full(w // 2 + 1, 2.0)
+    column_weights[0] = 1.0
+    if w % 2 == 0:
+        column_weights[-1] = 1.0
+    weights = ((freq_x ** 2 + freq_y ** 2) > radius ** 2) * column_weights
+    weights.flags.writeable = False
+    return weights
+
+
+def high_frequency_power(gray: np.ndarray) -> float:
+    """
+    Mean 2D spectrum magnitude outside a disk of radius min(H, W) // 4.
+    
+    The spectrum of a real image is conjugate-symmetric and so is the disk
+    mask, so only the real-input half spectrum is computed; each column
+    other than the zero and Nyquist frequencies stands for itself and its
+    mirror and is counted twice.
+    
+    Args:
+        gray: Grayscale image (H, W)
+        
+    Returns:
+        Mean high-frequency magnitude
+    """
+    # Single precision is ample for a mean over thousands of magnitudes
+    magnitude = np.abs(scipy.fft.rfft2(gray.astype(np.float32)))
+    weights = _high_frequency_weights(*gray.shape)
+    
+    return float(np.sum(magnitude * weights) / np.sum(weights))
+
+
+def extract_texture_features(
+    roi: np.ndarray,
+    mask: np.ndarray = None,
+    gray: Optional[np.ndarray] = None
+) -> TextureFeatures:
     """
     Extract texture-based features from ROI.
     
     Args:
         roi: ROI image (H, W, 3), RGB, 0-255
         mask: Optional binary mask
+        gray: ROI already converted to grayscale (converted here if omitted)
         
     Returns:
         TextureFeatures object
     """
     # Convert to grayscale
-    gray = cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY)
+    if gray is None:
+        gray = cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY)
     
     # GLCM features
     # Quantize to reduce computation
-    gray_quantized = (gray // 16).astype(np.uint8)
+    gray_quantized = gray >> 4
     
     # Compute GLCM for multiple angles
     distances = [1]
@@ -98,36 +244,26 @@ def extract_texture_features(roi: np.ndarray, mask: np.ndarray = None) -> Textur
         gray_quantized,
         distances=distances,
         angles=angles,
-        levels=16,
+        levels=GLCM_LEVELS,
         symmetric=True,
         normed=True
     )
     
-    # Aggregate across angles
-    glcm_contrast = float(np.mean(graycoprops(glcm, 'contrast')))
-    glcm_homogeneity = float(np.mean(graycoprops(glcm, 'homogeneity')))
-    glcm_energy = float(np.mean(graycoprops(glcm, 'energy')))
+    # Properties per angle straight from the normalized matrices (as
+    # graycoprops computes them), aggregated across angles
+    glcm_contrast = float(np.mean(np.sum(glcm * _GLCM_CONTRAST_WEIGHTS, axis=(0, 1))))
+    glcm_homogeneity = float(np.mean(np.sum(glcm * _GLCM_HOMOGENEITY_WEIGHTS, axis=(0, 1))))
+    glcm_energy = float(np.mean(np.sqrt(np.sum(glcm * glcm, axis=(0, 1)))))
     glcm_entropy = float(-np.sum(glcm * np.log2(glcm + 1e-10)))
     
     # LBP features
     radius = 3
     n_points = 8 * radius
-    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
-    lbp_hist, _ = np.histogram(lbp.ravel(), bins=n_points + 2, range=(0, n_points + 2), density=True)
+    lbp_hist = uniform_lbp_histogram(gray, n_points, radius)
     lbp_uniformity = float(np.sum(lbp_hist ** 2))
     
-    # FFT features (high frequency power)
-    f_transform = np.fft.fft2(gray)
-    f_shift = np.fft.fftshift(f_transform)
-    magnitude = np.abs(f_shift)
-    
-    h, w = magnitude.shape
-    center_h, center_w = h // 2, w // 2
-    radius_fft = min(h, w) // 4
-    
-    y, x = np.ogrid[:h, :w]
-    mask_high_freq = ((x - center_w)**2 + (y - center_h)**2) > radius_fft**2
-    fft_highfreq_power = float(np.mean(magnitude[mask_high_freq]))
+    # FFT features (mean magnitude outside the central low-frequency disk)
+    fft_highfreq_power = high_frequency_power(gray)
     
     features = TextureFeatures(
         glcm_contrast=glcm_contrast,
@@ -142,27 +278,156 @@ def extract_texture_features(roi: np.ndarray, mask: np.ndarray = None) -> Textur
     return features
 
 
-def frangi_filter(image: np.ndarray, scale_range=(1, 3), scale_step=1) -> np.ndarray:
+def _frangi_response(
+    image: np.ndarray,
+    sigma: float,
+    beta: float,
+    gamma: Optional[float],
+    truncate: float,
+    hessian_scale: float = 1.0
+):
+    """
+    Frangi vesselness of an image at one scale.
+    
+    Args:
+        image: Negated grayscale image, float64
+        sigma: Scale (sigma) in the image's own pixel units
+        beta: Blobness sensitivity
+        gamma: Structureness scale (None derives it from this scale)
+        truncate: Gaussian kernel radius, in standard deviations
+        hessian_scale: Factor applied to the Hessian, to express it in the
+            units of another pyramid level
+        
+    Returns:
+        Tuple of (vesselness response, gamma used)
+    """
+    # Hessian from two successive first-order Gaussian derivatives
+    gaussian_sd = sigma / math.sqrt(2)
+    
+    def gaussian(img: np.ndarray, order) -> np.ndarray:
+        return ndi.gaussian_filter(img, gaussian_sd, order=order, mode='reflect', truncate=truncate)
+    
+    grad_r = gaussian(image, (1, 0))
+    grad_c = gaussian(image, (0, 1))
+    h_rr = gaussian(grad_r, (1, 0))
+    h_rc = gaussian(grad_r, (0, 1))
+    h_cc = gaussian(grad_c, (0, 1))
+    if hessian_scale != 1.0:
+        h_rr *= hessian_scale
+        h_rc *= hessian_scale
+        h_cc *= hessian_scale
+    
+    # Eigenvalues, lambda1 the smaller in magnitude
+    half_trace = (h_rr + h_cc) / 2
+    half_gap = np.sqrt(h_rc ** 2 + ((h_rr - h_cc) / 2) ** 2)
+    eig_high = half_trace + half_gap
+    eig_low = half_trace - half_gap
+    low_first = np.abs(eig_low) < np.abs(eig_high)
+    lambda1 = np.where(low_first, eig_low, eig_high)
+    lambda2 = np.where(low_first, eig_high, eig_low)
+    
+    structure = np.sqrt(lambda1 ** 2 + lambda2 ** 2)
+    blobness = np.abs(lambda1) / np.maximum(lambda2, 1e-10)
+    
+    if gamma is None:
+        gamma = structure.max() / 2 or 1.0
+    
+    response = np.exp(-(blobness ** 2) / (2 * beta ** 2))
+    response *= 1.0 - np.exp(-(structure ** 2) / (2 * gamma ** 2))
+    return response, gamma
+
+
+def frangi_filter(
+    image: np.ndarray,
+    scale_range=(1, 3),
+    scale_step=1,
+    pyramid: Optional[bool] = None
+) -> np.ndarray:
     """
     Apply Frangi vesselness filter to enhance vessel-like structures.
     
+    Bit-identical to skimage.filters.frangi(black_ridges=False) with the
+    default alpha, beta and gamma: same Gaussian derivative kernels
+    (including skimage's 100 sigma truncation for sigma <= 1) and the same
+    closed 2x2 eigenvalue form, ordered without a sort. The response
+    saturates on smooth regions, so even last-bit differences move the
+    percentile threshold in extract_vascular_features.
+    
+    With pyramid, each scale is instead filtered on the cv2.pyrDown octave
+    that brings its sigma back under 2 pixels, and the per-octave maxima are
+    carried up with cv2.pyrUp. The kernels stay small at every scale, at the
+    cost of an approximate (smoothed) response for sigma >= 2.
+    
     Args:
         image: Grayscale image
         scale_range: Range of scales (sigma values)
         scale_step: Step between scales
+        pyramid: Use the octave pyramid (defaults to settings.frangi_pyramid)
         
     Returns:
         Vesselness response image
     """
-    from skimage.filters import frangi
+    if pyramid is None:
+        pyramid = settings.frangi_pyramid
     
-    vessel_response = frangi(
-        image,
-        sigmas=range(scale_range[0], scale_range[1] + 1, scale_step),
-        black_ridges=False
-    )
+    beta = 0.5
+    image = -image.astype(np.float64)  # Bright ridges
+    
+    sigmas = range(scale_range[0], scale_range[1] + 1, scale_step)
+    levels = [int(math.log2(sigma)) if pyramid else 0 for sigma in sigmas]
     
-    return vessel_response
+    pyramid_images = [image]
+    for _ in range(max(levels)):
+        pyramid_images.append(cv2.pyrDown(pyramid_images[-1]))
+    level_responses = [np.zeros_like(level_image) for level_image in pyramid_images]
+    
+    # Structureness scale is fixed by the first sigma
+    gamma = None
+    for sigma, level in zip(sigmas, levels):
+        # skimage's kernel radius rule, by the full-resolution sigma
+        truncate = 8 if sigma > 1 else 100
+        
+        # Derivatives on an octave are 2x steeper per level than at full size
+        response, gamma = _frangi_response(
+            pyramid_images[level], sigma / 2 ** level, beta, gamma, truncate, hessian_scale=4.0 ** level
+        )
+        np.maximum(level_responses[level], response, out=level_responses[level])
+    
+    # Carry the coarser octaves' maxima up to full size
+    for level in range(len(level_responses) - 1, 0, -1):
+        finer = level_responses[level - 1]
+        upsampled = cv2.pyrUp(level_responses[level], dstsize=(finer.shape[1], finer.shape[0]))
+        np.maximum(finer, upsampled, out=finer)
+    
+    return level_responses[0]
+
+
+def orientation_histogram(orientations: np.ndarray) -> np.ndarray:
+    """
+    Density histogram of gradient orientations over [-pi, pi].
+    
+    Same binning as np.histogram(bins=18, range=(-pi, pi), density=True):
+    the bin index is computed directly (arctan2 output is always in range),
+    nudged by one where rounding puts a value on the wrong side of an edge,
+    and counted with bincount.
+    
+    Args:
+        orientations: Angles in radians, 1D float64
+        
+    Returns:
+        Bin densities (ORIENTATION_BINS,)
+    """
+    first_edge = _ORIENTATION_EDGES[0]
+    scale = ORIENTATION_BINS / (_ORIENTATION_EDGES[-1] - first_edge)
+    indices = ((orientations - first_edge) * scale).astype(np.intp)
+    np.minimum(indices, ORIENTATION_BINS - 1, out=indices)  # pi goes in the last bin
+    
+    # Edge corrections (within ~1 ULP of a bin edge)
+    indices[orientations < _ORIENTATION_EDGES[indices]] -= 1
+    indices[(orientations >= _ORIENTATION_EDGES[indices + 1]) & (indices != ORIENTATION_BINS - 1)] += 1
+    
+    counts = np.bincount(indices, minlength=ORIENTATION_BINS)
+    return counts / _ORIENTATION_WIDTHS / counts.sum()
 
 
 def extract_vascular_features(roi: np.ndarray, mask: np.ndarray = None) -> VascularFeatures:
@@ -187,25 +452,29 @@ def extract_vascular_features(roi: np.ndarray, mask: np.ndarray = None) -> Vascu
     vessel_mask = vessel_response > threshold
     
     # Vessel density
-    vessel_density = float(np.sum(vessel_mask) / vessel_mask.size)
-    
-    # Vessel thickness (using distance transform on vessel mask)
-    if np.sum(vessel_mask) > 0:
-        dist_transform = cv2.distanceTransform(vessel_mask.astype(np.uint8), cv2.DIST_L2, 5)
-        mean_thickness = float(np.mean(dist_transform[vessel_mask]))
+    vessel_pixels = np.count_nonzero(vessel_mask)
+    vessel_density = float(vessel_pixels / vessel_mask.size)
+    
+    # Vessel thickness (using distance transform on vessel mask). The
+    # distance is zero off the mask, so the full sum is the sum over vessels
+    if vessel_pixels > 0:
+        dist_transform = cv2.distanceTransform(vessel_mask.view(np.uint8), cv2.DIST_L2, 5)
+        mean_thickness = float(dist_transform.sum(dtype=np.float64) / vessel_pixels)
     else:
         mean_thickness = 0.0
     
     # Vessel orientation entropy
-    # Compute gradients
-    sobelx = cv2.Sobel(green_channel, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(green_channel, cv2.CV_64F, 0, 1, ksize=3)
-    orientations = np.arctan2(sobely, sobelx)
+    # Compute gradients (integer-valued, so exact in float32)
+    sobelx = cv2.Sobel(green_channel, cv2.CV_32F, 1, 0, ksize=3)
+    sobely = cv2.Sobel(green_channel, cv2.CV_32F, 0, 1, ksize=3)
     
     # Histogram of orientations (only in vessel regions)
-    if np.sum(vessel_mask) > 0:
-        vessel_orientations = orientations[vessel_mask]
-        hist, _ = np.histogram(vessel_orientations, bins=18, range=(-np.pi, np.pi), density=True)
+    if vessel_pixels > 0:
+        vessel_orientations = np.arctan2(
+            sobely[vessel_mask].astype(np.float64),
+            sobelx[vessel_mask].astype(np.float64)
+        )
+        hist = orientation_histogram(vessel_orientations)
         # Entropy
         hist = hist + 1e-10
         orientation_entropy = float(-np.sum(hist * np.log2(hist)))
@@ -222,20 +491,41 @@ def extract_vascular_features(roi: np.ndarray, mask: np.ndarray = None) -> Vascu
     return features
 
 
-def extract_all_features(roi: np.ndarray, mask: np.ndarray = None) -> Features:
+def extract_all_features(
+    roi: np.ndarray,
+    mask: np.ndarray = None,
+    ctx: Optional[ROIContext] = None
+) -> Features:
     """
     Extract complete feature set from ROI.
     
     Args:
         roi: ROI image (H, W, 3), RGB, 0-255
         mask: Optional binary mask
+        ctx: Color space cache for the ROI, shared with later stages
         
     Returns:
         Features object with all feature types
     """
-    color_features = extract_color_features(roi, mask)
-    texture_features = extract_texture_features(roi, mask)
-    vascular_features = extract_vascular_features(roi, mask)
+    # Color space conversions are done once and shared by the extractors
+    if ctx is None:
+        ctx = ROIContext(roi)
+    
+    lab, gray = ctx.lab, ctx.gray
+    
+    # The extractors only read the ROI and spend most of their time in
+    # OpenCV/NumPy/SciPy kernels that release the GIL, so they run side by side
+    executor = get_feature_executor()
+    if executor is not None:
+        vascular_future = executor.submit(extract_vascular_features, roi, mask)
+        texture_future = executor.submit(extract_texture_features, roi, mask, gray=gray)
+        color_features = extract_color_features(roi, mask, lab=lab)
+        texture_features = texture_future.result()
+        vascular_features = vascular_future.result()
+    else:
+        color_features = extract_color_features(roi, mask, lab=lab)
+        texture_features = extract_texture_features(roi, mask, gray=gray)
+        vascular_features = extract_vascular_features(roi, mask)
     
     features = Features(
         color=color_features,
@@ -2,23 +2,33 @@
 Hand detection service for validating uploaded images contain hands/fingers.
 """
 import cv2
+import threading
 import numpy as np
 import mediapipe as mp
 from typing import Tuple, Dict, Optional
-from PIL import Image
-import io
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
-# Initialize MediaPipe Hands
+# MediaPipe Hands. A graph is not safe to drive from several threads at
+# once, so each worker thread builds and keeps its own
 mp_hands = mp.solutions.hands
-hands_detector = mp_hands.Hands(
-    static_image_mode=True,
-    max_num_hands=2,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
-)
+_thread_local = threading.local()
+
+
+def _get_detector():
+    """Get (creating on first use) the calling thread's MediaPipe Hands graph."""
+    detector = getattr(_thread_local, 'detector', None)
+    if detector is None:
+        detector = mp_hands.Hands(
+            static_image_mode=True,
+            max_num_hands=2,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+        _thread_local.detector = detector
+        logger.debug(f"Created MediaPipe Hands graph for thread {threading.current_thread().name}")
+    return detector
 
 
 class HandDetectionError(Exception):
@@ -37,8 +47,8 @@ def detect_hand_mediapipe(image: np.ndarray) -> Tuple[bool, float, Dict]:
         Tuple of (hand_detected, confidence, detection_info)
     """
     try:
-        # Process image with MediaPipe
-        results = hands_detector.process(image)
+        # Process image with this thread's MediaPipe graph
+        results = _get_detector().process(image)
         
         if results.multi_hand_landmarks:
             num_hands = len(results.multi_hand_landmarks)
@@ -101,11 +111,11 @@ def detect_skin_fallback(image: np.ndarray) -> Tuple[bool, float, Dict]:
         upper_ycrcb = np.array([255, 173, 127], dtype=np.uint8)
         mask_ycrcb = cv2.inRange(ycrcb, lower_ycrcb, upper_ycrcb)
         
-        # Combine masks
-        skin_mask = cv2.bitwise_or(mask_hsv, mask_ycrcb)
+        # Combine masks (in place)
+        skin_mask = cv2.bitwise_or(mask_hsv, mask_ycrcb, dst=mask_hsv)
         
         # Calculate skin percentage
-        skin_pixels = np.sum(skin_mask > 0)
+        skin_pixels = cv2.countNonZero(skin_mask)
         total_pixels = skin_mask.size
         skin_percentage = skin_pixels / total_pixels
         
@@ -128,12 +138,12 @@ def detect_skin_fallback(image: np.ndarray) -> Tuple[bool, float, Dict]:
         return False, 0.0, {'error': str(e), 'method': 'failed'}
 
 
-def validate_hand_in_image(file_bytes: bytes) -> Dict:
+def validate_hand_in_image(image_rgb: np.ndarray) -> Dict:
     """
     Validate that the uploaded image contains a hand.
     
     Args:
-        file_bytes: Raw image bytes
+        image_rgb: Decoded image (H, W, 3), RGB, 0-255
         
     Returns:
         Detection info dictionary
@@ -142,12 +152,6 @@ def validate_hand_in_image(file_bytes: bytes) -> Dict:
         HandDetectionError: If no hand is detected
     """
     try:
-        # Convert bytes to PIL Image
-        pil_image = Image.open(io.BytesIO(file_bytes))
-        
-        # Convert to RGB numpy array
-        image_rgb = np.array(pil_image.convert('RGB'))
-        
         # Detect hand
         hand_detected, confidence, detection_info = detect_hand_mediapipe(image_rgb)
         
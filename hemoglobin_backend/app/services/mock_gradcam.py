@@ -4,13 +4,66 @@ Creates realistic-looking heatmaps based on color analysis.
 """
 import numpy as np
 import cv2
-from typing import Tuple
+from functools import lru_cache
+from typing import Optional, Tuple
+from app.services.roi_context import ROIContext
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 
-def generate_mock_gradcam_heatmap(roi_image: np.ndarray, features: dict) -> np.ndarray:
+def _build_importance_luts() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-pixel importance terms as lookup tables over uint8 channel values.
+    
+    Returns:
+        Tuple of (red + R/G ratio term indexed by R << 8 | G (65536,),
+        saturation term (256, 1), darkness term (256, 1)), float32
+    """
+    norm = np.arange(256, dtype=np.float32) / 255.0
+    
+    # Factor 1: Red channel (blood oxygenation indicator), higher red = more important
+    # Factor 4: Red/Green ratio
+    rg_importance = np.clip(np.divide(norm[:, np.newaxis], norm[np.newaxis, :] + 1e-6) / 2.0, 0, 1)
+    red_rg = (norm[:, np.newaxis] * 0.5 + rg_importance * 0.32).astype(np.float32).ravel()
+    
+    # Factor 2: Saturation (vascular visibility), higher saturation = more important
+    saturation = (norm * 0.3).astype(np.float32).reshape(256, 1)
+    
+    # Factor 3: Inverse lightness (darker = more blood = more important)
+    darkness = ((1.0 - (norm / 255.0)) * 0.45).astype(np.float32).reshape(256, 1)
+    
+    return red_rg, saturation, darkness
+
+
+# Weights match the mock prediction formula
+_RED_RG_LUT, _SATURATION_LUT, _DARKNESS_LUT = _build_importance_luts()
+
+
+@lru_cache(maxsize=16)
+def _center_mask(height: int, width: int) -> np.ndarray:
+    """
+    Center-focused weighting (1 at the center, down to 0.3 at the edges).
+    
+    Cached per ROI size; the returned array is read-only.
+    """
+    y, x = np.ogrid[:height, :width]
+    center_y, center_x = height // 2, width // 2
+    
+    # Distance from center
+    dist_from_center = np.sqrt((x - center_x)**2 + (y - center_y)**2)
+    max_dist = np.sqrt(center_x**2 + center_y**2)
+    center_mask = 1.0 - (dist_from_center / max_dist)
+    center_mask = np.clip(center_mask, 0.3, 1.0)  # Don't completely zero out edges
+    center_mask.flags.writeable = False
+    return center_mask
+
+
+def generate_mock_gradcam_heatmap(
+    roi_image: np.ndarray,
+    features: dict,
+    ctx: Optional[ROIContext] = None
+) -> np.ndarray:
     """
     Generate a mock GradCAM-style heatmap based on color and vascular features.
     
@@ -23,51 +76,25 @@ def generate_mock_gradcam_heatmap(roi_image: np.ndarray, features: dict) -> np.n
     Args:
         roi_image: ROI image (H, W, 3), RGB, 0-255
         features: Feature dictionary with color and vascular data
+        ctx: Color space cache for the ROI (LAB is reused from feature extraction)
         
     Returns:
         Heatmap array (H, W), values 0-1
     """
     try:
-        # Convert to different color spaces for analysis
-        hsv = cv2.cvtColor(roi_image, cv2.COLOR_RGB2HSV)
-        lab = cv2.cvtColor(roi_image, cv2.COLOR_RGB2LAB)
-        
-        # Extract channels
-        h, s, v = cv2.split(hsv)
-        l, a, b = cv2.split(lab)
-        r, g, blue = cv2.split(roi_image)
-        
-        # Normalize to 0-1
-        s_norm = s.astype(np.float32) / 255.0
-        v_norm = v.astype(np.float32) / 255.0
-        r_norm = r.astype(np.float32) / 255.0
-        l_norm = l.astype(np.float32) / 255.0
-        
-        # Create importance map based on multiple factors
+        if ctx is None:
+            ctx = ROIContext(roi_image)
         
-        # Factor 1: Red channel (blood oxygenation indicator)
-        # Higher red = more important
-        red_importance = r_norm
+        # Channels used for analysis
+        saturation = cv2.extractChannel(ctx.hsv, 1)
+        lightness = cv2.extractChannel(ctx.lab, 0)
+        red_green = (roi_image[:, :, 0].astype(np.uint16) << 8) | roi_image[:, :, 1]
         
-        # Factor 2: Saturation (vascular visibility)
-        # Higher saturation = more important
-        sat_importance = s_norm
-        
-        # Factor 3: Inverse lightness (darker = more blood = more important)
-        # Lower L* = more important
-        dark_importance = 1.0 - (l_norm / 255.0)
-        
-        # Factor 4: Red/Green ratio
-        rg_ratio = np.divide(r_norm, g.astype(np.float32) / 255.0 + 1e-6)
-        rg_importance = np.clip(rg_ratio / 2.0, 0, 1)
-        
-        # Combine factors with weights matching the mock prediction formula
-        heatmap = (
-            red_importance * 0.5 +      # Red channel weight
-            sat_importance * 0.3 +       # Saturation weight
-            dark_importance * 0.45 +     # Darkness (inverse L*) weight
-            rg_importance * 0.32         # R/G ratio weight
-        )
+        # Create importance map from the weighted factors, each looked up
+        # from its channel values rather than computed in float passes
+        heatmap = _RED_RG_LUT.take(red_green)
+        heatmap += cv2.LUT(saturation, _SATURATION_LUT)
+        heatmap += cv2.LUT(lightness, _DARKNESS_LUT)
         
         # Normalize to 0-1
         heatmap = heatmap / heatmap.max() if heatmap.max() > 0 else heatmap
@@ -75,19 +102,8 @@ def generate_mock_gradcam_heatmap(roi_image: np.ndarray, features: dict) -> np.n
         # Apply Gaussian blur for smoother visualization
         heatmap = cv2.GaussianBlur(heatmap, (15, 15), 0)
         
-        # Create a center-focused mask (nail bed is typically in center)
-        height, width = heatmap.shape
-        y, x = np.ogrid[:height, :width]
-        center_y, center_x = height // 2, width // 2
-        
-        # Distance from center
-        dist_from_center = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-        max_dist = np.sqrt(center_x**2 + center_y**2)
-        center_mask = 1.0 - (dist_from_center / max_dist)
-        center_mask = np.clip(center_mask, 0.3, 1.0)  # Don't completely zero out edges
-        
-        # Apply center focus
-        heatmap = heatmap * center_mask
+        # Apply center focus (nail bed is typically in center)
+        heatmap = heatmap * _center_mask(*heatmap.shape)
         
         # Enhance contrast
         heatmap = np.power(heatmap, 0.8)  # Gamma correction
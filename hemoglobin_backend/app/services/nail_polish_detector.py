@@ -4,25 +4,68 @@ Detects if nails are painted to ensure accurate hemoglobin estimation.
 """
 import numpy as np
 import cv2
-from PIL import Image
-import io
 from typing import Dict, Tuple
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Natural nails are typically in red/pink range (0-30° or 330-360°). Per
+# OpenCV hue value (0-179, half of 0-360): 1 if in that range, else 0
+_hue_degrees = np.arange(256) / 179.0 * 360.0
+_BIOLOGICAL_HUE_LUT = (
+    ((_hue_degrees >= 0) & (_hue_degrees <= 30)) | ((_hue_degrees >= 330) & (_hue_degrees <= 360))
+).astype(np.uint8)
+
+# Saturation above which the non-biological hue rule applies
+_HUE_RULE_MIN_SATURATION = 0.25
+
+# Detection rules as (triggered, reason, confidence), each a function of
+# the metrics dict
+_POLISH_RULES = (
+    # High saturation (bright colors)
+    (
+        lambda m: m['mean_saturation'] > 0.4,
+        lambda m: f"high saturation ({m['mean_saturation']:.2f})",
+        lambda m: m['mean_saturation']
+    ),
+    # Very low saturation with high uniformity (could be dark polish)
+    (
+        lambda m: m['mean_saturation'] < 0.15 and m['std_saturation'] < 0.05 and m['mean_value'] < 0.3,
+        lambda m: f"dark uniform color (V={m['mean_value']:.2f})",
+        lambda m: 0.7
+    ),
+    # Non-biological hue (not red/pink)
+    (
+        lambda m: m['mean_saturation'] > _HUE_RULE_MIN_SATURATION and m['biological_hue_ratio'] < 0.3,
+        lambda m: f"non-biological hue (bio_ratio={m['biological_hue_ratio']:.2f})",
+        lambda m: 0.8
+    ),
+    # Very bright/neon colors
+    (
+        lambda m: m['mean_value'] > 0.85 and m['mean_saturation'] > 0.5,
+        lambda m: f"bright neon color (V={m['mean_value']:.2f}, S={m['mean_saturation']:.2f})",
+        lambda m: 0.9
+    ),
+    # Very uniform high saturation (typical of polish)
+    (
+        lambda m: m['mean_saturation'] > 0.35 and m['std_saturation'] < 0.08,
+        lambda m: f"uniform high saturation (std={m['std_saturation']:.2f})",
+        lambda m: 0.75
+    )
+)
+
 
 class NailPolishDetectionError(Exception):
     """Exception raised when nail polish is detected."""
     pass
 
 
-def detect_nail_polish(file_bytes: bytes, hand_info: dict) -> Dict:
+def detect_nail_polish(image_rgb: np.ndarray, hand_info: dict) -> Dict:
     """
     Detect if nails are painted by analyzing color characteristics.
     
     Args:
-        file_bytes: Raw image bytes
+        image_rgb: Decoded image (H, W, 3), RGB, 0-255
         hand_info: Hand detection info (currently not used, but available for future enhancement)
         
     Returns:
@@ -36,92 +79,55 @@ def detect_nail_polish(file_bytes: bytes, hand_info: dict) -> Dict:
         NailPolishDetectionError: If nails appear to be painted
     """
     try:
-        # Load image
-        img = Image.open(io.BytesIO(file_bytes))
-        img_array = np.array(img.convert('RGB'))
-        
-        # Convert to HSV color space for better color analysis
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        
         # Analyze the central region (where fingertips typically are)
         # This is a simplified approach - in production, you'd use hand_info to locate exact fingertips
-        height, width = hsv.shape[:2]
+        height, width = image_rgb.shape[:2]
         center_y_start = int(height * 0.3)
         center_y_end = int(height * 0.7)
         center_x_start = int(width * 0.3)
         center_x_end = int(width * 0.7)
         
-        roi = hsv[center_y_start:center_y_end, center_x_start:center_x_end]
-        
-        # Extract HSV channels
-        h_channel = roi[:, :, 0]  # Hue (0-179 in OpenCV)
-        s_channel = roi[:, :, 1]  # Saturation (0-255)
-        v_channel = roi[:, :, 2]  # Value/Brightness (0-255)
-        
-        # Normalize to 0-1 range
-        s_norm = s_channel / 255.0
-        v_norm = v_channel / 255.0
-        
-        # Calculate metrics
-        mean_saturation = float(np.mean(s_norm))
-        mean_value = float(np.mean(v_norm))
-        std_saturation = float(np.std(s_norm))
-        
-        # Calculate hue distribution
-        # Natural nails are typically in red/pink range (0-30° or 330-360°)
-        # In OpenCV, hue is 0-179 (half of 0-360)
-        h_normalized = h_channel / 179.0 * 360.0  # Convert to 0-360 degrees
-        
-        # Count pixels in biological hue range (red/pink: 0-30° or 330-360°)
-        biological_hue_mask = ((h_normalized >= 0) & (h_normalized <= 30)) | \
-                             ((h_normalized >= 330) & (h_normalized <= 360))
-        biological_hue_ratio = float(np.sum(biological_hue_mask) / biological_hue_mask.size)
+        # Convert to HSV color space for better color analysis (only the
+        # analyzed region, the rest of the image is never read)
+        roi = cv2.cvtColor(
+            image_rgb[center_y_start:center_y_end, center_x_start:center_x_end],
+            cv2.COLOR_RGB2HSV
+        )
+        
+        # Saturation and value statistics straight from the uint8 channels
+        # (Saturation and Value/Brightness 0-255, normalized to 0-1)
+        hsv_mean, hsv_std = cv2.meanStdDev(roi)
+        mean_saturation = float(hsv_mean[1, 0]) / 255.0
+        mean_value = float(hsv_mean[2, 0]) / 255.0
+        std_saturation = float(hsv_std[1, 0]) / 255.0
+        
+        # Count pixels in biological hue range (Hue 0-179 in OpenCV). Only the
+        # non-biological hue rule reads it, and only above its saturation
+        # floor, so natural-looking nails skip the hue pass (ratio is None)
+        biological_hue_ratio = None
+        if mean_saturation > _HUE_RULE_MIN_SATURATION:
+            h_channel = cv2.extractChannel(roi, 0)
+            biological_pixels = cv2.countNonZero(cv2.LUT(h_channel, _BIOLOGICAL_HUE_LUT))
+            biological_hue_ratio = biological_pixels / h_channel.size
+        
+        metrics = {
+            'mean_saturation': mean_saturation,
+            'std_saturation': std_saturation,
+            'mean_value': mean_value,
+            'biological_hue_ratio': biological_hue_ratio
+        }
         
         # Detection logic
-        is_painted = False
-        reasons = []
-        confidence = 0.0
-        
-        # Threshold 1: High saturation (bright colors)
-        if mean_saturation > 0.4:
-            is_painted = True
-            reasons.append(f"high saturation ({mean_saturation:.2f})")
-            confidence = max(confidence, mean_saturation)
-        
-        # Threshold 2: Very low saturation with high uniformity (could be dark polish)
-        if mean_saturation < 0.15 and std_saturation < 0.05 and mean_value < 0.3:
-            is_painted = True
-            reasons.append(f"dark uniform color (V={mean_value:.2f})")
-            confidence = max(confidence, 0.7)
-        
-        # Threshold 3: Non-biological hue (not red/pink)
-        if mean_saturation > 0.25 and biological_hue_ratio < 0.3:
-            is_painted = True
-            reasons.append(f"non-biological hue (bio_ratio={biological_hue_ratio:.2f})")
-            confidence = max(confidence, 0.8)
-        
-        # Threshold 4: Very bright/neon colors
-        if mean_value > 0.85 and mean_saturation > 0.5:
-            is_painted = True
-            reasons.append(f"bright neon color (V={mean_value:.2f}, S={mean_saturation:.2f})")
-            confidence = max(confidence, 0.9)
-        
-        # Threshold 5: Very uniform high saturation (typical of polish)
-        if mean_saturation > 0.35 and std_saturation < 0.08:
-            is_painted = True
-            reasons.append(f"uniform high saturation (std={std_saturation:.2f})")
-            confidence = max(confidence, 0.75)
+        triggered = [rule for rule in _POLISH_RULES if rule[0](metrics)]
+        reasons = [reason(metrics) for _, reason, _ in triggered]
+        confidence = max((score(metrics) for _, _, score in triggered), default=0.0)
+        is_painted = bool(triggered)
         
         result = {
             'is_painted': is_painted,
             'confidence': confidence,
             'reason': ', '.join(reasons) if reasons else 'natural nails detected',
-            'metrics': {
-                'mean_saturation': mean_saturation,
-                'std_saturation': std_saturation,
-                'mean_value': mean_value,
-                'biological_hue_ratio': biological_hue_ratio
-            }
+            'metrics': metrics
         }
         
         if is_painted:
@@ -2,6 +2,7 @@
 Prediction service with anemia classification and uncertainty handling.
 """
 import numpy as np
+from functools import lru_cache
 from typing import Optional
 from app.models.hb_predictor import get_hb_model
 from app.schemas import Prediction, AnemiaStage
@@ -32,6 +33,47 @@ def classify_anemia(hb_value: float) -> AnemiaStage:
         return AnemiaStage.SEVERE
 
 
+# Stages in ascending Hb order, one per interval between the thresholds
+_STAGES_ASCENDING = np.array(
+    [AnemiaStage.SEVERE, AnemiaStage.MODERATE, AnemiaStage.MILD, AnemiaStage.NORMAL],
+    dtype=object
+)
+
+
+def classify_anemia_batch(hb_values: np.ndarray) -> np.ndarray:
+    """
+    Classify anemia stages for many Hb values at once.
+    
+    Same thresholds as classify_anemia, looked up with one searchsorted
+    instead of branching per value. NaN fails every comparison in
+    classify_anemia and is SEVERE there; searchsorted would sort it past
+    the last threshold, so it is mapped explicitly.
+    
+    Args:
+        hb_values: Hemoglobin values in g/dL
+        
+    Returns:
+        AnemiaStage array with the shape of hb_values
+    """
+    hb_values = np.asarray(hb_values, dtype=np.float64)
+    thresholds = np.array([
+        settings.anemia_threshold_moderate,
+        settings.anemia_threshold_mild,
+        settings.anemia_threshold_normal
+    ])
+    indices = np.searchsorted(thresholds, hb_values, side='right')
+    indices = np.where(np.isnan(hb_values), 0, indices)  # 0 = SEVERE
+    
+    # Index flat and reshape, so 0-d input gives a 0-d array, not a scalar
+    return _STAGES_ASCENDING[indices.ravel()].reshape(indices.shape)
+
+
+@lru_cache(maxsize=8)
+def _z_score(confidence: float) -> float:
+    """Two-sided standard normal critical value (cached per confidence level)."""
+    return float(stats.norm.ppf((1 + confidence) / 2))
+
+
 def compute_confidence_interval(
     mean: float,
     std: float,
@@ -48,7 +90,7 @@ def compute_confidence_interval(
     Returns:
         Tuple of (lower_bound, upper_bound)
     """
-    z_score = stats.norm.ppf((1 + confidence) / 2)
+    z_score = _z_score(confidence)
     margin = z_score * std
     
     lower = max(0.0, mean - margin)  # Hb can't be negative
@@ -2,16 +2,44 @@
 Image preprocessing pipeline with fairness considerations.
 """
 import cv2
+import threading
 import numpy as np
 from PIL import Image
-from typing import Tuple, Optional
-from sklearn.cluster import KMeans
-from app.schemas import PreprocessingReport
+from typing import Tuple, Optional, Union
+from app.schemas import PreprocessingReport, QualityReport
 from app.config import settings
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Skin tone bins: upper L* edges (OpenCV 0-255 scale) of tone clusters 0-3
+SKIN_TONE_L_EDGES = (80, 120, 160, 200)
+
+# Pixels sampled for skin tone k-means (settings.skin_tone_kmeans)
+SKIN_TONE_SAMPLE_SIZE = 4096
+
+# Telea inpainting neighborhood radius for glare (pixels)
+INPAINT_RADIUS = 3
+
+# OpenCV interpolation per settings.resize_interpolation
+RESIZE_INTERPOLATIONS = {
+    'lanczos4': cv2.INTER_LANCZOS4,
+    'cubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'linear': cv2.INTER_LINEAR
+}
+
+# CLAHE objects keep working buffers between calls, so each thread gets one
+_thread_local = threading.local()
+
+
+def _get_clahe():
+    """Get (creating on first use) the calling thread's CLAHE object."""
+    clahe = getattr(_thread_local, 'clahe', None)
+    if clahe is None:
+        clahe = _thread_local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe
+
 
 def center_crop_and_resize(image: np.ndarray, target_size: int) -> np.ndarray:
     """
@@ -35,12 +63,32 @@ def center_crop_and_resize(image: np.ndarray, target_size: int) -> np.ndarray:
         image = image[:, start:start+h, :]
     
     # Resize
-    resized = cv2.resize(image, (target_size, target_size), interpolation=cv2.INTER_LANCZOS4)
+    resized = cv2.resize(
+        image,
+        (target_size, target_size),
+        interpolation=RESIZE_INTERPOLATIONS[settings.resize_interpolation]
+    )
     
     logger.debug(f"Cropped and resized to {target_size}x{target_size}")
     return resized
 
 
+def _white_balance_table(avg: float) -> np.ndarray:
+    """
+    Gray-world correction of one LAB chroma channel for every (L, value) pair.
+    
+    Args:
+        avg: Image mean of the channel
+        
+    Returns:
+        Corrected values (65536,), uint8, indexed by L << 8 | value
+    """
+    table = np.empty((256, 256), dtype=np.uint8)
+    levels = np.arange(256, dtype=np.uint8)
+    table[:] = levels[np.newaxis, :] - ((avg - 128) * (levels[:, np.newaxis] / 255.0) * 1.1)
+    return table.ravel()
+
+
 def apply_white_balance(image: np.ndarray) -> np.ndarray:
     """
     Apply gray-world white balance correction.
@@ -52,11 +100,15 @@ def apply_white_balance(image: np.ndarray) -> np.ndarray:
         White-balanced image
     """
     result = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    avg_a = np.average(result[:, :, 1])
-    avg_b = np.average(result[:, :, 2])
+    _, avg_a, avg_b, _ = cv2.mean(result)
     
-    result[:, :, 1] = result[:, :, 1] - ((avg_a - 128) * (result[:, :, 0] / 255.0) * 1.1)
-    result[:, :, 2] = result[:, :, 2] - ((avg_b - 128) * (result[:, :, 0] / 255.0) * 1.1)
+    # The corrected a/b value depends only on (L, a/b), so it is looked up
+    # by L << 8 | value from a 256x256 table instead of computed in float
+    l_index = cv2.extractChannel(result, 0).astype(np.uint16) << 8
+    for channel, avg in ((1, avg_a), (2, avg_b)):
+        values = cv2.extractChannel(result, channel)
+        corrected = _white_balance_table(avg).take(l_index | values)
+        cv2.insertChannel(corrected, result, channel)
     
     result = cv2.cvtColor(result, cv2.COLOR_LAB2BGR)
     logger.debug("Applied white balance correction")
@@ -74,36 +126,98 @@ def apply_clahe(image: np.ndarray) -> np.ndarray:
         CLAHE-enhanced image
     """
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    l = clahe.apply(l)
-    
-    enhanced = cv2.merge([l, a, b])
-    enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
+    _clahe_lab(lab)
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
     
     logger.debug("Applied CLAHE enhancement")
     return enhanced
 
 
+def apply_global_histeq(image: np.ndarray) -> np.ndarray:
+    """
+    Apply global histogram equalization on L channel.
+    
+    A single 256-entry LUT built from the L histogram; cheaper than CLAHE,
+    without its per-tile adaptation.
+    
+    Args:
+        image: Input BGR image
+        
+    Returns:
+        Equalized image
+    """
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    _equalize_lab(lab)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+
+def _equalize_lab(lab: np.ndarray):
+    """
+    Equalize the L channel histogram of a LAB image, in place.
+    
+    Args:
+        lab: LAB image (H, W, 3), uint8
+    """
+    l = cv2.extractChannel(lab, 0)
+    cv2.insertChannel(cv2.equalizeHist(l), lab, 0)
+
+
+def _clahe_lab(lab: np.ndarray):
+    """
+    Apply CLAHE to the L channel of a LAB image, in place.
+    
+    Args:
+        lab: LAB image (H, W, 3), uint8
+    """
+    l = cv2.extractChannel(lab, 0)
+    cv2.insertChannel(_get_clahe().apply(l), lab, 0)
+
+
+def _glare_chroma_table() -> np.ndarray:
+    """
+    Per-value chroma limits equivalent to the HSV glare thresholds.
+    
+    Glare is V >= 200 and S <= 50. In HSV, V is the largest channel and S
+    depends only on V and the chroma (largest minus smallest channel), so
+    for each V the condition is chroma < table[V]. The table is derived from
+    OpenCV's own HSV conversion and reproduces its rounding exactly.
+    
+    Returns:
+        Table (256,), uint8: exclusive chroma limit per V (0 below V=200)
+    """
+    value, chroma = np.meshgrid(np.arange(256), np.arange(256), indexing='ij')
+    valid = chroma <= value
+    smallest = np.where(valid, value - chroma, 0).astype(np.uint8)
+    pixels = np.stack([smallest, smallest, value.astype(np.uint8)], axis=-1)
+    hsv = cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV)
+    glare = valid & (hsv[..., 2] >= 200) & (hsv[..., 1] <= 50)
+    # S grows with chroma, so the glare chromas are 0..limit-1 for each V
+    return glare.sum(axis=1).astype(np.uint8)
+
+
+_GLARE_CHROMA_LIMITS = _glare_chroma_table()
+
+
 def detect_glare(image: np.ndarray) -> Tuple[np.ndarray, float]:
     """
     Detect specular highlights/glare using HSV thresholding.
     
+    The HSV thresholds (V >= 200, S <= 50) are evaluated on the channel
+    max/min through _GLARE_CHROMA_LIMITS, without converting to HSV.
+    
     Args:
         image: Input BGR image
         
     Returns:
         Tuple of (glare_mask, coverage_fraction)
     """
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
     # High value, low saturation indicates glare
-    lower = np.array([0, 0, 200])
-    upper = np.array([180, 50, 255])
+    b, g, r = cv2.split(image)
+    value = cv2.max(cv2.max(b, g), r)
+    chroma = cv2.subtract(value, cv2.min(cv2.min(b, g), r))
     
-    glare_mask = cv2.inRange(hsv, lower, upper)
-    coverage = np.sum(glare_mask > 0) / glare_mask.size
+    glare_mask = cv2.compare(chroma, cv2.LUT(value, _GLARE_CHROMA_LIMITS), cv2.CMP_LT)
+    coverage = cv2.countNonZero(glare_mask) / glare_mask.size
     
     logger.debug(f"Glare detection: {coverage:.3f} coverage")
     return glare_mask, float(coverage)
@@ -120,56 +234,178 @@ def inpaint_glare(image: np.ndarray, glare_mask: np.ndarray) -> np.ndarray:
     Returns:
         Inpainted image
     """
-    if np.sum(glare_mask) == 0:
+    # Only the mask's bounding box plus a margin wider than the inpainting
+    # radius is processed; pixels outside it do not affect the result
+    x, y, w, h = cv2.boundingRect(glare_mask)
+    if w == 0:
         return image
     
-    inpainted = cv2.inpaint(image, glare_mask, 3, cv2.INPAINT_TELEA)
+    margin = 2 * INPAINT_RADIUS + 2
+    height, width = glare_mask.shape[:2]
+    x0, y0 = max(x - margin, 0), max(y - margin, 0)
+    x1, y1 = min(x + w + margin, width), min(y + h + margin, height)
+    
+    inpainted = image.copy()
+    inpainted[y0:y1, x0:x1] = cv2.inpaint(
+        image[y0:y1, x0:x1], glare_mask[y0:y1, x0:x1], INPAINT_RADIUS, cv2.INPAINT_TELEA
+    )
     logger.debug("Inpainted glare regions")
     return inpainted
 
 
-def estimate_skin_tone(image: np.ndarray, mask: Optional[np.ndarray] = None) -> Tuple[int, np.ndarray]:
+def _border_strips(lab: np.ndarray) -> list:
+    """
+    Non-overlapping views of the border strips (a tenth of the width).
+    
+    Args:
+        lab: LAB image (H, W, 3)
+        
+    Returns:
+        List of (h, w, 3) views covering the border exactly once
+    """
+    h, w = lab.shape[:2]
+    border_width = w // 10
+    if border_width == 0:
+        return []
+    if 2 * border_width >= h or 2 * border_width >= w:
+        return [lab]
+    return [
+        lab[:border_width],
+        lab[h - border_width:],
+        lab[border_width:h - border_width, :border_width],
+        lab[border_width:h - border_width, w - border_width:]
+    ]
+
+
+def _border_lab_mean(lab: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Mean LAB value of the border strips, without building a mask.
+    
+    Args:
+        lab: LAB image (H, W, 3), uint8
+        
+    Returns:
+        Mean [L, a, b], or None if the border has fewer than 100 pixels
+    """
+    strips = _border_strips(lab)
+    count = sum(strip.shape[0] * strip.shape[1] for strip in strips)
+    if count < 100:
+        return None
+    # Integer channel sums are exact in float64; scaling by the reciprocal
+    # as cv2.mean does gives the same value bit for bit
+    total = np.sum([cv2.sumElems(strip)[:3] for strip in strips], axis=0)
+    return total * (1.0 / count)
+
+
+def _border_region(shape: Tuple[int, int]) -> np.ndarray:
+    """
+    uint8 mask of the border strips (a tenth of the width).
+    
+    Args:
+        shape: Image (H, W)
+        
+    Returns:
+        Mask (H, W), 1 on the border
+    """
+    h, w = shape
+    border_width = w // 10
+    region = np.zeros((h, w), dtype=np.uint8)
+    region[:, :border_width] = 1
+    region[:, -border_width:] = 1
+    region[:border_width, :] = 1
+    region[-border_width:, :] = 1
+    return region
+
+
+def _skin_tone_kmeans_cluster(
+    lab: np.ndarray,
+    region: Optional[np.ndarray],
+    lab_mean: np.ndarray
+) -> int:
+    """
+    Skin tone cluster from k-means on the region's LAB pixels.
+    
+    Args:
+        lab: LAB image (H, W, 3)
+        region: uint8 mask of the pixels to cluster (None for all)
+        lab_mean: Mean LAB value of those pixels
+        
+    Returns:
+        Id of the cluster center nearest to lab_mean (0-4, unordered)
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    
+    pixels = lab[region > 0] if region is not None else lab.reshape(-1, 3)
+    
+    # Cluster into 5 tone groups, fitted on a fixed-seed random sample of the pixels
+    rng = np.random.default_rng(settings.random_seed)
+    if len(pixels) > SKIN_TONE_SAMPLE_SIZE:
+        pixels = pixels[rng.choice(len(pixels), size=SKIN_TONE_SAMPLE_SIZE, replace=False)]
+    kmeans = MiniBatchKMeans(
+        n_clusters=5,
+        batch_size=1024,
+        n_init=3,
+        max_iter=50,
+        random_state=settings.random_seed
+    )
+    kmeans.fit(pixels)
+    
+    return int(np.argmin(np.linalg.norm(kmeans.cluster_centers_ - lab_mean, axis=1)))
+
+
+def estimate_skin_tone(
+    image: np.ndarray,
+    mask: Optional[np.ndarray] = None,
+    lab: Optional[np.ndarray] = None
+) -> Tuple[int, np.ndarray]:
     """
     Estimate skin tone cluster using LAB color space.
     
+    The cluster is the lightness bin of the mean L* (0 darkest to 4
+    lightest), or with settings.skin_tone_kmeans the nearest of 5 k-means
+    clusters fitted to the pixels.
+    
     Args:
         image: Input BGR image
         mask: Optional mask for skin regions (if None, uses whole image)
+        lab: Optional precomputed LAB conversion of image
         
     Returns:
         Tuple of (cluster_id, lab_mean)
     """
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    if lab is None:
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
     
     if mask is not None:
-        pixels = lab[mask > 0]
+        region = np.greater(mask, 0).view(np.uint8)
+        if cv2.countNonZero(region) < 100:
+            region = None  # Whole image
+        lab_mean = np.array(cv2.mean(lab, mask=region)[:3])
     else:
         # Sample from border regions (likely skin around nail)
-        h, w = lab.shape[:2]
-        border_width = w // 10
-        border_mask = np.zeros((h, w), dtype=bool)
-        border_mask[:, :border_width] = True
-        border_mask[:, -border_width:] = True
-        border_mask[:border_width, :] = True
-        border_mask[-border_width:, :] = True
-        pixels = lab[border_mask]
-    
-    if len(pixels) < 100:
-        pixels = lab.reshape(-1, 3)
-    
-    # Cluster into 5 tone groups (very light to very dark)
-    kmeans = KMeans(n_clusters=5, random_state=settings.random_seed, n_init=10)
-    kmeans.fit(pixels)
-    
-    # Determine cluster based on L* value
-    lab_mean = np.mean(pixels, axis=0)
-    cluster_id = int(kmeans.predict([lab_mean])[0])
+        lab_mean = _border_lab_mean(lab)
+        region = None
+        if lab_mean is None:
+            lab_mean = np.array(cv2.mean(lab)[:3])  # Whole image
+        elif settings.skin_tone_kmeans:
+            region = _border_region(lab.shape[:2])
+    
+    if settings.skin_tone_kmeans:
+        cluster_id = _skin_tone_kmeans_cluster(lab, region, lab_mean)
+    else:
+        # Lightness bins, 0 (darkest) to 4 (lightest)
+        cluster_id = int(np.digitize(lab_mean[0], SKIN_TONE_L_EDGES))
     
     logger.debug(f"Skin tone cluster: {cluster_id}, LAB mean: {lab_mean}")
     return cluster_id, lab_mean
 
 
-def apply_tone_normalization(image: np.ndarray, tone_cluster: int, lab_mean: np.ndarray) -> Tuple[np.ndarray, float]:
+def apply_tone_normalization(
+    image: np.ndarray,
+    tone_cluster: int,
+    lab_mean: np.ndarray,
+    lab: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, float]:
     """
     Apply fairness-aware tone normalization.
     
@@ -177,12 +413,32 @@ def apply_tone_normalization(image: np.ndarray, tone_cluster: int, lab_mean: np.
         image: Input BGR image
         tone_cluster: Skin tone cluster ID
         lab_mean: Mean LAB values
+        lab: Optional precomputed LAB conversion of image (not modified)
         
     Returns:
         Tuple of (normalized_image, scaling_factor)
     """
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB).astype(np.float32)
+    if lab is None:
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    lab = lab.copy()
+    
+    scaling_factor = _tone_normalize_lab(lab, lab_mean)
+    normalized = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    
+    return normalized, scaling_factor
+
+
+def _tone_normalize_lab(lab: np.ndarray, lab_mean: np.ndarray) -> float:
+    """
+    Scale the L channel of a LAB image towards the target lightness, in place.
     
+    Args:
+        lab: LAB image (H, W, 3), uint8
+        lab_mean: Mean LAB values
+        
+    Returns:
+        Scaling factor applied
+    """
     # Target L* value (mid-range)
     target_L = 180.0
     current_L = lab_mean[0]
@@ -191,31 +447,52 @@ def apply_tone_normalization(image: np.ndarray, tone_cluster: int, lab_mean: np.
     scaling_factor = target_L / (current_L + 1e-6)
     scaling_factor = np.clip(scaling_factor, 0.7, 1.3)
     
-    # Apply to L channel only
-    lab[:, :, 0] = np.clip(lab[:, :, 0] * scaling_factor, 0, 255)
-    
-    normalized = cv2.cvtColor(lab.astype(np.uint8), cv2.COLOR_LAB2BGR)
+    # Apply to L channel only, as a per-level table (float32 product,
+    # clipped and truncated to uint8)
+    lut = np.clip(np.arange(256, dtype=np.float32) * scaling_factor, 0, 255).astype(np.uint8)
+    cv2.insertChannel(cv2.LUT(cv2.extractChannel(lab, 0), lut), lab, 0)
     
     logger.debug(f"Applied tone normalization: factor={scaling_factor:.3f}")
-    return normalized, float(scaling_factor)
+    return float(scaling_factor)
 
 
-def preprocess_image(pil_image: Image.Image, save_path: Optional[str] = None) -> Tuple[np.ndarray, PreprocessingReport]:
+def preprocess_image(
+    image: Union[np.ndarray, Image.Image],
+    save_path: Optional[str] = None,
+    quality_report: Optional[QualityReport] = None
+) -> Tuple[np.ndarray, PreprocessingReport]:
     """
     Complete preprocessing pipeline.
     
+    QC thresholds apply to the unprocessed input. If a failed quality_report
+    is given, only geometric standardization and the skin tone estimate run;
+    white balance, glare inpainting, tone normalization and contrast
+    enhancement are skipped (scaling factor 1.0, glare coverage 0.0).
+    
     Args:
-        pil_image: Input PIL image
+        image: Input RGB image array (H, W, 3) or PIL image
         save_path: Optional path to save preprocessed image
+        quality_report: Optional QC result for the same image
         
     Returns:
         Tuple of (preprocessed_array, preprocessing_report)
     """
-    # Convert to BGR for OpenCV
-    image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+    # 1. Geometric standardization (before the BGR conversion, so that
+    # only the target-size image is converted)
+    image = center_crop_and_resize(np.asarray(image), settings.target_size)
     
-    # 1. Geometric standardization
-    image = center_crop_and_resize(image, settings.target_size)
+    # Convert to BGR for OpenCV
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    
+    if quality_report is not None and not quality_report.quality_pass:
+        tone_cluster, lab_mean = estimate_skin_tone(image)
+        logger.info(f"Preprocessing skipped after failed QC: tone_cluster={tone_cluster}")
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), PreprocessingReport(
+            tone_cluster=tone_cluster,
+            lab_mean=lab_mean.tolist(),
+            scaling_factor=1.0,
+            glare_mask_coverage=0.0
+        )
     
     # 2. White balance
     image = apply_white_balance(image)
@@ -225,18 +502,27 @@ def preprocess_image(pil_image: Image.Image, save_path: Optional[str] = None) ->
     if glare_coverage > 0.01:  # Inpaint if >1% glare
         image = inpaint_glare(image, glare_mask)
     
-    # 4. Skin tone estimation
-    tone_cluster, lab_mean = estimate_skin_tone(image)
+    # 4. Skin tone estimation (the image stays in LAB through step 6)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    tone_cluster, lab_mean = estimate_skin_tone(image, lab=lab)
     
     # 5. Tone normalization for fairness
-    image, scaling_factor = apply_tone_normalization(image, tone_cluster, lab_mean)
+    scaling_factor = _tone_normalize_lab(lab, lab_mean)
     
-    # 6. CLAHE enhancement
-    image = apply_clahe(image)
+    # 6. Contrast enhancement (CLAHE, or global equalization if disabled)
+    if settings.use_clahe:
+        _clahe_lab(lab)
+        logger.debug("Applied CLAHE enhancement")
+    else:
+        _equalize_lab(lab)
+        logger.debug("Applied global histogram equalization")
+    
+    # Single conversion out of LAB
+    image_rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
     
     # Save if requested
     if save_path:
-        cv2.imwrite(save_path, image)
+        cv2.imwrite(save_path, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
         logger.info(f"Saved preprocessed image to {save_path}")
     
     # Create report
@@ -249,7 +535,4 @@ def preprocess_image(pil_image: Image.Image, save_path: Optional[str] = None) ->
     
     logger.info(f"Preprocessing complete: tone_cluster={tone_cluster}, glare={glare_coverage:.3f}")
     
-    # Convert back to RGB
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
     return image_rgb, report
@@ -18,6 +18,53 @@ from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Paragraph and table styles are shared by every report
+_STYLES = getSampleStyleSheet()
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=18,
+    textColor=colors.HexColor('#1a1a1a'),
+    spaceAfter=12,
+    alignment=TA_CENTER
+)
+_HEADING_STYLE = ParagraphStyle(
+    'CustomHeading',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    textColor=colors.HexColor('#2c3e50'),
+    spaceAfter=10,
+    spaceBefore=12
+)
+
+_SCAN_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+# Keyed by QC pass/fail (status cell color)
+_QC_TABLE_STYLES = {
+    quality_pass: TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
+        ('TEXTCOLOR', (1, 0), (1, 0), colors.green if quality_pass else colors.red),
+        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
+    ])
+    for quality_pass in (True, False)
+}
+
+_PREDICTION_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
+    ('FONTNAME', (1, 0), (1, 2), 'Helvetica-Bold'),
+    ('FONTSIZE', (1, 0), (1, 0), 12),
+])
+
 
 def create_clinical_report(
     scan_data: ScanResponse,
@@ -46,24 +93,9 @@ def create_clinical_report(
     elements = []
     
     # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1a1a1a'),
-        spaceAfter=12,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=10,
-        spaceBefore=12
-    )
+    styles = _STYLES
+    title_style = _TITLE_STYLE
+    heading_style = _HEADING_STYLE
     
     # Title
     elements.append(Paragraph("Hemoglobin Estimation Report", title_style))
@@ -77,13 +109,7 @@ def create_clinical_report(
         ['Model Version:', f"UNet {scan_data.version.unet}, Hb {scan_data.version.hb_model}"]
     ]
     scan_info_table = Table(scan_info_data, colWidths=[2*inch, 4*inch])
-    scan_info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
+    scan_info_table.setStyle(_SCAN_INFO_TABLE_STYLE)
     elements.append(scan_info_table)
     elements.append(Spacer(1, 0.2*inch))
     
@@ -91,7 +117,6 @@ def create_clinical_report(
     elements.append(Paragraph("Image Quality Assessment", heading_style))
     qc = scan_data.quality
     qc_status = "✓ PASS" if qc.quality_pass else "✗ FAIL"
-    qc_color = colors.green if qc.quality_pass else colors.red
     
     qc_data = [
         ['Status:', qc_status],
@@ -100,13 +125,7 @@ def create_clinical_report(
         ['Contrast:', f"{qc.contrast:.2f}"]
     ]
     qc_table = Table(qc_data, colWidths=[2*inch, 4*inch])
-    qc_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
-        ('TEXTCOLOR', (1, 0), (1, 0), qc_color),
-        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
-    ]))
+    qc_table.setStyle(_QC_TABLE_STYLES[qc.quality_pass])
     elements.append(qc_table)
     
     if not qc.quality_pass:
@@ -143,13 +162,7 @@ def create_clinical_report(
         ]
         
         pred_table = Table(pred_data, colWidths=[2*inch, 4*inch])
-        pred_table.setStyle(TableStyle([
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#555555')),
-            ('FONTNAME', (1, 0), (1, 2), 'Helvetica-Bold'),
-            ('FONTSIZE', (1, 0), (1, 0), 12),
-        ]))
+        pred_table.setStyle(_PREDICTION_TABLE_STYLE)
         elements.append(pred_table)
         elements.append(Spacer(1, 0.2*inch))
         
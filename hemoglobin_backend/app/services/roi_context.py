@@ -0,0 +1,47 @@
+"""
+Per-ROI cache of color space conversions shared by the pipeline stages.
+"""
+import cv2
+import numpy as np
+
+
+class ROIContext:
+    """
+    ROI image with its LAB, HSV and grayscale versions converted on first use.
+    
+    Feature extraction and the mock Grad-CAM both read the same ROI; passing
+    one context between them converts each color space once per scan.
+    """
+    
+    def __init__(self, roi: np.ndarray):
+        """
+        Initialize the context (nothing is converted yet).
+        
+        Args:
+            roi: ROI image (H, W, 3), RGB, 0-255
+        """
+        self.roi = roi
+        self._lab = None
+        self._hsv = None
+        self._gray = None
+    
+    @property
+    def lab(self) -> np.ndarray:
+        """ROI in LAB (H, W, 3), uint8."""
+        if self._lab is None:
+            self._lab = cv2.cvtColor(self.roi, cv2.COLOR_RGB2LAB)
+        return self._lab
+    
+    @property
+    def hsv(self) -> np.ndarray:
+        """ROI in HSV (H, W, 3), uint8."""
+        if self._hsv is None:
+            self._hsv = cv2.cvtColor(self.roi, cv2.COLOR_RGB2HSV)
+        return self._hsv
+    
+    @property
+    def gray(self) -> np.ndarray:
+        """ROI in grayscale (H, W), uint8."""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.roi, cv2.COLOR_RGB2GRAY)
+        return self._gray
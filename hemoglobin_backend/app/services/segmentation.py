@@ -7,11 +7,16 @@ from typing import Tuple, Optional
 from pathlib import Path
 from app.models.unet import get_unet_model
 from app.schemas import SegmentationReport
+from app.services.preprocessing import RESIZE_INTERPOLATIONS
 from app.config import settings
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Mask clean-up structuring elements (read-only)
+_KERNEL_OPEN = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+_KERNEL_CLOSE = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+
 
 def threshold_mask(mask: np.ndarray, threshold: float = 0.5) -> np.ndarray:
     """
@@ -39,20 +44,18 @@ def clean_mask(mask: np.ndarray) -> np.ndarray:
         Cleaned binary mask
     """
     # Morphological opening (remove small noise)
-    kernel_open = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel_open)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, _KERNEL_OPEN)
     
     # Keep only largest connected component
-    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
     
     if num_labels > 1:
-        # Find largest component (excluding background)
-        largest_label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
-        mask = (labels == largest_label).astype(np.uint8) * 255
+        # Find largest component (excluding background); compare gives 0/255 directly
+        largest_label = 1 + int(stats[1:, cv2.CC_STAT_AREA].argmax())
+        mask = cv2.compare(labels, largest_label, cv2.CMP_EQ)
     
     # Morphological closing (smooth edges)
-    kernel_close = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel_close)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, _KERNEL_CLOSE)
     
     logger.debug("Cleaned segmentation mask")
     return mask
@@ -70,17 +73,15 @@ def extract_roi(image: np.ndarray, mask: np.ndarray, padding: int = 10) -> Tuple
     Returns:
         Tuple of (roi_image, bbox) where bbox is (x, y, w, h)
     """
-    # Find bounding box
-    coords = cv2.findNonZero(mask)
-    if coords is None:
+    # Find bounding box (computed from the mask, without a coordinate list)
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0:
         logger.warning("No mask found, using center crop")
         h, w = image.shape[:2]
         size = min(h, w) // 2
         x, y = w // 2 - size // 2, h // 2 - size // 2
         return image[y:y+size, x:x+size], (x, y, size, size)
     
-    x, y, w, h = cv2.boundingRect(coords)
-    
     # Add padding
     x = max(0, x - padding)
     y = max(0, y - padding)
@@ -110,7 +111,11 @@ def resize_roi(roi: np.ndarray, target_size: int) -> np.ndarray:
     scale = target_size / max(h, w)
     new_h, new_w = int(h * scale), int(w * scale)
     
-    resized = cv2.resize(roi, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+    resized = cv2.resize(
+        roi,
+        (new_w, new_h),
+        interpolation=RESIZE_INTERPOLATIONS[settings.resize_interpolation]
+    )
     
     # Pad to square
     pad_h = (target_size - new_h) // 2
@@ -3,13 +3,12 @@ SHAP-based feature importance explainer.
 Explains which features contribute most to hemoglobin predictions.
 """
 import numpy as np
-import shap
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-import io
-import base64
+import pybase64
+from html import escape
+from functools import lru_cache
+from operator import itemgetter
 from typing import Dict, List, Tuple
+from app.schemas import FEATURE_VECTOR_FIELDS, MODEL_FEATURE_DIM
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
@@ -36,6 +35,30 @@ FEATURE_NAMES = [
     'a*/L* Ratio'
 ]
 
+# Per-group value getters for the model's features; _FEATURE_ORDER puts the
+# concatenated color, texture and vascular values into FEATURE_NAMES order
+_MODEL_FIELDS = FEATURE_VECTOR_FIELDS[:MODEL_FEATURE_DIM]
+_GROUP_FIELDS = {
+    group: [name for g, name in _MODEL_FIELDS if g == group]
+    for group in ('color', 'texture', 'vascular')
+}
+_COLOR_GETTER = itemgetter(*_GROUP_FIELDS['color'])
+_TEXTURE_GETTER = itemgetter(*_GROUP_FIELDS['texture'])
+_VASCULAR_GETTER = itemgetter(*_GROUP_FIELDS['vascular'])
+_GROUPED_FIELDS = [
+    (group, name) for group in ('color', 'texture', 'vascular') for name in _GROUP_FIELDS[group]
+]
+_FEATURE_ORDER = itemgetter(*(_GROUPED_FIELDS.index(field) for field in _MODEL_FIELDS))
+
+
+# Clinical context for the interpretation: L* when it is the top feature,
+# and the others (in this order) when among the top 3
+_PRIMARY_L_BLURB = "\nL* lightness is the primary indicator - darker nail beds typically indicate higher hemoglobin levels."
+_TOP_FEATURE_BLURBS = {
+    'R/G Ratio': "The red/green color ratio helps assess blood oxygenation in the nail bed.",
+    'Vessel Density': "Blood vessel density in the nail bed provides additional hemoglobin information."
+}
+
 
 class SHAPExplainer:
     """
@@ -54,102 +77,29 @@ class SHAPExplainer:
         
         For the mock prediction model, we can calculate importance based on
         the actual formula weights used in predict_mock_from_features().
+        Results are cached on the feature vector rounded to 3 decimals.
         
         Args:
             features: Extracted features dict
-            
+        
         Returns:
             Dict with feature importance analysis
         """
         try:
-            # Extract feature values
-            color = features['color']
+            # Feature vector matching the order in FEATURE_NAMES, quantized so
+            # near-identical scans share a cache entry
             texture = features['texture']
-            vascular = features['vascular']
-            
-            # Create feature array matching the order in FEATURE_NAMES
-            feature_values = np.array([
-                color['mean_L'],
-                color['mean_a'],
-                color['mean_b'],
-                color['mean_R'],
-                color['mean_G'],
-                color['mean_B'],
-                color['ratio_R_G'],
-                color['ratio_R_B'],
-                texture['glcm_contrast'],
-                texture['glcm_homogeneity'],
-                texture['glcm_energy'],
-                texture['lbp_uniformity'],
-                texture['fft_highfreq_power'],
-                vascular['vessel_density'],
-                vascular['mean_thickness'],
-                vascular['orientation_entropy'],
-                color['std_L'],
-                color['ratio_a_L']
-            ])
-            
-            # Calculate importance based on mock prediction formula
-            # These weights reflect the actual contribution in predict_mock_from_features()
-            importance_scores = np.zeros(18)
-            
-            # L* (index 0) - most important (used in L_factor calculation)
-            L_normalized = (color['mean_L'] - 60) / 20.0
-            L_contribution = abs(-L_normalized * 2.0)
-            importance_scores[0] = L_contribution
-            
-            # R/G ratio (index 6) - second most important
-            rg_normalized = (color['ratio_R_G'] - 1.05) / 0.15
-            rg_contribution = abs(rg_normalized * 1.5)
-            importance_scores[6] = rg_contribution
-            
-            # Vessel density (index 13) - third most important
-            vessel_normalized = (vascular['vessel_density'] - 0.15) / 0.1
-            vessel_contribution = abs(vessel_normalized * 0.8)
-            importance_scores[13] = vessel_contribution
-            
-            # Mean Red (index 3) - fourth most important
-            red_normalized = (color['mean_R'] - 150) / 50.0
-            red_contribution = abs(red_normalized * 0.5)
-            importance_scores[3] = red_contribution
-            
-            # LBP Uniformity (index 11) - affects uncertainty/confidence
-            texture_contribution = abs(texture.get('lbp_uniformity', 0.5) - 0.5) * 0.4
-            importance_scores[11] = texture_contribution
-            
-            # Normalize importance scores to sum to 1
-            total_importance = np.sum(importance_scores)
-            if total_importance > 0:
-                importance_scores = importance_scores / total_importance
-            
-            # Create feature importance list
-            feature_importance = []
-            for i, (name, value, importance) in enumerate(zip(self.feature_names, feature_values, importance_scores)):
-                if importance > 0.01:  # Only include features with >1% importance
-                    feature_importance.append({
-                        'name': name,
-                        'value': float(value),
-                        'importance': float(importance),
-                        'contribution': float(importance * 100)  # As percentage
-                    })
-            
-            # Sort by importance (descending)
-            feature_importance.sort(key=lambda x: x['importance'], reverse=True)
-            
-            # Generate interpretation
-            top_feature = feature_importance[0] if feature_importance else None
-            interpretation = self._generate_interpretation(feature_importance)
-            
-            result = {
-                'top_features': feature_importance[:5],  # Top 5 features
-                'all_features': feature_importance,
-                'interpretation': interpretation,
-                'method': 'formula_based'  # Indicates this is based on the mock formula
-            }
-            
-            logger.info(f"Feature importance calculated: top feature = {top_feature['name'] if top_feature else 'none'}")
-            return result
+            if 'lbp_uniformity' not in texture:
+                texture = {**texture, 'lbp_uniformity': 0.5}
+            grouped = (
+                _COLOR_GETTER(features['color'])
+                + _TEXTURE_GETTER(texture)
+                + _VASCULAR_GETTER(features['vascular'])
+            )
+            feature_values = tuple(round(float(v), 3) for v in _FEATURE_ORDER(grouped))
             
+            return _formula_importance(feature_values)
+        
         except Exception as e:
             logger.error(f"Error calculating feature importance: {e}")
             return {
@@ -159,7 +109,8 @@ class SHAPExplainer:
                 'method': 'error'
             }
     
-    def _generate_interpretation(self, feature_importance: List[Dict]) -> str:
+    @staticmethod
+    def _generate_interpretation(feature_importance: List[Dict]) -> str:
         """Generate human-readable interpretation of feature importance."""
         if not feature_importance:
             return "No significant features identified."
@@ -176,71 +127,191 @@ class SHAPExplainer:
         
         # Add clinical context
         if feature_importance[0]['name'] == 'L* (Lightness)':
-            interpretation_parts.append("\nL* lightness is the primary indicator - darker nail beds typically indicate higher hemoglobin levels.")
-        
-        if any(f['name'] == 'R/G Ratio' for f in top_3):
-            interpretation_parts.append("The red/green color ratio helps assess blood oxygenation in the nail bed.")
+            interpretation_parts.append(_PRIMARY_L_BLURB)
         
-        if any(f['name'] == 'Vessel Density' for f in top_3):
-            interpretation_parts.append("Blood vessel density in the nail bed provides additional hemoglobin information.")
+        top_names = {f['name'] for f in top_3}
+        interpretation_parts.extend(
+            blurb for name, blurb in _TOP_FEATURE_BLURBS.items() if name in top_names
+        )
         
         return "\n".join(interpretation_parts)
     
-    def generate_visualization(self, feature_importance: List[Dict]) -> str:
+    def render_visualization(self, feature_importance: List[Dict]) -> bytes:
         """
-        Generate a bar chart visualization of feature importance.
+        Render a bar chart of feature importance as SVG markup.
+        
+        Charts are cached on the plotted (name, contribution) pairs, rounded
+        to the 0.1% shown in the bar labels.
         
         Args:
             feature_importance: List of feature importance dicts
-            
+        
         Returns:
-            Base64 encoded PNG image
+            UTF-8 SVG bytes (empty if there is nothing to plot)
         """
+        if not feature_importance:
+            return b""
+        
+        # Take top 8 features for visualization
+        bars = tuple(
+            (f['name'], round(f['contribution'], 1))
+            for f in feature_importance[:8]
+        )
+        
         try:
-            if not feature_importance:
-                return ""
-            
-            # Take top 8 features for visualization
-            top_features = feature_importance[:8]
-            
-            # Create figure
-            fig, ax = plt.subplots(figsize=(10, 6))
-            
-            # Extract data
-            names = [f['name'] for f in top_features]
-            importances = [f['contribution'] for f in top_features]
-            
-            # Create horizontal bar chart
-            y_pos = np.arange(len(names))
-            colors = plt.cm.RdYlGn_r(np.linspace(0.3, 0.7, len(names)))
-            
-            bars = ax.barh(y_pos, importances, color=colors)
-            ax.set_yticks(y_pos)
-            ax.set_yticklabels(names)
-            ax.invert_yaxis()  # Highest importance at top
-            ax.set_xlabel('Contribution (%)', fontsize=12)
-            ax.set_title('Feature Importance for Hemoglobin Prediction', fontsize=14, fontweight='bold')
-            ax.set_xlim(0, max(importances) * 1.1)
-            
-            # Add value labels on bars
-            for i, (bar, imp) in enumerate(zip(bars, importances)):
-                ax.text(imp + 0.5, i, f'{imp:.1f}%', va='center', fontsize=10)
-            
-            plt.tight_layout()
-            
-            # Convert to base64
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-            buf.seek(0)
-            img_base64 = base64.b64encode(buf.read()).decode('utf-8')
-            plt.close(fig)
-            
-            logger.info("Feature importance visualization generated")
-            return img_base64
-            
+            return _render_importance_chart(bars)
         except Exception as e:
             logger.error(f"Error generating visualization: {e}")
+            return b""
+    
+    def generate_visualization(self, feature_importance: List[Dict]) -> str:
+        """
+        Generate a bar chart visualization of feature importance.
+        
+        Args:
+            feature_importance: List of feature importance dicts
+        
+        Returns:
+            Base64 encoded SVG data URI
+        """
+        svg = self.render_visualization(feature_importance)
+        if not svg:
             return ""
+        return f"data:image/svg+xml;base64,{pybase64.b64encode_as_string(svg)}"
+
+
+# Bar colors, top bar to bottom (matplotlib RdYlGn_r from 0.3 to 0.7)
+_BAR_COLORS = ((165, 216, 106), (217, 239, 139), (255, 254, 190), (254, 224, 139), (253, 173, 96))
+
+
+def _bar_color(t: float) -> str:
+    """
+    Interpolate the bar palette.
+    
+    Args:
+        t: Position in [0, 1]
+    
+    Returns:
+        Hex color string
+    """
+    pos = t * (len(_BAR_COLORS) - 1)
+    i = min(int(pos), len(_BAR_COLORS) - 2)
+    frac = pos - i
+    rgb = (round(a + (b - a) * frac) for a, b in zip(_BAR_COLORS[i], _BAR_COLORS[i + 1]))
+    return '#' + ''.join(f'{c:02x}' for c in rgb)
+
+
+@lru_cache(maxsize=2048)
+def _render_importance_chart(bars: Tuple[Tuple[str, float], ...]) -> bytes:
+    """
+    Render a horizontal bar chart of feature contributions as SVG.
+    
+    The markup is built directly as text, which is orders of magnitude
+    cheaper than a matplotlib figure and a fraction of the PNG size.
+    
+    Args:
+        bars: (feature name, contribution %) pairs, most important first
+    
+    Returns:
+        UTF-8 SVG bytes
+    """
+    label_width, plot_width, row_height = 170, 360, 32
+    top, bottom = 44, 44
+    width = label_width + plot_width + 70
+    height = top + row_height * len(bars) + bottom
+    x_max = max(contribution for _, contribution in bars) * 1.1 or 1.0
+    
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="sans-serif" font-size="12">',
+        f'<rect width="{width}" height="{height}" fill="#ffffff"/>',
+        f'<text x="{width / 2:.0f}" y="26" text-anchor="middle" font-size="15" font-weight="bold">'
+        'Feature Importance for Hemoglobin Prediction</text>'
+    ]
+    
+    for i, (name, contribution) in enumerate(bars):
+        y = top + i * row_height
+        bar_width = plot_width * max(contribution, 0.0) / x_max
+        color = _bar_color(i / (len(bars) - 1) if len(bars) > 1 else 0.0)
+        parts.append(
+            f'<text x="{label_width - 8}" y="{y + row_height / 2 + 4:.0f}" text-anchor="end">{escape(name)}</text>'
+            f'<rect x="{label_width}" y="{y + 4}" width="{bar_width:.1f}" height="{row_height - 8}" fill="{color}"/>'
+            f'<text x="{label_width + bar_width + 6:.1f}" y="{y + row_height / 2 + 4:.0f}">{contribution:.1f}%</text>'
+        )
+    
+    axis_y = top + row_height * len(bars)
+    parts.append(
+        f'<line x1="{label_width}" y1="{top}" x2="{label_width}" y2="{axis_y}" stroke="#333333"/>'
+        f'<line x1="{label_width}" y1="{axis_y}" x2="{label_width + plot_width}" y2="{axis_y}" stroke="#333333"/>'
+        f'<text x="{label_width + plot_width / 2:.0f}" y="{axis_y + 28}" text-anchor="middle" font-size="13">'
+        'Contribution (%)</text>'
+        '</svg>'
+    )
+    
+    logger.info("Feature importance visualization generated")
+    return ''.join(parts).encode('utf-8')
+
+
+# Features scored by the mock prediction formula (predict_mock_from_features),
+# most important first: L*, R/G ratio, vessel density, mean red and LBP
+# uniformity (which affects uncertainty/confidence)
+_SCORED_INDICES = np.array([0, 6, 13, 3, 11])
+_SCORED_CENTERS = np.array([60.0, 1.05, 0.15, 150.0, 0.5])
+_SCORED_SCALES = np.array([20.0, 0.15, 0.1, 50.0, 1.0])
+_SCORED_WEIGHTS = np.array([2.0, 1.5, 0.8, 0.5, 0.4])
+
+
+@lru_cache(maxsize=2048)
+def _formula_importance(feature_values: Tuple[float, ...]) -> Dict:
+    """
+    Formula-based feature importance for a (quantized) feature vector.
+    
+    The returned dict is shared between cache hits and must not be mutated.
+    
+    Args:
+        feature_values: 18 feature values in FEATURE_NAMES order
+    
+    Returns:
+        Dict with feature importance analysis
+    """
+    # Calculate importance based on mock prediction formula
+    # (|value - center| / scale * weight per scored feature)
+    importance_scores = np.zeros(len(FEATURE_NAMES))
+    values = np.asarray(feature_values, dtype=np.float64)
+    importance_scores[_SCORED_INDICES] = (
+        np.abs((values[_SCORED_INDICES] - _SCORED_CENTERS) / _SCORED_SCALES) * _SCORED_WEIGHTS
+    )
+    
+    # Normalize importance scores to sum to 1
+    total_importance = importance_scores.sum()
+    if total_importance > 0:
+        importance_scores /= total_importance
+    
+    # Features with >1% importance, by importance (descending; ties keep
+    # FEATURE_NAMES order)
+    selected = np.flatnonzero(importance_scores > 0.01)
+    selected = selected[np.argsort(-importance_scores[selected], kind='stable')]
+    feature_importance = [
+        {
+            'name': FEATURE_NAMES[i],
+            'value': float(feature_values[i]),
+            'importance': float(importance_scores[i]),
+            'contribution': float(importance_scores[i] * 100)  # As percentage
+        }
+        for i in selected
+    ]
+    
+    # Generate interpretation
+    top_feature = feature_importance[0] if feature_importance else None
+    interpretation = SHAPExplainer._generate_interpretation(feature_importance)
+    
+    logger.info(f"Feature importance calculated: top feature = {top_feature['name'] if top_feature else 'none'}")
+    return {
+        'top_features': feature_importance[:5],  # Top 5 features
+        'all_features': feature_importance,
+        'interpretation': interpretation,
+        'method': 'formula_based'  # Indicates this is based on the mock formula
+    }
 
 
 # Global explainer instance
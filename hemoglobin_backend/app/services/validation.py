@@ -2,9 +2,11 @@
 Input validation for uploaded images.
 """
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import BinaryIO, Tuple, Optional
 from PIL import Image
 import io
+import cv2
+import numpy as np
 from app.config import settings
 from app.utils.logger import setup_logger
 from app.services.hand_detector import validate_hand_in_image, HandDetectionError
@@ -15,19 +17,47 @@ logger = setup_logger(__name__)
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
 ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png'}
 
+# Leading bytes of each allowed type
+_MAGIC_BYTES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png')
+)
+
 
 class ValidationError(Exception):
     """Custom exception for validation failures."""
     pass
 
 
-def validate_file_type(file_bytes: bytes, filename: str) -> None:
+def _open_image(upload: BinaryIO) -> Image.Image:
+    """Open the uploaded image (lazily) from the start of the stream."""
+    upload.seek(0)
+    return Image.open(upload)
+
+
+def _sniff_mime_type(upload: BinaryIO) -> Optional[str]:
+    """
+    Identify an allowed image type from the file's leading bytes.
+    
+    Args:
+        upload: Uploaded file stream
+        
+    Returns:
+        MIME type, or None if the content is neither JPEG nor PNG
+    """
+    upload.seek(0)
+    head = upload.read(8)
+    return next((mime for magic, mime in _MAGIC_BYTES if head.startswith(magic)), None)
+
+
+def validate_file_type(upload: BinaryIO, filename: str, img: Optional[Image.Image] = None) -> None:
     """
     Validate file type and extension.
     
     Args:
-        file_bytes: Raw file bytes
+        upload: Uploaded file stream
         filename: Original filename
+        img: Optional image already opened from upload (header only)
         
     Raises:
         ValidationError: If file type is invalid
@@ -39,9 +69,15 @@ def validate_file_type(file_bytes: bytes, filename: str) -> None:
             f"Invalid file extension: {ext}. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
+    # Content that is neither JPEG nor PNG is rejected from its magic bytes,
+    # without parsing it
+    if _sniff_mime_type(upload) is None:
+        raise ValidationError("Cannot read image file: content is not a JPEG or PNG image")
+    
     # Check MIME type (using python-magic would require libmagic, using PIL instead)
     try:
-        img = Image.open(io.BytesIO(file_bytes))
+        if img is None:
+            img = _open_image(upload)
         mime_type = f"image/{img.format.lower()}"
         if mime_type not in ALLOWED_MIME_TYPES:
             raise ValidationError(f"Invalid MIME type: {mime_type}")
@@ -51,18 +87,19 @@ def validate_file_type(file_bytes: bytes, filename: str) -> None:
     logger.info(f"File type validated: {filename} ({mime_type})")
 
 
-def validate_file_size(file_bytes: bytes) -> None:
+def validate_file_size(upload: BinaryIO) -> None:
     """
     Validate file size.
     
     Args:
-        file_bytes: Raw file bytes
+        upload: Uploaded file stream
         
     Raises:
         ValidationError: If file is too large
     """
-    size_mb = len(file_bytes) / (1024 * 1024)
-    if size_mb > settings.max_upload_size_mb:
+    size_bytes = upload.seek(0, io.SEEK_END)
+    size_mb = size_bytes / (1024 * 1024)
+    if size_bytes > settings.max_upload_size_mb * 1024 * 1024:
         raise ValidationError(
             f"File too large: {size_mb:.2f} MB. Maximum: {settings.max_upload_size_mb} MB"
         )
@@ -70,12 +107,13 @@ def validate_file_size(file_bytes: bytes) -> None:
     logger.info(f"File size validated: {size_mb:.2f} MB")
 
 
-def validate_image_resolution(file_bytes: bytes) -> Tuple[int, int]:
+def validate_image_resolution(upload: BinaryIO, img: Optional[Image.Image] = None) -> Tuple[int, int]:
     """
     Validate image resolution and return dimensions.
     
     Args:
-        file_bytes: Raw file bytes
+        upload: Uploaded file stream
+        img: Optional image already opened from upload (header only)
         
     Returns:
         Tuple of (width, height)
@@ -84,7 +122,8 @@ def validate_image_resolution(file_bytes: bytes) -> Tuple[int, int]:
         ValidationError: If resolution is too low
     """
     try:
-        img = Image.open(io.BytesIO(file_bytes))
+        if img is None:
+            img = _open_image(upload)
         width, height = img.size
         
         min_dimension = 512
@@ -103,12 +142,15 @@ def validate_image_resolution(file_bytes: bytes) -> Tuple[int, int]:
         raise ValidationError(f"Cannot read image dimensions: {str(e)}")
 
 
-def validate_image_integrity(file_bytes: bytes) -> Image.Image:
+def validate_image_integrity(upload: BinaryIO) -> Image.Image:
     """
     Validate image can be loaded and is not corrupted.
     
+    Very large JPEGs are decoded at a reduced scale (see
+    settings.upload_max_dim), which libjpeg does in the DCT domain.
+    
     Args:
-        file_bytes: Raw file bytes
+        upload: Uploaded file stream
         
     Returns:
         PIL Image object
@@ -117,11 +159,13 @@ def validate_image_integrity(file_bytes: bytes) -> Image.Image:
         ValidationError: If image is corrupted
     """
     try:
-        img = Image.open(io.BytesIO(file_bytes))
+        img = _open_image(upload)
         img.verify()  # Verify integrity
         
-        # Reload after verify (verify closes the file)
-        img = Image.open(io.BytesIO(file_bytes))
+        # Reload after verify (verify invalidates the image)
+        img = _open_image(upload)
+        if settings.upload_max_dim:
+            img.draft('RGB', (settings.upload_max_dim, settings.upload_max_dim))
         img.load()  # Force load to catch truncated images
         
         logger.info("Image integrity validated")
@@ -131,12 +175,82 @@ def validate_image_integrity(file_bytes: bytes) -> Image.Image:
         raise ValidationError(f"Corrupted or unreadable image: {str(e)}")
 
 
-def validate_hand_presence(file_bytes: bytes) -> dict:
+# cv2.imdecode flags for the libjpeg DCT-domain reductions
+_REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def _jpeg_reduction(width: int, height: int) -> int:
+    """
+    JPEG decode reduction for settings.upload_max_dim.
+    
+    Same choice as PIL's Image.draft: the largest of 8, 4, 2 and 1 that
+    keeps both sides at or above upload_max_dim.
+    
+    Args:
+        width: Image width
+        height: Image height
+        
+    Returns:
+        Reduction factor (1, 2, 4 or 8)
+    """
+    max_dim = settings.upload_max_dim
+    if not max_dim:
+        return 1
+    ratio = min(width // max_dim, height // max_dim)
+    return next((s for s in (8, 4, 2) if ratio >= s), 1)
+
+
+def decode_image(upload: BinaryIO, img: Optional[Image.Image] = None) -> np.ndarray:
+    """
+    Validate the image's integrity and decode it straight into an RGB array.
+    
+    Decodes with cv2.imdecode into a NumPy buffer, without a PIL image and
+    its copy into an array. Very large JPEGs are decoded at a reduced scale
+    in the DCT domain, as validate_image_integrity does through PIL, and
+    the EXIF orientation is ignored in the same way.
+    
+    Args:
+        upload: Uploaded file stream
+        img: Optional image opened from upload and not yet loaded; it is
+            consumed by the integrity check
+        
+    Returns:
+        Image (H, W, 3), RGB, 0-255
+        
+    Raises:
+        ValidationError: If image is corrupted
+    """
+    try:
+        if img is None:
+            img = _open_image(upload)
+        img.verify()  # Verify integrity
+        image_format, (width, height) = img.format, img.size
+    except Exception as e:
+        raise ValidationError(f"Corrupted or unreadable image: {str(e)}")
+    
+    reduction = _jpeg_reduction(width, height) if image_format == 'JPEG' else 1
+    flags = _REDUCED_COLOR_FLAGS[reduction] | cv2.IMREAD_IGNORE_ORIENTATION
+    
+    upload.seek(0)
+    image = cv2.imdecode(np.frombuffer(upload.read(), dtype=np.uint8), flags)
+    if image is None:  # Truncated or undecodable pixel data
+        raise ValidationError("Corrupted or unreadable image: pixel data could not be decoded")
+    
+    logger.info("Image integrity validated")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+def validate_hand_presence(image_rgb: np.ndarray) -> dict:
     """
     Validate that the image contains a hand/fingers.
     
     Args:
-        file_bytes: Raw file bytes
+        image_rgb: Decoded image (H, W, 3), RGB, 0-255
         
     Returns:
         Hand detection info dictionary
@@ -145,7 +259,7 @@ def validate_hand_presence(file_bytes: bytes) -> dict:
         ValidationError: If no hand is detected
     """
     try:
-        detection_info = validate_hand_in_image(file_bytes)
+        detection_info = validate_hand_in_image(image_rgb)
         logger.info(f"Hand presence validated: {detection_info}")
         return detection_info
     except HandDetectionError as e:
@@ -156,19 +270,19 @@ def validate_hand_presence(file_bytes: bytes) -> dict:
         raise ValidationError(f"Failed to validate hand presence: {str(e)}")
 
 
-def validate_no_nail_polish(file_bytes: bytes, hand_info: dict) -> None:
+def validate_no_nail_polish(image_rgb: np.ndarray, hand_info: dict) -> None:
     """
     Validate that nails are not painted.
     
     Args:
-        file_bytes: Raw file bytes
+        image_rgb: Decoded image (H, W, 3), RGB, 0-255
         hand_info: Hand detection info
         
     Raises:
         ValidationError: If nail polish is detected
     """
     try:
-        result = detect_nail_polish(file_bytes, hand_info)
+        result = detect_nail_polish(image_rgb, hand_info)
         if result['is_painted']:
             raise ValidationError(
                 f"Nail polish detected ({result['reason']}). "
@@ -185,37 +299,92 @@ def validate_no_nail_polish(file_bytes: bytes, hand_info: dict) -> None:
         logger.warning("Nail polish detection failed, continuing with analysis")
 
 
-def validate_upload(file_bytes: bytes, filename: str) -> Tuple[Image.Image, dict]:
+def _detection_image(image_rgb: np.ndarray) -> np.ndarray:
+    """
+    Downscale the image for the hand and nail polish checks.
+    
+    MediaPipe resizes its input to a few hundred pixels anyway, and the
+    skin and color statistics are ratios and means over regions, so the
+    checks don't need full camera resolution.
+    
+    Args:
+        image_rgb: Decoded image (H, W, 3), RGB, 0-255
+        
+    Returns:
+        Image with its longer side at most settings.detection_max_dim
+    """
+    max_dim = settings.detection_max_dim
+    height, width = image_rgb.shape[:2]
+    if not max_dim or max(height, width) <= max_dim:
+        return image_rgb
+    
+    scale = max_dim / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image_rgb, size, interpolation=cv2.INTER_AREA)
+
+
+def validate_upload(
+    upload: BinaryIO,
+    filename: str,
+    *,
+    check_hand: bool = True,
+    check_polish: bool = True
+) -> Tuple[np.ndarray, dict]:
     """
     Complete validation pipeline for uploaded image.
     
+    The upload is read from its (spooled) file rather than held in memory
+    as bytes. The header is parsed once and the image decoded once; the
+    pixel checks and the rest of the scan pipeline share the resulting RGB
+    array.
+    
     Args:
-        file_bytes: Raw file bytes
+        upload: Uploaded file stream (seekable)
         filename: Original filename
+        check_hand: Whether to require a detected hand (steps 5-6 are
+            skipped without it, as the polish check uses the hand info)
+        check_polish: Whether to run the nail polish check
         
     Returns:
-        Tuple of (validated PIL Image object, hand_detection_info)
+        Tuple of (validated image (H, W, 3) RGB array, hand_detection_info)
         
     Raises:
         ValidationError: If any validation fails
     """
+    # Header parsed once, shared by the type, resolution and integrity checks
+    # (if it fails, validate_file_type reopens and reports the error)
+    img = None
+    if _sniff_mime_type(upload) is not None:
+        try:
+            img = _open_image(upload)
+        except Exception:
+            pass
+    
     # Step 1: File type and format validation
-    validate_file_type(file_bytes, filename)
+    validate_file_type(upload, filename, img)
     
     # Step 2: File size validation
-    validate_file_size(file_bytes)
+    validate_file_size(upload)
     
     # Step 3: Resolution validation
-    validate_image_resolution(file_bytes)
+    validate_image_resolution(upload, img)
+    
+    # Step 4: Image integrity validation (the only full decode)
+    image_rgb = decode_image(upload, img)
+    
+    if not check_hand:
+        logger.info(f"Upload validation complete (hand checks skipped): {filename}")
+        return image_rgb, {}
     
-    # Step 4: Hand detection validation
-    hand_info = validate_hand_presence(file_bytes)
+    # Steps 5-6 run on a downscaled copy; the full image goes on to the pipeline
+    detection_rgb = _detection_image(image_rgb)
     
-    # Step 5: Nail polish detection (NEW)
-    validate_no_nail_polish(file_bytes, hand_info)
+    # Step 5: Hand detection validation
+    hand_info = validate_hand_presence(detection_rgb)
     
-    # Step 6: Image integrity validation
-    img = validate_image_integrity(file_bytes)
+    # Step 6: Nail polish detection
+    if check_polish:
+        validate_no_nail_polish(detection_rgb, hand_info)
     
     logger.info(f"Upload validation complete: {filename}")
-    return img, hand_info
+    return image_rgb, hand_info
@@ -0,0 +1,31 @@
+"""
+Model warm-up, so the first scan does not pay for loading and tracing.
+"""
+from time import perf_counter
+from app.models.hb_predictor import get_hb_model
+from app.services.explainability import warm_up_gradcam
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def warm_up_models():
+    """
+    Load the models used by the scan route and run each inference path once
+    on a blank input.
+    
+    The UNet is not warmed: segmentation currently uses the CV fallback.
+    """
+    start = perf_counter()
+    
+    for name, warm_up in (
+        ('Hb model', get_hb_model().warmup),
+        ('Grad-CAM', warm_up_gradcam)
+    ):
+        try:
+            warm_up()
+        except Exception as e:
+            # The request path retries (and reports) the same work
+            logger.error(f"{name} warm-up failed: {e}")
+    
+    logger.info(f"Models warmed up in {perf_counter() - start:.2f}s")
@@ -0,0 +1,71 @@
+"""
+Dedicated thread pool for CPU-bound scan pipeline stages.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+from app.config import settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_feature_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Get (creating on first use) the CPU stage executor."""
+    global _executor
+    if _executor is None:
+        max_workers = settings.cpu_workers or os.cpu_count() or 1
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan-cpu")
+        logger.info(f"Started CPU executor with {max_workers} workers")
+    return _executor
+
+
+def get_feature_executor() -> Optional[ThreadPoolExecutor]:
+    """
+    Get (creating on first use) the executor for a scan's feature extractors.
+    
+    Kept apart from the CPU stage executor: the extractors are submitted from
+    a task already running there, and waiting on the same pool could deadlock.
+    
+    Returns:
+        The executor, or None when settings.feature_workers is 1 or less
+    """
+    global _feature_executor
+    if _feature_executor is None and settings.feature_workers > 1:
+        _feature_executor = ThreadPoolExecutor(
+            max_workers=settings.feature_workers,
+            thread_name_prefix="scan-features"
+        )
+    return _feature_executor
+
+
+def shutdown_cpu_executor():
+    """Wait for running stages and release the executor threads."""
+    global _executor, _feature_executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _feature_executor is not None:
+        _feature_executor.shutdown(wait=True)
+        _feature_executor = None
+
+
+async def run_cpu_bound(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking function on the CPU executor without blocking the event loop.
+    
+    Args:
+        func: Function to call
+        args: Positional arguments
+        kwargs: Keyword arguments
+    
+    Returns:
+        The function's return value
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_cpu_executor(), partial(func, *args, **kwargs))
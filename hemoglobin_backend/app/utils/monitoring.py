@@ -3,6 +3,8 @@ Prometheus metrics and drift detection for monitoring.
 """
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
 from typing import Dict, Any
+import threading
+import time
 import numpy as np
 from app.config import settings
 from app.utils.logger import setup_logger
@@ -55,8 +57,14 @@ class DriftDetector:
     
     def __init__(self):
         self.baseline_stats: Dict[str, Dict[str, float]] = {}
-        self.recent_samples: Dict[str, list] = {}
         self.window_size = 100
+        # Rolling window per feature: ring buffer, next write position,
+        # number of samples held and their running sum
+        self.recent_samples: Dict[str, np.ndarray] = {}
+        self._head: Dict[str, int] = {}
+        self._count: Dict[str, int] = {}
+        self._sum: Dict[str, float] = {}
+        self._drift_gauges: Dict[str, Any] = {}
     
     def set_baseline(self, feature_name: str, mean: float, std: float):
         """
@@ -68,7 +76,11 @@ class DriftDetector:
             std: Training set standard deviation
         """
         self.baseline_stats[feature_name] = {'mean': mean, 'std': std}
-        self.recent_samples[feature_name] = []
+        self.recent_samples[feature_name] = np.zeros(self.window_size)
+        self._head[feature_name] = 0
+        self._count[feature_name] = 0
+        self._sum[feature_name] = 0.0
+        self._drift_gauges[feature_name] = feature_drift_score.labels(feature_name=feature_name)
         logger.info(f"Set baseline for {feature_name}: mean={mean:.3f}, std={std:.3f}")
     
     def update(self, features: Dict[str, float]):
@@ -82,19 +94,15 @@ class DriftDetector:
             if name not in self.baseline_stats:
                 continue
             
-            # Add to rolling window
-            self.recent_samples[name].append(value)
-            if len(self.recent_samples[name]) > self.window_size:
-                self.recent_samples[name].pop(0)
+            recent_mean = self._add_sample(name, float(value))
             
             # Compute drift score (normalized difference in means)
-            if len(self.recent_samples[name]) >= 30:  # Minimum samples
-                recent_mean = np.mean(self.recent_samples[name])
+            if self._count[name] >= 30:  # Minimum samples
                 baseline_mean = self.baseline_stats[name]['mean']
                 baseline_std = self.baseline_stats[name]['std']
                 
                 drift = abs(recent_mean - baseline_mean) / (baseline_std + 1e-6)
-                feature_drift_score.labels(feature_name=name).set(drift)
+                self._drift_gauges[name].set(drift)
                 
                 if drift > 2.0:  # Alert threshold
                     logger.warning(
@@ -102,12 +110,68 @@ class DriftDetector:
                         f"baseline={baseline_mean:.3f}, recent={recent_mean:.3f}, "
                         f"drift_score={drift:.3f}"
                     )
+    
+    def _add_sample(self, name: str, value: float) -> float:
+        """
+        Add a value to a feature's rolling window in O(1).
+        
+        The oldest sample is overwritten once the window is full. The running
+        sum is recomputed from the buffer each time the write position wraps,
+        so rounding error cannot accumulate.
+        
+        Args:
+            name: Feature name
+            value: New feature value
+            
+        Returns:
+            Mean of the samples in the window
+        """
+        samples = self.recent_samples[name]
+        head = self._head[name]
+        count = self._count[name]
+        
+        if count == self.window_size:
+            self._sum[name] -= samples[head]
+        else:
+            count += 1
+            self._count[name] = count
+        samples[head] = value
+        self._sum[name] += value
+        
+        head = (head + 1) % self.window_size
+        self._head[name] = head
+        if head == 0:
+            self._sum[name] = float(samples.sum())
+        
+        return self._sum[name] / count
 
 
 # Global drift detector
 drift_detector = DriftDetector()
 
 
-def get_metrics():
-    """Return Prometheus metrics in text format."""
-    return generate_latest()
+_metrics_lock = threading.Lock()
+_metrics_cache = {'expires': 0.0, 'payload': b''}
+
+
+def get_metrics() -> bytes:
+    """
+    Return Prometheus metrics in text format.
+    
+    Output is reused for settings.metrics_cache_ttl seconds so concurrent
+    scrapers don't each walk and format the whole registry. The cache is
+    per process, like the registry itself.
+    
+    Returns:
+        Exposition-format metrics
+    """
+    ttl = settings.metrics_cache_ttl
+    if ttl <= 0:
+        return generate_latest()
+    
+    with _metrics_lock:
+        now = time.monotonic()
+        if now >= _metrics_cache['expires']:
+            _metrics_cache['payload'] = generate_latest()
+            _metrics_cache['expires'] = now + ttl
+        return _metrics_cache['payload']
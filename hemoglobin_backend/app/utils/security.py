@@ -1,25 +1,44 @@
 """
 Security utilities for PHI protection and data encryption.
 """
-import uuid
+import os
+import base64
 import hashlib
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 from app.config import settings
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Streamed file format: magic, GCM nonce, ciphertext, GCM tag. Files without
+# the magic are legacy Fernet tokens
+_FILE_MAGIC = b'HBE1'
+_NONCE_SIZE = 12
+_TAG_SIZE = 16
+_CHUNK_SIZE = 64 * 1024
+
 
 def generate_scan_id() -> str:
     """
     Generate a unique, anonymous scan ID.
     
+    Formats the random bytes as a canonical UUID4 string directly, without
+    building a uuid.UUID object.
+    
     Returns:
         UUID4 string
     """
-    return str(uuid.uuid4())
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40  # Version 4
+    b[8] = (b[8] & 0x3F) | 0x80  # RFC 4122 variant
+    h = b.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
 
 
 def hash_identifier(identifier: str) -> str:
@@ -35,20 +54,54 @@ def hash_identifier(identifier: str) -> str:
     return hashlib.sha256(identifier.encode()).hexdigest()
 
 
+@lru_cache(maxsize=1)
+def _get_file_keys() -> Tuple[Optional[Fernet], Optional[bytes]]:
+    """
+    Build the process-wide encryption keys on first use.
+    
+    settings.encryption_key is fixed per process, so the Fernet cipher and
+    the derived file key are created once and shared by every
+    FileEncryption instance.
+    
+    Returns:
+        Tuple of (Fernet cipher, AES-256 file key), or (None, None) when
+        encryption is disabled
+    """
+    if not settings.enable_encryption:
+        return None, None
+    
+    # In production, load from secure key management service
+    cipher = Fernet(settings.encryption_key.encode())
+    # AES-256 key for streamed files, derived from the Fernet key
+    file_key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'hemoscan-file-encryption'
+    ).derive(base64.urlsafe_b64decode(settings.encryption_key))
+    return cipher, file_key
+
+
 class FileEncryption:
     """Handle file encryption/decryption for stored images."""
     
-    def __init__(self):
-        if settings.enable_encryption:
-            # In production, load from secure key management service
-            self.cipher = Fernet(settings.encryption_key.encode())
-        else:
-            self.cipher = None
+    @property
+    def cipher(self) -> Optional[Fernet]:
+        """Fernet cipher (legacy files), or None when encryption is disabled."""
+        return _get_file_keys()[0]
+    
+    @property
+    def _file_key(self) -> Optional[bytes]:
+        """AES-256 key for streamed files."""
+        return _get_file_keys()[1]
     
     def encrypt_file(self, file_path: Path) -> Path:
         """
         Encrypt a file in place.
         
+        The file is streamed through AES-256-GCM in 64 KB chunks, so memory
+        use does not grow with the file size.
+        
         Args:
             file_path: Path to file to encrypt
             
@@ -58,15 +111,18 @@ class FileEncryption:
         if not self.cipher:
             return file_path
         
+        encrypted_path = file_path.with_suffix(file_path.suffix + '.enc')
         try:
-            with open(file_path, 'rb') as f:
-                data = f.read()
-            
-            encrypted_data = self.cipher.encrypt(data)
-            encrypted_path = file_path.with_suffix(file_path.suffix + '.enc')
+            nonce = os.urandom(_NONCE_SIZE)
+            encryptor = Cipher(algorithms.AES(self._file_key), modes.GCM(nonce)).encryptor()
+            encryptor.authenticate_additional_data(_FILE_MAGIC)
             
-            with open(encrypted_path, 'wb') as f:
-                f.write(encrypted_data)
+            with open(file_path, 'rb') as src, open(encrypted_path, 'wb') as dst:
+                dst.write(_FILE_MAGIC + nonce)
+                while chunk := src.read(_CHUNK_SIZE):
+                    dst.write(encryptor.update(chunk))
+                dst.write(encryptor.finalize())
+                dst.write(encryptor.tag)
             
             # Remove original
             file_path.unlink()
@@ -75,12 +131,16 @@ class FileEncryption:
             
         except Exception as e:
             logger.error(f"Encryption failed for {file_path}: {e}")
+            encrypted_path.unlink(missing_ok=True)
             return file_path
     
     def decrypt_file(self, encrypted_path: Path) -> bytes:
         """
         Decrypt a file and return contents.
         
+        The whole file is authenticated before any plaintext is returned.
+        Legacy Fernet-encrypted files are still read.
+        
         Args:
             encrypted_path: Path to encrypted file
             
@@ -93,9 +153,30 @@ class FileEncryption:
         
         try:
             with open(encrypted_path, 'rb') as f:
-                encrypted_data = f.read()
+                header = f.read(len(_FILE_MAGIC) + _NONCE_SIZE)
+                if not header.startswith(_FILE_MAGIC):
+                    return self.cipher.decrypt(header + f.read())
+                
+                size = f.seek(0, os.SEEK_END)
+                f.seek(size - _TAG_SIZE)
+                tag = f.read(_TAG_SIZE)
+                f.seek(len(header))
+                
+                decryptor = Cipher(
+                    algorithms.AES(self._file_key),
+                    modes.GCM(header[len(_FILE_MAGIC):], tag)
+                ).decryptor()
+                decryptor.authenticate_additional_data(_FILE_MAGIC)
+                
+                plaintext = bytearray()
+                remaining = size - len(header) - _TAG_SIZE
+                while remaining > 0:
+                    chunk = f.read(min(_CHUNK_SIZE, remaining))
+                    remaining -= len(chunk)
+                    plaintext += decryptor.update(chunk)
+                plaintext += decryptor.finalize()
             
-            return self.cipher.decrypt(encrypted_data)
+            return bytes(plaintext)
             
         except Exception as e:
             logger.error(f"Decryption failed for {encrypted_path}: {e}")
@@ -1,122 +1,171 @@
 """
 Patch script to add feature-based mock predictions to hb_predictor.py
 This script carefully modifies the file to avoid corruption.
+
+Edits are made line by line so comments and formatting survive (ast.unparse
+would drop them); the ast module is used to skip an already patched file
+and to check that the result still parses before it is written.
 """
+import ast
+import sys
 
-# Read the original file
-with open('app/models/hb_predictor.py', 'r', encoding='utf-8') as f:
-    lines = f.readlines()
+TARGET = 'app/models/hb_predictor.py'
 
-# Find and modify the __init__ method
-modified_lines = []
-for i, line in enumerate(lines):
+# Method added to HbPredictor after features_to_array
+MOCK_PREDICTION_METHOD = tuple('''    
+    def predict_mock_from_features(
+        self,
+        features: Dict
+    ) -> Tuple[float, float, float, np.ndarray]:
+        """Generate realistic mock prediction from extracted features."""
+        mean_L = features["color"]["mean_L"]
+        ratio_R_G = features["color"]["ratio_R_G"]
+        vessel_density = features["vascular"]["vessel_density"]
+        mean_R = features["color"]["mean_R"]
+        
+        base_hb = 14.0
+        L_normalized = (mean_L - 60) / 20.0
+        L_factor = -L_normalized * 2.0
+        rg_normalized = (ratio_R_G - 1.05) / 0.15
+        rg_factor = rg_normalized * 1.5
+        vessel_normalized = (vessel_density - 0.15) / 0.1
+        vessel_factor = vessel_normalized * 0.8
+        red_normalized = (mean_R - 150) / 50.0
+        red_factor = red_normalized * 0.5
+        
+        hb_mean = base_hb + L_factor + rg_factor + vessel_factor + red_factor
+        hb_mean = float(np.clip(hb_mean, 8.0, 18.0))
+        
+        texture_uniformity = features["texture"].get("lbp_uniformity", 0.5)
+        base_std = 0.6 + (1.0 - texture_uniformity) * 0.4
+        hb_std = float(base_std + np.random.uniform(-0.1, 0.1))
+        uncertainty = float(min(hb_std / (hb_mean + 1e-6), 0.5))
+        
+        if hb_mean >= 12.0:
+            anemia_probs = np.array([0.75, 0.15, 0.08, 0.02])
+        elif hb_mean >= 11.0:
+            anemia_probs = np.array([0.25, 0.55, 0.15, 0.05])
+        elif hb_mean >= 8.0:
+            anemia_probs = np.array([0.10, 0.25, 0.55, 0.10])
+        else:
+            anemia_probs = np.array([0.05, 0.10, 0.30, 0.55])
+        
+        logger.info(f"Mock prediction: Hb={hb_mean:.2f}±{hb_std:.2f} g/dL (L*={mean_L:.1f}, R/G={ratio_R_G:.3f})")
+        return hb_mean, hb_std, uncertainty, anemia_probs
+'''.splitlines(keepends=True))
+
+# Check inserted after the predict_with_uncertainty docstring
+MOCK_PREDICTION_CHECK = tuple('''        # Use mock predictions if model not trained
+        if not self.is_trained or self.model is None:
+            logger.info("Using feature-based mock predictions (no trained model)")
+            return self.predict_mock_from_features(features)
+        
+'''.splitlines(keepends=True))
+
+
+def _has_mock_method(source: str) -> bool:
+    """Whether HbPredictor already defines predict_mock_from_features."""
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.ClassDef) and node.name == 'HbPredictor':
+            return any(
+                isinstance(item, ast.FunctionDef) and item.name == 'predict_mock_from_features'
+                for item in node.body
+            )
+    return False
+
+
+def _docstring_end(source: str, method: str) -> int:
+    """0-based index of the last docstring line of a method, or -1."""
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.FunctionDef) and node.name == method and ast.get_docstring(node) is not None:
+            return node.body[0].end_lineno - 1
+    return -1
+
+
+def _insert_after(*extra):
+    """Handler that keeps the line and adds `extra` lines after it."""
+    return lambda lines, i: [lines[i], *extra]
+
+
+def _replace_with(*replacement):
+    """Handler that replaces the line with `replacement` lines."""
+    return lambda lines, i: list(replacement)
+
+
+def _drop_untrained_model(lines, i):
+    """Replace the untrained model built after a placeholder/untrained warning."""
+    if i > 0 and ('Using placeholder' in lines[i-1] or 'Using untrained model' in lines[i-1]):
+        return ['            self.model = None\n', '            self.is_trained = False\n']
+    return None
+
+
+def _add_mock_method(lines, i):
+    """Add the mock prediction method after features_to_array."""
+    if i + 2 < len(lines) and 'def predict_with_uncertainty' in lines[i+2]:
+        return [lines[i], *MOCK_PREDICTION_METHOD]
+    return None
+
+
+# Edits keyed by the stripped source line; a handler returns the lines to
+# emit in its place, or None to keep the line as is
+HANDLERS = {
     # Add is_trained flag after model_path assignment
-    if 'self.model_path = model_path or settings.hb_model_path' in line:
-        modified_lines.append(line)
-        modified_lines.append('        self.is_trained = False\n')
-        continue
-    
+    'self.model_path = model_path or settings.hb_model_path': _insert_after(
+        '        self.is_trained = False\n'
+    ),
     # Modify the else block in __init__
-    if 'logger.warning(f"Hb model not found at {self.model_path}. Using placeholder.")' in line:
-        modified_lines.append('            logger.warning(f"Hb model not found at {self.model_path}. Using feature-based mock predictions.")\n')
-        continue
-    
-    if i > 0 and 'Using placeholder' in lines[i-1] and 'self.model = build_hb_predictor()' in line:
-        modified_lines.append('            self.model = None\n')
-        modified_lines.append('            self.is_trained = False\n')
-        continue
-    
+    'logger.warning(f"Hb model not found at {self.model_path}. Using placeholder.")': _replace_with(
+        '            logger.warning(f"Hb model not found at {self.model_path}. Using feature-based mock predictions.")\n'
+    ),
+    'self.model = build_hb_predictor()': _drop_untrained_model,
     # Modify load_model to set is_trained
-    if 'self.model = keras.models.load_model(str(self.model_path))' in line:
-        modified_lines.append(line)
-        modified_lines.append('            self.is_trained = True\n')
-        continue
-    
+    'self.model = keras.models.load_model(str(self.model_path))': _insert_after(
+        '            self.is_trained = True\n'
+    ),
     # Modify load_model error handling
-    if 'logger.warning("Using untrained model")' in line:
-        modified_lines.append('            logger.warning("Falling back to feature-based mock predictions")\n')
-        continue
-    
-    if i > 0 and 'Using untrained model' in lines[i-1] and 'self.model = build_hb_predictor()' in line:
-        modified_lines.append('            self.model = None\n')
-        modified_lines.append('            self.is_trained = False\n')
-        continue
-    
-    # Add mock prediction method after features_to_array
-    if 'return feature_array' in line and i < len(lines) - 1 and 'def predict_with_uncertainty' in lines[i+2]:
+    'logger.warning("Using untrained model")': _replace_with(
+        '            logger.warning("Falling back to feature-based mock predictions")\n'
+    ),
+    'return feature_array': _add_mock_method
+}
+
+
+# Read the original file
+with open(TARGET, 'r', encoding='utf-8') as f:
+    source = f.read()
+
+if _has_mock_method(source):
+    print("hb_predictor.py already has predict_mock_from_features; nothing to do")
+    sys.exit(0)
+
+lines = source.splitlines(keepends=True)
+docstring_end = _docstring_end(source, 'predict_with_uncertainty')
+
+# Apply the edits
+modified_lines = []
+for i, line in enumerate(lines):
+    handler = HANDLERS.get(line.strip())
+    replacement = handler(lines, i) if handler else None
+    if replacement is not None:
+        modified_lines.extend(replacement)
+    else:
         modified_lines.append(line)
-        modified_lines.append('    \n')
-        modified_lines.append('    def predict_mock_from_features(\n')
-        modified_lines.append('        self,\n')
-        modified_lines.append('        features: Dict\n')
-        modified_lines.append('    ) -> Tuple[float, float, float, np.ndarray]:\n')
-        modified_lines.append('        """Generate realistic mock prediction from extracted features."""\n')
-        modified_lines.append('        mean_L = features["color"]["mean_L"]\n')
-        modified_lines.append('        ratio_R_G = features["color"]["ratio_R_G"]\n')
-        modified_lines.append('        vessel_density = features["vascular"]["vessel_density"]\n')
-        modified_lines.append('        mean_R = features["color"]["mean_R"]\n')
-        modified_lines.append('        \n')
-        modified_lines.append('        base_hb = 14.0\n')
-        modified_lines.append('        L_normalized = (mean_L - 60) / 20.0\n')
-        modified_lines.append('        L_factor = -L_normalized * 2.0\n')
-        modified_lines.append('        rg_normalized = (ratio_R_G - 1.05) / 0.15\n')
-        modified_lines.append('        rg_factor = rg_normalized * 1.5\n')
-        modified_lines.append('        vessel_normalized = (vessel_density - 0.15) / 0.1\n')
-        modified_lines.append('        vessel_factor = vessel_normalized * 0.8\n')
-        modified_lines.append('        red_normalized = (mean_R - 150) / 50.0\n')
-        modified_lines.append('        red_factor = red_normalized * 0.5\n')
-        modified_lines.append('        \n')
-        modified_lines.append('        hb_mean = base_hb + L_factor + rg_factor + vessel_factor + red_factor\n')
-        modified_lines.append('        hb_mean = float(np.clip(hb_mean, 8.0, 18.0))\n')
-        modified_lines.append('        \n')
-        modified_lines.append('        texture_uniformity = features["texture"].get("lbp_uniformity", 0.5)\n')
-        modified_lines.append('        base_std = 0.6 + (1.0 - texture_uniformity) * 0.4\n')
-        modified_lines.append('        hb_std = float(base_std + np.random.uniform(-0.1, 0.1))\n')
-        modified_lines.append('        uncertainty = float(min(hb_std / (hb_mean + 1e-6), 0.5))\n')
-        modified_lines.append('        \n')
-        modified_lines.append('        if hb_mean >= 12.0:\n')
-        modified_lines.append('            anemia_probs = np.array([0.75, 0.15, 0.08, 0.02])\n')
-        modified_lines.append('        elif hb_mean >= 11.0:\n')
-        modified_lines.append('            anemia_probs = np.array([0.25, 0.55, 0.15, 0.05])\n')
-        modified_lines.append('        elif hb_mean >= 8.0:\n')
-        modified_lines.append('            anemia_probs = np.array([0.10, 0.25, 0.55, 0.10])\n')
-        modified_lines.append('        else:\n')
-        modified_lines.append('            anemia_probs = np.array([0.05, 0.10, 0.30, 0.55])\n')
-        modified_lines.append('        \n')
-        modified_lines.append('        logger.info(f"Mock prediction: Hb={hb_mean:.2f}±{hb_std:.2f} g/dL (L*={mean_L:.1f}, R/G={ratio_R_G:.3f})")\n')
-        modified_lines.append('        return hb_mean, hb_std, uncertainty, anemia_probs\n')
-        continue
     
     # Add check at beginning of predict_with_uncertainty
-    if '"""' in line and i > 0 and 'Predict Hb with uncertainty' in lines[i-1]:
-        modified_lines.append(line)
-        # Find the next line after the docstring closes
-        j = i + 1
-        while j < len(lines) and '"""' not in lines[j]:
-            j += 1
-        # Add lines up to and including closing """
-        for k in range(i+1, j+1):
-            modified_lines.append(lines[k])
-        # Add the mock prediction check
-        modified_lines.append('        # Use mock predictions if model not trained\n')
-        modified_lines.append('        if not self.is_trained or self.model is None:\n')
-        modified_lines.append('            logger.info("Using feature-based mock predictions (no trained model)")\n')
-        modified_lines.append('            return self.predict_mock_from_features(features)\n')
-        modified_lines.append('        \n')
-        # Skip to after the docstring
-        for k in range(i+1, j+1):
-            lines[k] = None  # Mark as processed
-        continue
-    
-    # Skip lines that were already processed
-    if line is None:
-        continue
-    
-    modified_lines.append(line)
+    if i == docstring_end:
+        modified_lines.extend(MOCK_PREDICTION_CHECK)
+
+# Refuse to write a result that no longer parses
+patched = ''.join(modified_lines)
+try:
+    ast.parse(patched)
+except SyntaxError as e:
+    print(f"Patch would corrupt hb_predictor.py ({e}); file left unchanged")
+    sys.exit(1)
 
 # Write the modified file
-with open('app/models/hb_predictor.py', 'w', encoding='utf-8') as f:
-    f.writelines(modified_lines)
+with open(TARGET, 'w', encoding='utf-8') as f:
+    f.write(patched)
 
 print("Successfully patched hb_predictor.py")
 print("Changes made:")
@@ -1,8 +1,33 @@
 """
 Pytest configuration.
 """
+import os
 import sys
 from pathlib import Path
 
 # Add app directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Under pytest-xdist (pytest -n auto) give each worker its own SQLite file,
+# so one worker's setup_database teardown can't drop another's tables. Set
+# before the test modules import app, which binds the engine on import.
+_XDIST_WORKER = os.environ.get("PYTEST_XDIST_WORKER")
+_WORKER_DB = Path(__file__).parent.parent / "data" / f"test_{_XDIST_WORKER}.db"
+if _XDIST_WORKER:
+    os.environ["DATABASE_URL"] = f"sqlite:///{_WORKER_DB}"
+
+
+def pytest_sessionstart(session):
+    """Create the tables in the worker's database, as app startup would."""
+    if _XDIST_WORKER:
+        from app.database.models import init_db
+        init_db()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    """Close the worker's database and remove its files."""
+    if _XDIST_WORKER:
+        from app.database.models import engine
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{_WORKER_DB}{suffix}").unlink(missing_ok=True)
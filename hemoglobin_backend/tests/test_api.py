@@ -4,10 +4,17 @@ Unit tests for API endpoints.
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.database.models import Base, engine
+from app.config import settings
+from app.database.models import Base, SessionLocal, engine
+from app.database.crud import create_scan_record
+from app.routes import scan as scan_routes
+from app.schemas import Explainability, QualityReport, ScanResponse
+from app.utils.security import generate_scan_id
 import io
-from PIL import Image
 import numpy as np
+import pybase64
+from functools import lru_cache
+from PIL import Image
 
 client = TestClient(app)
 
@@ -20,16 +27,20 @@ def setup_database():
     Base.metadata.drop_all(bind=engine)
 
 
-def create_test_image(size=(512, 512), color=(200, 150, 150)):
-    """Create a test image."""
-    img_array = np.full((size[0], size[1], 3), color, dtype=np.uint8)
-    img = Image.fromarray(img_array)
+@lru_cache(maxsize=None)
+def _encode_test_image(size, color):
+    """JPEG bytes of a solid-color image, encoded once per size and color."""
+    img = Image.new('RGB', (size[1], size[0]), color)
     
     img_bytes = io.BytesIO()
     img.save(img_bytes, format='JPEG')
-    img_bytes.seek(0)
     
-    return img_bytes
+    return img_bytes.getvalue()
+
+
+def create_test_image(size=(512, 512), color=(200, 150, 150)):
+    """Create a test image."""
+    return io.BytesIO(_encode_test_image(tuple(size), tuple(color)))
 
 
 def test_health_check():
@@ -41,6 +52,19 @@ def test_health_check():
     assert "version" in data
 
 
+@pytest.mark.parametrize("origin, allowed", [
+    (settings.cors_origins[0], True),
+    ("http://evil.example", False)
+])
+def test_cors_origins(origin, allowed):
+    """Test that CORS allows exactly the configured origins."""
+    response = client.options(
+        "/api/v1/health",
+        headers={"Origin": origin, "Access-Control-Request-Method": "GET"}
+    )
+    assert (response.headers.get("access-control-allow-origin") == origin) is allowed
+
+
 def test_root_endpoint():
     """Test root endpoint."""
     response = client.get("/")
@@ -103,14 +127,20 @@ def test_get_scan_not_found():
     assert response.status_code == 404
 
 
-def test_get_scan_existing(setup_database):
-    """Test retrieving existing scan."""
-    # First create a scan
+@pytest.fixture(scope="module")
+def uploaded_scan(setup_database):
+    """Upload response for one scan, shared by the tests that read it back."""
     img_bytes = create_test_image()
-    create_response = client.post(
+    return client.post(
         "/api/v1/scan",
         files={"file": ("test.jpg", img_bytes, "image/jpeg")}
     )
+
+
+def test_get_scan_existing(uploaded_scan):
+    """Test retrieving existing scan."""
+    # First create a scan
+    create_response = uploaded_scan
     
     assert create_response.status_code == 200
     scan_id = create_response.json()["scan_id"]
@@ -123,14 +153,10 @@ def test_get_scan_existing(setup_database):
     assert data["scan_id"] == scan_id
 
 
-def test_get_report(setup_database):
+def test_get_report(uploaded_scan):
     """Test report generation."""
     # First create a scan
-    img_bytes = create_test_image()
-    create_response = client.post(
-        "/api/v1/scan",
-        files={"file": ("test.jpg", img_bytes, "image/jpeg")}
-    )
+    create_response = uploaded_scan
     
     assert create_response.status_code == 200
     scan_id = create_response.json()["scan_id"]
@@ -141,6 +167,141 @@ def test_get_report(setup_database):
     assert report_response.headers["content-type"] == "application/pdf"
 
 
+@pytest.fixture
+def stored_scan(setup_database):
+    """A stored scan with saved Grad-CAM and feature importance images."""
+    scan_id = generate_scan_id()
+    image_url = f"/api/v1/image/{scan_id}"
+    scan = ScanResponse(
+        scan_id=scan_id,
+        quality=QualityReport(
+            sharpness=120.0,
+            brightness=128.0,
+            contrast=40.0,
+            motion_blur_score=0.1,
+            quality_pass=True
+        ),
+        explainability=Explainability(
+            gradcam_overlay_url=f"{image_url}/gradcam",
+            feature_importance_plot_url=f"{image_url}/importance"
+        )
+    )
+    with SessionLocal() as db:
+        create_scan_record(db, scan)
+    
+    images = {
+        'gradcam': _encode_test_image((32, 32), (255, 0, 0)),
+        'importance': b'<svg xmlns="http://www.w3.org/2000/svg"/>'
+    }
+    image_paths = scan_routes._scan_image_paths(scan_id)
+    for kind, data in images.items():
+        image_paths[kind][0].write_bytes(data)
+    
+    yield scan_id, images
+    
+    for path, _ in image_paths.values():
+        path.unlink(missing_ok=True)
+
+
+def test_get_scan_image(stored_scan):
+    """Test downloading saved scan images."""
+    scan_id, images = stored_scan
+    
+    response = client.get(f"/api/v1/image/{scan_id}/gradcam")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.content == images['gradcam']
+    
+    response = client.get(f"/api/v1/image/{scan_id}/importance")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("image/svg+xml")
+    assert response.content == images['importance']
+
+
+@pytest.mark.parametrize("path", [
+    "/api/v1/image/not-a-uuid/gradcam",
+    "/api/v1/image/{scan_id}/mask",
+    "/api/v1/image/{scan_id}/original"
+])
+def test_get_scan_image_not_found(stored_scan, path):
+    """Test invalid scan IDs, unknown kinds and unsaved images."""
+    scan_id, _ = stored_scan
+    response = client.get(path.format(scan_id=scan_id))
+    assert response.status_code == 404
+
+
+def test_get_scan_include_images(stored_scan):
+    """Test inlining the saved images only when include_images is set."""
+    scan_id, images = stored_scan
+    
+    data = client.get(f"/api/v1/scan/{scan_id}").json()
+    assert data["explainability"]["gradcam_nail_overlay"] is None
+    assert data["explainability"]["feature_importance_plot"] is None
+    
+    data = client.get(f"/api/v1/scan/{scan_id}", params={"include_images": True}).json()
+    explainability = data["explainability"]
+    assert explainability["gradcam_nail_overlay"] == (
+        f"data:image/jpeg;base64,{pybase64.b64encode_as_string(images['gradcam'])}"
+    )
+    assert explainability["feature_importance_plot"] == (
+        f"data:image/svg+xml;base64,{pybase64.b64encode_as_string(images['importance'])}"
+    )
+    assert explainability["gradcam_overlay_url"] == f"/api/v1/image/{scan_id}/gradcam"
+    # Sections the scan doesn't have stay empty
+    assert data["preprocessing"] is None
+
+
+@pytest.mark.parametrize("embed", [False, True])
+def test_scan_explainability_images(setup_database, monkeypatch, embed):
+    """Test that the Grad-CAM and importance images follow embed_images_base64."""
+    # Skip hand detection so a synthetic image reaches explainability
+    monkeypatch.setattr(
+        scan_routes,
+        "validate_upload",
+        lambda f, filename: (np.asarray(Image.open(f).convert('RGB')), {})
+    )
+    monkeypatch.setattr(settings, "embed_images_base64", embed)
+    
+    rng = np.random.default_rng(0)
+    image = (rng.random((600, 600, 3)) * 60 + [200, 140, 130]).clip(0, 255).astype(np.uint8)
+    image[::7] = 90
+    img_bytes = io.BytesIO()
+    Image.fromarray(image).save(img_bytes, format='JPEG')
+    img_bytes.seek(0)
+    
+    response = client.post(
+        "/api/v1/scan",
+        files={"file": ("test.jpg", img_bytes, "image/jpeg")}
+    )
+    assert response.status_code == 200
+    explainability = response.json()["explainability"]
+    
+    for field, url_field, media_type in (
+        ("gradcam_nail_overlay", "gradcam_overlay_url", "image/jpeg"),
+        ("feature_importance_plot", "feature_importance_plot_url", "image/svg+xml")
+    ):
+        saved = client.get(explainability[url_field])
+        assert saved.status_code == 200
+        if embed:
+            encoded = pybase64.b64encode_as_string(saved.content)
+            assert explainability[field] == f"data:{media_type};base64,{encoded}"
+        else:
+            assert explainability[field] is None
+
+
+def test_bgr_buffer_is_capped():
+    """Test that large encodes don't grow the per-thread scratch buffer."""
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    side = int((scan_routes._BGR_BUFFER_MAX_BYTES / 3) ** 0.5) + 1
+    large = rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+    
+    np.testing.assert_array_equal(scan_routes._to_bgr(small), small[..., ::-1])
+    np.testing.assert_array_equal(scan_routes._to_bgr(large), large[..., ::-1])
+    
+    assert scan_routes._bgr_buffers.buffer.size <= scan_routes._BGR_BUFFER_MAX_BYTES
+
+
 def test_metrics_endpoint():
     """Test Prometheus metrics endpoint."""
     response = client.get("/metrics")
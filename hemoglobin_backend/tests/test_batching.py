@@ -0,0 +1,137 @@
+"""
+Unit tests for inference micro-batching.
+"""
+import threading
+import pytest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from app.models.batching import InferenceBatcher
+
+
+def run_concurrently(batcher, inputs_list):
+    """Submit every input from its own thread at the same time."""
+    barrier = threading.Barrier(len(inputs_list))
+    
+    def submit(inputs):
+        barrier.wait()
+        return batcher(*inputs)
+    
+    with ThreadPoolExecutor(max_workers=len(inputs_list)) as pool:
+        futures = [pool.submit(submit, inputs) for inputs in inputs_list]
+        return [future.result(timeout=10) for future in futures]
+
+
+def test_single_submission():
+    """Test one call passing straight through."""
+    batcher = InferenceBatcher(lambda x: x * 2, name="test", max_batch_size=4, max_wait_ms=0)
+    
+    x = np.arange(6, dtype=np.float32).reshape(3, 2)
+    
+    np.testing.assert_array_equal(batcher(x), x * 2)
+
+
+def test_concurrent_calls_coalesce():
+    """Test that concurrent calls share one forward pass."""
+    batch_sizes = []
+    
+    def infer(x):
+        batch_sizes.append(len(x))
+        return x + 1
+    
+    # Wait long enough that all four submissions make the same batch
+    batcher = InferenceBatcher(infer, name="test", max_batch_size=4, max_wait_ms=5000)
+    inputs_list = [(np.full((1, 3), i, dtype=np.float32),) for i in range(4)]
+    
+    results = run_concurrently(batcher, inputs_list)
+    
+    assert batch_sizes == [4]
+    for (x,), result in zip(inputs_list, results):
+        np.testing.assert_array_equal(result, x + 1)
+
+
+def test_per_request_slicing():
+    """Test that each caller gets back its own rows of every output."""
+    def infer(images, features):
+        return images.sum(axis=(1, 2)), features * 10
+    
+    batcher = InferenceBatcher(infer, name="test", max_batch_size=3, max_wait_ms=5000)
+    rng = np.random.default_rng(0)
+    inputs_list = [
+        (rng.random((n, 4, 4)), rng.random((n, 5)))
+        for n in (1, 2, 3)
+    ]
+    
+    results = run_concurrently(batcher, inputs_list)
+    
+    for (images, features), (sums, scaled) in zip(inputs_list, results):
+        assert sums.shape == (len(images),)
+        np.testing.assert_allclose(sums, images.sum(axis=(1, 2)))
+        np.testing.assert_allclose(scaled, features * 10)
+
+
+def test_exception_reaches_every_caller():
+    """Test that a failing forward pass raises in each caller of the batch."""
+    calls = []
+    
+    def infer(x):
+        calls.append(len(x))
+        if len(calls) == 1:
+            raise RuntimeError("forward pass failed")
+        return x
+    
+    batcher = InferenceBatcher(infer, name="test", max_batch_size=2, max_wait_ms=5000)
+    inputs_list = [(np.zeros((1, 2)),), (np.ones((1, 2)),)]
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        barrier = threading.Barrier(2)
+        
+        def submit(inputs):
+            barrier.wait()
+            with pytest.raises(RuntimeError, match="forward pass failed"):
+                batcher(*inputs)
+        
+        for future in [pool.submit(submit, inputs) for inputs in inputs_list]:
+            future.result(timeout=10)
+    
+    # The worker survives and serves later calls
+    batcher.max_batch_size = 1
+    np.testing.assert_array_equal(batcher(np.ones((1, 2))), np.ones((1, 2)))
+
+
+@pytest.mark.parametrize("bad_output", [
+    lambda x: x[:-1],
+    lambda x: (x, np.float32(1.0)),
+    lambda x: np.float32(1.0)
+])
+def test_malformed_output_raises(bad_output):
+    """Test that outputs not matching the batch raise instead of hanging."""
+    calls = []
+    
+    def infer(x):
+        calls.append(len(x))
+        return bad_output(x) if len(calls) == 1 else x
+    
+    batcher = InferenceBatcher(infer, name="test", max_batch_size=1, max_wait_ms=0, timeout_s=10)
+    
+    with pytest.raises(ValueError, match="doesn't match the batch"):
+        batcher(np.zeros((2, 3)))
+    
+    # The worker survives and serves later calls
+    np.testing.assert_array_equal(batcher(np.ones((2, 3))), np.ones((2, 3)))
+
+
+def test_result_timeout():
+    """Test that a caller gives up instead of blocking forever."""
+    release = threading.Event()
+    
+    def infer(x):
+        release.wait(timeout=10)
+        return x
+    
+    batcher = InferenceBatcher(infer, name="test", max_batch_size=1, max_wait_ms=0, timeout_s=0.2)
+    
+    try:
+        with pytest.raises(TimeoutError):
+            batcher(np.zeros((1, 2)))
+    finally:
+        release.set()
@@ -0,0 +1,57 @@
+"""
+Unit tests for Grad-CAM explainability.
+"""
+import gc
+import weakref
+import numpy as np
+import tensorflow as tf
+from app.services import explainability
+from app.services.explainability import compute_gradcam
+
+
+def build_model():
+    """Small two-input model with a conv layer and a regression output."""
+    image_input = tf.keras.Input(shape=(32, 32, 3), name='image_input')
+    tabular_input = tf.keras.Input(shape=(4,), name='tabular_input')
+    
+    x = tf.keras.layers.Conv2D(4, 3, name='conv_last')(image_input)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    x = tf.keras.layers.concatenate([x, tabular_input])
+    hb_output = tf.keras.layers.Dense(3, name='hb_regression')(x)
+    anemia_output = tf.keras.layers.Dense(4, activation='softmax', name='anemia_classification')(x)
+    
+    return tf.keras.Model(inputs=[image_input, tabular_input], outputs=[hb_output, anemia_output])
+
+
+def run_gradcam(model):
+    """Grad-CAM heatmap for a blank input."""
+    return compute_gradcam(
+        model,
+        np.zeros((1, 32, 32, 3), dtype=np.uint8),
+        np.zeros((1, 4), dtype=np.float32)
+    )
+
+
+def test_gradcam_step_is_reused():
+    """Test that the traced step is built once per model and layer."""
+    model = build_model()
+    
+    heatmap = run_gradcam(model)
+    
+    assert heatmap.shape == (30, 30)
+    assert explainability._gradcam_steps[model].keys() == {'conv_last'}
+    step = explainability._gradcam_steps[model]['conv_last']
+    run_gradcam(model)
+    assert explainability._gradcam_steps[model]['conv_last'] is step
+
+
+def test_gradcam_cache_releases_model():
+    """Test that the cached step doesn't keep a released model alive."""
+    model = build_model()
+    run_gradcam(model)
+    
+    model_ref = weakref.ref(model)
+    del model
+    gc.collect()
+    
+    assert model_ref() is None
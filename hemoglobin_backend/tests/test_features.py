@@ -3,34 +3,43 @@ Unit tests for feature extraction.
 """
 import pytest
 import numpy as np
+from skimage.filters import frangi
+from app.config import Settings
+from app.schemas import FEATURE_VECTOR_FIELDS, Features
 from app.services.feature_extraction import (
     extract_color_features,
     extract_texture_features,
     extract_vascular_features,
-    extract_all_features
+    extract_all_features,
+    frangi_filter
 )
 
 
 def create_test_roi(size=(256, 256)):
     """Create a test ROI image."""
     # Create gradient image for more realistic features
-    roi = np.zeros((size[0], size[1], 3), dtype=np.uint8)
+    i = np.arange(size[0], dtype=np.float64)[:, None]
+    j = np.arange(size[1], dtype=np.float64)[None, :]
+    channels = np.broadcast_arrays(
+        150 + 50 * i / size[0],
+        130 + 30 * j / size[1],
+        140 + 40 * (i + j) / (size[0] + size[1])
+    )
     
-    for i in range(size[0]):
-        for j in range(size[1]):
-            roi[i, j] = [
-                int(150 + 50 * i / size[0]),
-                int(130 + 30 * j / size[1]),
-                int(140 + 40 * (i + j) / (size[0] + size[1]))
-            ]
-    
-    return roi
+    # Truncate like int() (all values are positive)
+    return np.stack(channels, axis=-1).astype(np.uint8)
+
 
+@pytest.fixture(scope="module")
+def roi():
+    """Test ROI shared by the module's tests (read-only, so no test can alter it)."""
+    image = create_test_roi()
+    image.flags.writeable = False
+    return image
 
-def test_extract_color_features():
+
+def test_extract_color_features(roi):
     """Test color feature extraction."""
-    roi = create_test_roi()
-    
     features = extract_color_features(roi)
     
     # Check all fields exist
@@ -44,10 +53,8 @@ def test_extract_color_features():
     assert features.ratio_R_G > 0
 
 
-def test_extract_texture_features():
+def test_extract_texture_features(roi):
     """Test texture feature extraction."""
-    roi = create_test_roi()
-    
     features = extract_texture_features(roi)
     
     # Check all fields exist
@@ -62,10 +69,8 @@ def test_extract_texture_features():
     assert 0 <= features.lbp_uniformity <= 1
 
 
-def test_extract_vascular_features():
+def test_extract_vascular_features(roi):
     """Test vascular feature extraction."""
-    roi = create_test_roi()
-    
     features = extract_vascular_features(roi)
     
     # Check all fields exist
@@ -79,10 +84,42 @@ def test_extract_vascular_features():
     assert features.orientation_entropy >= 0
 
 
-def test_extract_all_features():
-    """Test complete feature extraction."""
-    roi = create_test_roi()
+@pytest.mark.parametrize("pyramid", [None, False])
+@pytest.mark.parametrize("image", ["roi", "noise"])
+def test_frangi_filter_matches_skimage(roi, image, pyramid):
+    """Test that the exact (and default) Frangi path is bit-identical to skimage's."""
+    if image == "roi":
+        green = roi[:, :, 1]
+    else:
+        green = np.random.default_rng(0).integers(0, 256, (96, 128), dtype=np.uint8)
+    
+    expected = frangi(green, sigmas=range(1, 5), black_ridges=False)
+    
+    response = frangi_filter(green, scale_range=(1, 4), scale_step=1, pyramid=pyramid)
+    
+    np.testing.assert_array_equal(response, expected)
+
+
+def test_frangi_pyramid_is_opt_in():
+    """Test that the approximate pyramid path is off by default."""
+    assert Settings.model_fields['frangi_pyramid'].default is False
+
+
+def test_vessel_density_regression(roi):
+    """Test vessel density on the fixed ROI against skimage's thresholded response."""
+    # The response has a plateau of tied values at the 90th percentile, so
+    # any drift from skimage shows up here
+    response = frangi(roi[:, :, 1], sigmas=range(1, 5), black_ridges=False)
+    expected = np.count_nonzero(response > np.percentile(response, 90)) / response.size
+    
+    features = extract_vascular_features(roi)
     
+    assert features.vessel_density == expected
+    assert features.vessel_density == 0.02734375
+
+
+def test_extract_all_features(roi):
+    """Test complete feature extraction."""
     features = extract_all_features(roi)
     
     # Check all feature groups exist
@@ -94,3 +131,33 @@ def test_extract_all_features():
     assert features.color.mean_L > 0
     assert features.texture.glcm_contrast >= 0
     assert 0 <= features.vascular.vessel_density <= 1
+
+
+def test_feature_vector_round_trip(roi):
+    """Test that to_vector and from_vector preserve every feature."""
+    features = extract_all_features(roi)
+    vector = features.to_vector()
+    
+    assert vector.shape == (len(FEATURE_VECTOR_FIELDS),)
+    assert vector.dtype == np.float32
+    for (group, name), value in zip(FEATURE_VECTOR_FIELDS, vector):
+        assert value == np.float32(getattr(getattr(features, group), name))
+    
+    rebuilt = Features.from_vector(vector)
+    np.testing.assert_array_equal(rebuilt.to_vector(), vector)
+    
+    with pytest.raises(ValueError):
+        Features.from_vector(vector[:-1])
+
+
+def test_feature_vector_tracks_mutation(roi):
+    """Test that the vector reflects features changed after a first call."""
+    features = extract_all_features(roi)
+    features.to_vector()
+    
+    features.color.mean_L = 42.0
+    features.vascular = features.vascular.model_copy(update={'vessel_density': 0.5})
+    
+    vector = features.to_vector()
+    assert vector[FEATURE_VECTOR_FIELDS.index(('color', 'mean_L'))] == 42.0
+    assert vector[FEATURE_VECTOR_FIELDS.index(('vascular', 'vessel_density'))] == 0.5
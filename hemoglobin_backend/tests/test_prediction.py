@@ -0,0 +1,62 @@
+"""
+Unit tests for anemia classification.
+"""
+import pytest
+import numpy as np
+from app.config import settings
+from app.schemas import AnemiaStage
+from app.services.prediction import classify_anemia, classify_anemia_batch
+
+
+def boundary_values():
+    """Each threshold, its neighbouring floats and out-of-range values."""
+    values = [np.nan, -np.inf, np.inf, -1.0, 0.0, 5.0, 20.0]
+    for threshold in (
+        settings.anemia_threshold_moderate,
+        settings.anemia_threshold_mild,
+        settings.anemia_threshold_normal
+    ):
+        values += [
+            threshold,
+            np.nextafter(threshold, -np.inf),
+            np.nextafter(threshold, np.inf),
+            threshold - 0.05,
+            threshold + 0.05
+        ]
+    return np.array(values)
+
+
+def test_classify_anemia_thresholds():
+    """Test scalar classification on each side of the thresholds."""
+    assert classify_anemia(settings.anemia_threshold_normal) == AnemiaStage.NORMAL
+    assert classify_anemia(settings.anemia_threshold_mild) == AnemiaStage.MILD
+    assert classify_anemia(settings.anemia_threshold_moderate) == AnemiaStage.MODERATE
+    assert classify_anemia(settings.anemia_threshold_moderate - 0.1) == AnemiaStage.SEVERE
+    assert classify_anemia(float('nan')) == AnemiaStage.SEVERE
+
+
+def test_classify_anemia_batch_matches_scalar():
+    """Test that batch classification agrees with classify_anemia everywhere."""
+    values = boundary_values()
+    
+    stages = classify_anemia_batch(values)
+    
+    assert list(stages) == [classify_anemia(float(v)) for v in values]
+
+
+def test_classify_anemia_batch_nan_is_severe():
+    """Test that NaN is SEVERE, as in classify_anemia."""
+    stages = classify_anemia_batch(np.array([np.nan, 15.0, np.nan]))
+    
+    assert list(stages) == [AnemiaStage.SEVERE, AnemiaStage.NORMAL, AnemiaStage.SEVERE]
+
+
+@pytest.mark.parametrize("shape", [(), (6,), (2, 3)])
+def test_classify_anemia_batch_shape(shape):
+    """Test that the output keeps the input shape."""
+    values = np.full(shape, 10.0)
+    
+    stages = classify_anemia_batch(values)
+    
+    assert stages.shape == shape
+    assert all(stage == classify_anemia(10.0) for stage in stages.ravel())
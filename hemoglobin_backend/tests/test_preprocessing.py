@@ -5,6 +5,8 @@ import pytest
 import numpy as np
 from PIL import Image
 import cv2
+from app.config import settings
+from app.schemas import QualityReport
 from app.services.preprocessing import (
     center_crop_and_resize,
     apply_white_balance,
@@ -20,6 +22,14 @@ def create_test_image(size=(512, 512), color=(180, 140, 140)):
     return img_array
 
 
+@pytest.fixture(scope="module")
+def img_bgr():
+    """BGR test image shared by the module's tests (read-only; copy to modify)."""
+    image = cv2.cvtColor(create_test_image(), cv2.COLOR_RGB2BGR)
+    image.flags.writeable = False
+    return image
+
+
 def test_center_crop_and_resize():
     """Test center crop and resize."""
     # Rectangular image
@@ -30,37 +40,30 @@ def test_center_crop_and_resize():
     assert resized.shape == (256, 256, 3)
 
 
-def test_apply_white_balance():
+def test_apply_white_balance(img_bgr):
     """Test white balance correction."""
-    img = create_test_image()
-    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    
     balanced = apply_white_balance(img_bgr)
     
     assert balanced.shape == img_bgr.shape
     assert balanced.dtype == np.uint8
 
 
-def test_detect_glare():
+def test_detect_glare(img_bgr):
     """Test glare detection."""
-    img = create_test_image()
+    img = img_bgr.copy()
     
     # Add bright spot (glare)
     img[100:150, 100:150] = [250, 250, 250]
-    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
     
-    glare_mask, coverage = detect_glare(img_bgr)
+    glare_mask, coverage = detect_glare(img)
     
     assert glare_mask.shape == (512, 512)
     assert 0 <= coverage <= 1
     assert coverage > 0  # Should detect the bright spot
 
 
-def test_estimate_skin_tone():
+def test_estimate_skin_tone(img_bgr):
     """Test skin tone estimation."""
-    img = create_test_image()
-    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    
     cluster_id, lab_mean = estimate_skin_tone(img_bgr)
     
     assert 0 <= cluster_id < 5
@@ -87,3 +90,49 @@ def test_preprocess_image():
     assert len(report.lab_mean) == 3
     assert 0 < report.scaling_factor < 2
     assert 0 <= report.glare_mask_coverage <= 1
+
+
+def make_quality_report(quality_pass):
+    """QC report that passed or failed."""
+    return QualityReport(
+        sharpness=120.0 if quality_pass else 5.0,
+        brightness=128.0,
+        contrast=40.0,
+        motion_blur_score=0.1,
+        quality_pass=quality_pass,
+        fail_reasons=[] if quality_pass else ["Image too blurry"]
+    )
+
+
+def test_preprocess_image_after_failed_qc():
+    """Test that a failed QC report skips everything but geometry and tone."""
+    # Non-square and dark with a glare patch, so the full pipeline would
+    # crop, rescale the tone and inpaint
+    image = create_test_image(size=(600, 800), color=(90, 60, 60))
+    image[100:200, 300:400] = 255
+    
+    preprocessed, report = preprocess_image(image, quality_report=make_quality_report(False))
+    
+    assert preprocessed.shape == (512, 512, 3)
+    np.testing.assert_array_equal(preprocessed, center_crop_and_resize(image, settings.target_size))
+    assert report.scaling_factor == 1.0
+    assert report.glare_mask_coverage == 0.0
+    
+    tone_cluster, lab_mean = estimate_skin_tone(cv2.cvtColor(preprocessed, cv2.COLOR_RGB2BGR))
+    assert report.tone_cluster == tone_cluster
+    np.testing.assert_allclose(report.lab_mean, lab_mean)
+    
+    _, full_report = preprocess_image(image)
+    assert full_report.scaling_factor != 1.0
+    assert full_report.glare_mask_coverage > 0.0
+
+
+def test_preprocess_image_after_passed_qc():
+    """Test that a passed QC report runs the full pipeline."""
+    image = create_test_image(size=(600, 800), color=(90, 60, 60))
+    
+    preprocessed, report = preprocess_image(image, quality_report=make_quality_report(True))
+    expected, expected_report = preprocess_image(image)
+    
+    np.testing.assert_array_equal(preprocessed, expected)
+    assert report == expected_report
@@ -0,0 +1,91 @@
+"""
+Smoke tests for TFLite quantization and serving.
+"""
+import pytest
+import numpy as np
+import keras
+from keras import layers
+from app.config import settings
+from app.models.quantization import TFLiteRunner, convert_to_tflite, load_tflite_runner
+
+
+@pytest.fixture(scope="module")
+def model():
+    """Small float model with the Hb predictor's input and output names."""
+    keras.utils.set_random_seed(0)
+    
+    image_input = keras.Input(shape=(32, 32, 3), name='image_input')
+    x = layers.Conv2D(8, 3, activation='relu')(image_input)
+    x = layers.GlobalAveragePooling2D()(x)
+    
+    tabular_input = keras.Input(shape=(18,), name='tabular_input')
+    t = layers.Dense(16, activation='relu')(tabular_input)
+    
+    x = layers.Dense(16, activation='relu')(layers.concatenate([x, t]))
+    hb_output = layers.Dense(3, name='hb_regression')(x)
+    anemia_output = layers.Dense(4, activation='softmax', name='anemia_classification')(x)
+    
+    return keras.Model(inputs=[image_input, tabular_input], outputs=[hb_output, anemia_output])
+
+
+@pytest.fixture(scope="module")
+def samples():
+    """Image and tabular batches in the model's input ranges."""
+    rng = np.random.default_rng(0)
+    return (
+        rng.random((16, 32, 32, 3), dtype=np.float32),
+        rng.random((16, 18), dtype=np.float32)
+    )
+
+
+def representative_dataset(samples):
+    """Calibration generator factory yielding one sample at a time."""
+    images, features = samples
+    
+    def dataset():
+        for i in range(len(images)):
+            yield [images[i:i + 1], features[i:i + 1]]
+    
+    return dataset
+
+
+@pytest.mark.parametrize("int8, rel_tolerance", [
+    (True, 0.05),
+    (False, 0.01)
+])
+def test_quantized_matches_float(model, samples, tmp_path, int8, rel_tolerance):
+    """Test that the quantized model's outputs stay close to the float model's."""
+    dataset = representative_dataset(samples) if int8 else None
+    model_path = convert_to_tflite(model, tmp_path / "model.tflite", dataset)
+    runner = TFLiteRunner(model_path)
+    
+    if int8:
+        tensor_types = {d['dtype'] for d in runner.interpreter.get_tensor_details()}
+        assert np.int8 in tensor_types
+    
+    # A batch size other than the calibration batch exercises input resizing
+    images, features = samples[0][:5], samples[1][:5]
+    outputs = runner(image_input=images, tabular_input=features)
+    hb_float, anemia_float = model.predict([images, features], verbose=0)
+    
+    assert outputs['hb_regression'].shape == hb_float.shape
+    assert outputs['anemia_classification'].shape == anemia_float.shape
+    
+    hb_scale = max(np.ptp(hb_float), 1e-3)
+    np.testing.assert_allclose(outputs['hb_regression'], hb_float, atol=rel_tolerance * hb_scale)
+    np.testing.assert_allclose(outputs['anemia_classification'], anemia_float, atol=rel_tolerance)
+
+
+def test_load_tflite_runner_fallback(tmp_path, monkeypatch):
+    """Test that serving falls back to Keras when TFLite is off or missing."""
+    missing_path = tmp_path / "missing.tflite"
+    
+    monkeypatch.setattr(settings, "use_tflite", False)
+    assert load_tflite_runner(missing_path) is None
+    
+    monkeypatch.setattr(settings, "use_tflite", True)
+    assert load_tflite_runner(missing_path) is None
+    
+    corrupt_path = tmp_path / "corrupt.tflite"
+    corrupt_path.write_bytes(b"not a flatbuffer")
+    assert load_tflite_runner(corrupt_path) is None
@@ -0,0 +1,110 @@
+"""
+Unit tests for stored file encryption.
+"""
+import os
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+from app.config import settings
+from app.utils import security
+from app.utils.security import FileEncryption
+
+
+@pytest.fixture
+def encryption(monkeypatch):
+    """File encryption enabled with a fresh key."""
+    monkeypatch.setattr(settings, "enable_encryption", True)
+    monkeypatch.setattr(settings, "encryption_key", Fernet.generate_key().decode())
+    security._get_file_keys.cache_clear()
+    yield FileEncryption()
+    security._get_file_keys.cache_clear()
+
+
+def write_file(tmp_path, data, name="scan.jpg"):
+    """Write plaintext to a file under tmp_path."""
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.parametrize("size", [
+    0,
+    1,
+    security._CHUNK_SIZE,
+    3 * security._CHUNK_SIZE + 17
+])
+def test_round_trip(encryption, tmp_path, size):
+    """Test that encrypting then decrypting returns the original bytes."""
+    data = os.urandom(size)
+    path = write_file(tmp_path, data)
+    
+    encrypted_path = encryption.encrypt_file(path)
+    
+    assert encrypted_path == tmp_path / "scan.jpg.enc"
+    assert not path.exists()
+    ciphertext = encrypted_path.read_bytes()
+    assert ciphertext.startswith(security._FILE_MAGIC)
+    assert len(ciphertext) == len(security._FILE_MAGIC) + security._NONCE_SIZE + size + security._TAG_SIZE
+    if size:
+        assert data not in ciphertext
+    
+    assert encryption.decrypt_file(encrypted_path) == data
+
+
+@pytest.mark.parametrize("offset", [
+    len(security._FILE_MAGIC),  # Nonce
+    len(security._FILE_MAGIC) + security._NONCE_SIZE + 100,  # Ciphertext
+    -1  # Tag
+])
+def test_tampering_raises(encryption, tmp_path, offset):
+    """Test that a flipped bit anywhere after the magic fails authentication."""
+    encrypted_path = encryption.encrypt_file(write_file(tmp_path, os.urandom(1000)))
+    
+    ciphertext = bytearray(encrypted_path.read_bytes())
+    ciphertext[offset] ^= 0x01
+    encrypted_path.write_bytes(ciphertext)
+    
+    with pytest.raises(InvalidTag):
+        encryption.decrypt_file(encrypted_path)
+
+
+def test_truncation_raises(encryption, tmp_path):
+    """Test that a file cut short fails authentication."""
+    encrypted_path = encryption.encrypt_file(write_file(tmp_path, os.urandom(1000)))
+    encrypted_path.write_bytes(encrypted_path.read_bytes()[:-100])
+    
+    with pytest.raises(InvalidTag):
+        encryption.decrypt_file(encrypted_path)
+
+
+def test_wrong_key_raises(encryption, tmp_path, monkeypatch):
+    """Test that a file encrypted under another key is rejected."""
+    encrypted_path = encryption.encrypt_file(write_file(tmp_path, b"nail bed image"))
+    
+    monkeypatch.setattr(settings, "encryption_key", Fernet.generate_key().decode())
+    security._get_file_keys.cache_clear()
+    
+    with pytest.raises(InvalidTag):
+        encryption.decrypt_file(encrypted_path)
+
+
+def test_legacy_fernet_file(encryption, tmp_path):
+    """Test reading a file written by the previous Fernet encryption."""
+    data = os.urandom(5000)
+    legacy_path = write_file(tmp_path, encryption.cipher.encrypt(data), name="scan.jpg.enc")
+    
+    assert encryption.decrypt_file(legacy_path) == data
+
+
+def test_encryption_disabled(tmp_path, monkeypatch):
+    """Test that files pass through unchanged when encryption is off."""
+    monkeypatch.setattr(settings, "enable_encryption", False)
+    security._get_file_keys.cache_clear()
+    encryption = FileEncryption()
+    path = write_file(tmp_path, b"nail bed image")
+    
+    try:
+        assert encryption.encrypt_file(path) == path
+        assert encryption.decrypt_file(path) == b"nail bed image"
+    finally:
+        security._get_file_keys.cache_clear()
@@ -0,0 +1,128 @@
+"""
+Unit tests for upload validation.
+"""
+import io
+import pytest
+import numpy as np
+from functools import lru_cache
+from PIL import Image
+from app.services.validation import (
+    ValidationError,
+    _sniff_mime_type,
+    validate_file_type,
+    validate_upload
+)
+
+
+@lru_cache(maxsize=None)
+def encode_image(image_format, size=(512, 512)):
+    """Bytes of a noisy test image in the given PIL format."""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    
+    img_bytes = io.BytesIO()
+    Image.fromarray(pixels).save(img_bytes, format=image_format)
+    return img_bytes.getvalue()
+
+
+@pytest.mark.parametrize("image_format, filename, mime_type", [
+    ("JPEG", "scan.jpg", "image/jpeg"),
+    ("JPEG", "scan.JPEG", "image/jpeg"),
+    ("PNG", "scan.png", "image/png")
+])
+def test_accepts_jpeg_and_png(image_format, filename, mime_type):
+    """Test that JPEG and PNG content is identified and accepted."""
+    upload = io.BytesIO(encode_image(image_format))
+    
+    assert _sniff_mime_type(upload) == mime_type
+    validate_file_type(upload, filename)
+
+
+def test_rejects_webp():
+    """Test that WebP content is not identified as an allowed type."""
+    upload = io.BytesIO(encode_image("WEBP"))
+    
+    assert _sniff_mime_type(upload) is None
+    with pytest.raises(ValidationError, match="Invalid file extension"):
+        validate_file_type(upload, "scan.webp")
+
+
+@pytest.mark.parametrize("image_format, filename", [
+    ("WEBP", "scan.jpg"),
+    ("WEBP", "scan.png"),
+    ("GIF", "scan.jpeg"),
+    ("BMP", "scan.png")
+])
+def test_rejects_spoofed_extension(image_format, filename):
+    """Test that other formats renamed to an allowed extension are rejected."""
+    upload = io.BytesIO(encode_image(image_format))
+    
+    with pytest.raises(ValidationError, match="not a JPEG or PNG"):
+        validate_file_type(upload, filename)
+
+
+def test_rejects_disallowed_extension():
+    """Test that JPEG content with a disallowed extension is rejected."""
+    upload = io.BytesIO(encode_image("JPEG"))
+    
+    with pytest.raises(ValidationError, match="Invalid file extension"):
+        validate_file_type(upload, "scan.webp")
+
+
+def test_content_decides_between_allowed_types():
+    """Test that a PNG named .jpg is checked as the PNG it is."""
+    upload = io.BytesIO(encode_image("PNG"))
+    
+    assert _sniff_mime_type(upload) == "image/png"
+    validate_file_type(upload, "scan.jpg")
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\xff\xd8",
+    b"\x89PNG\r\n",
+    b"RIFF\x00\x00\x00\x00WEBP"
+])
+def test_rejects_short_or_foreign_headers(data):
+    """Test that input shorter than a signature, or not matching one, is rejected."""
+    with pytest.raises(ValidationError, match="not a JPEG or PNG"):
+        validate_file_type(io.BytesIO(data), "scan.jpg")
+
+
+@pytest.mark.parametrize("data", [
+    b"\xff\xd8\xff",
+    b"\x89PNG\r\n\x1a\n"
+])
+def test_rejects_bare_signature(data):
+    """Test that a valid signature with nothing after it is rejected."""
+    with pytest.raises(ValidationError, match="Cannot read image file"):
+        validate_file_type(io.BytesIO(data), "scan.jpg")
+
+
+@pytest.mark.parametrize("image_format, filename", [
+    ("JPEG", "scan.jpg"),
+    ("PNG", "scan.png")
+])
+def test_validate_upload_decodes(image_format, filename):
+    """Test that a complete upload passes and decodes to an RGB array."""
+    image_rgb, hand_info = validate_upload(
+        io.BytesIO(encode_image(image_format)),
+        filename,
+        check_hand=False
+    )
+    
+    assert image_rgb.shape == (512, 512, 3)
+    assert image_rgb.dtype == np.uint8
+    assert hand_info == {}
+
+
+@pytest.mark.parametrize("image_format, filename", [
+    ("JPEG", "scan.jpg"),
+    ("PNG", "scan.png")
+])
+def test_validate_upload_rejects_truncated(image_format, filename):
+    """Test that an upload cut off in its pixel data is rejected."""
+    data = encode_image(image_format)
+    
+    with pytest.raises(ValidationError, match="Corrupted or unreadable image"):
+        validate_upload(io.BytesIO(data[:len(data) // 2]), filename, check_hand=False)
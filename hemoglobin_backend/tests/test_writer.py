@@ -0,0 +1,287 @@
+"""
+Unit tests for scan record storage and the batched writer.
+"""
+import asyncio
+import threading
+import pytest
+from sqlalchemy import create_engine, event, inspect, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import models as models_module
+from app.database import writer as writer_module
+from app.database.crud import create_scan_record, create_scan_records_bulk, get_scan_record
+from app.database.models import Base, ScanRecord, init_db
+from app.database.writer import ScanRecordWriter
+from app.routes.scan import _load_scan
+from app.schemas import QualityReport, ScanResponse
+
+
+@pytest.fixture
+def session_factory():
+    """Sessions on a private in-memory database."""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def make_scan(scan_id):
+    """Create a minimal scan response."""
+    return ScanResponse(
+        scan_id=scan_id,
+        quality=QualityReport(
+            sharpness=120.0,
+            brightness=128.0,
+            contrast=40.0,
+            motion_blur_score=0.1,
+            quality_pass=True
+        )
+    )
+
+
+def stored_ids(session_factory):
+    """Scan IDs currently in the database."""
+    with session_factory() as db:
+        return set(db.scalars(select(ScanRecord.scan_id)))
+
+
+def spy_bulk(monkeypatch):
+    """Record the size of every bulk insert the writer makes."""
+    sizes = []
+    
+    def bulk(db, batch):
+        sizes.append(len(batch))
+        return create_scan_records_bulk(db, batch)
+    
+    monkeypatch.setattr(writer_module, "create_scan_records_bulk", bulk)
+    return sizes
+
+
+def test_init_db_creates_tables_once(monkeypatch):
+    """Test that init_db creates the tables, then only probes for them."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    monkeypatch.setattr(models_module, "engine", engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    
+    init_db()
+    assert inspect(engine).has_table(ScanRecord.__tablename__)
+    
+    statements.clear()
+    init_db()
+    assert not any(statement.lstrip().upper().startswith("CREATE") for statement in statements)
+    assert len(statements) == 1
+    
+    engine.dispose()
+
+
+def test_create_scan_records_bulk(session_factory):
+    """Test inserting several records in one statement."""
+    with session_factory() as db:
+        assert create_scan_records_bulk(db, []) == 0
+        assert create_scan_records_bulk(db, [make_scan("a"), make_scan("b")]) == 2
+    
+    assert stored_ids(session_factory) == {"a", "b"}
+
+
+def test_response_data_round_trip(session_factory):
+    """Test that a stored scan loads back unchanged from the JSON column."""
+    scan = make_scan("a")
+    with session_factory() as db:
+        create_scan_record(db, scan)
+    
+    with session_factory() as db:
+        assert isinstance(get_scan_record(db, "a").response_data, dict)
+        assert _load_scan(db, "a") == scan
+
+
+def test_response_data_legacy_string(session_factory):
+    """Test loading a row whose response was stored as a serialized string."""
+    scan = make_scan("a")
+    with session_factory() as db:
+        db.add(ScanRecord(scan_id="a", response_data=scan.model_dump_json()))
+        db.commit()
+    
+    with session_factory() as db:
+        assert isinstance(get_scan_record(db, "a").response_data, str)
+        assert _load_scan(db, "a") == scan
+
+
+def test_flush_on_batch_size(session_factory, monkeypatch):
+    """Test that a full batch is written without waiting for the interval."""
+    sizes = spy_bulk(monkeypatch)
+    writer = ScanRecordWriter(max_batch_size=3, flush_interval=30.0, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        for i in range(3):
+            await writer.submit(make_scan(f"s{i}"))
+        await asyncio.wait_for(writer._queue.join(), timeout=5.0)
+        await writer.stop()
+    
+    asyncio.run(scenario())
+    
+    assert sizes == [3]
+    assert stored_ids(session_factory) == {"s0", "s1", "s2"}
+
+
+def test_flush_on_interval(session_factory, monkeypatch):
+    """Test that a partial batch is written once the interval has passed."""
+    sizes = spy_bulk(monkeypatch)
+    writer = ScanRecordWriter(max_batch_size=32, flush_interval=0.05, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        await writer.submit(make_scan("s0"))
+        await writer.submit(make_scan("s1"))
+        await asyncio.sleep(0.5)
+        flushed = stored_ids(session_factory)
+        await writer.stop()
+        return flushed
+    
+    assert asyncio.run(scenario()) == {"s0", "s1"}
+    assert sizes == [2]
+
+
+def test_get_pending_until_flushed(session_factory, monkeypatch):
+    """Test that submitted records stay readable until they are written."""
+    release = threading.Event()
+    
+    def blocked_bulk(db, batch):
+        release.wait(timeout=5.0)
+        return create_scan_records_bulk(db, batch)
+    
+    monkeypatch.setattr(writer_module, "create_scan_records_bulk", blocked_bulk)
+    writer = ScanRecordWriter(max_batch_size=1, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        scan = make_scan("s0")
+        await writer.submit(scan)
+        await asyncio.sleep(0.1)
+        assert writer.get_pending("s0") is scan
+        assert stored_ids(session_factory) == set()
+        
+        release.set()
+        await writer.stop()
+        assert writer.get_pending("s0") is None
+    
+    asyncio.run(scenario())
+    assert stored_ids(session_factory) == {"s0"}
+
+
+def test_stop_drains_queue(session_factory):
+    """Test that stop() writes every buffered record first."""
+    writer = ScanRecordWriter(max_batch_size=32, flush_interval=0.2, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        for i in range(5):
+            await writer.submit(make_scan(f"s{i}"))
+        await writer.stop()
+    
+    asyncio.run(scenario())
+    
+    assert not writer.running
+    assert stored_ids(session_factory) == {f"s{i}" for i in range(5)}
+
+
+def test_duplicate_does_not_drop_batch(session_factory):
+    """Test that one duplicate scan ID doesn't lose the rest of its batch."""
+    with session_factory() as db:
+        create_scan_record(db, make_scan("dup"))
+    
+    writer = ScanRecordWriter(max_batch_size=3, retry_delay=0.0, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        for scan_id in ("s0", "dup", "s1"):
+            await writer.submit(make_scan(scan_id))
+        await writer.stop()
+    
+    asyncio.run(scenario())
+    
+    assert stored_ids(session_factory) == {"dup", "s0", "s1"}
+    assert writer.get_pending("dup") is None
+    assert writer._attempts == {}
+
+
+def test_transient_failure_is_retried(session_factory, monkeypatch):
+    """Test that a record whose insert fails once is written on retry."""
+    failures = {"s0": 1}
+    
+    def bulk(db, batch):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+    
+    def flaky_create(db, scan_data):
+        if failures.get(scan_data.scan_id, 0) > 0:
+            failures[scan_data.scan_id] -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return create_scan_record(db, scan_data)
+    
+    monkeypatch.setattr(writer_module, "create_scan_records_bulk", bulk)
+    monkeypatch.setattr(writer_module, "create_scan_record", flaky_create)
+    writer = ScanRecordWriter(max_batch_size=2, retry_delay=0.0, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        await writer.submit(make_scan("s0"))
+        await writer.submit(make_scan("s1"))
+        await writer.stop()
+    
+    asyncio.run(scenario())
+    
+    assert stored_ids(session_factory) == {"s0", "s1"}
+    assert writer.get_pending("s0") is None
+
+
+def test_retries_are_bounded(session_factory, monkeypatch):
+    """Test that a record that never inserts is dropped after max_retries."""
+    calls = []
+    
+    def failing_create(db, scan_data):
+        calls.append(scan_data.scan_id)
+        raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+    
+    def failing_bulk(db, batch):
+        raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+    
+    monkeypatch.setattr(writer_module, "create_scan_records_bulk", failing_bulk)
+    monkeypatch.setattr(writer_module, "create_scan_record", failing_create)
+    writer = ScanRecordWriter(max_retries=2, retry_delay=0.0, session_factory=session_factory)
+    
+    async def scenario():
+        await writer.start()
+        await writer.submit(make_scan("s0"))
+        await asyncio.wait_for(writer.stop(), timeout=5.0)
+    
+    asyncio.run(scenario())
+    
+    assert calls == ["s0"] * 3
+    assert writer.get_pending("s0") is None
+    assert writer._attempts == {}
+    assert stored_ids(session_factory) == set()
+
+
+def test_detached_write_retries(session_factory, monkeypatch):
+    """Test the write path used when the flush task isn't running."""
+    failures = {"s0": 2}
+    
+    def flaky_create(db, scan_data):
+        if failures[scan_data.scan_id] > 0:
+            failures[scan_data.scan_id] -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return create_scan_record(db, scan_data)
+    
+    monkeypatch.setattr(writer_module, "create_scan_record", flaky_create)
+    writer = ScanRecordWriter(retry_delay=0.0, session_factory=session_factory)
+    
+    asyncio.run(writer.submit(make_scan("s0")))
+    
+    assert stored_ids(session_factory) == {"s0"}
+    assert writer.get_pending("s0") is None
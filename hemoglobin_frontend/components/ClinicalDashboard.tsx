@@ -38,7 +38,7 @@ const ClinicalDashboard: React.FC<ClinicalDashboardProps> = ({ result, onBack })
     // Helper to ensure base64 strings have the correct prefix
     const getBase64Image = (base64String?: string) => {
         if (!base64String) return undefined;
-        if (base64String.startsWith('data:')) return base64String;
+        if (base64String.startsWith('data:') || /^https?:\/\//.test(base64String)) return base64String;
         return `data:image/png;base64,${base64String}`;
     };
 
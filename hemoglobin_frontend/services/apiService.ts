@@ -112,19 +112,46 @@ function mapBackendToFrontend(backendData: any, imageUrl: string): AnalysisResul
                 { name: 'texture', direction: 'normal', impact: 'Nail bed texture' }
             ]
         },
-        explainability: backendData.explainability,
+        explainability: backendData.explainability ? {
+            ...backendData.explainability,
+            gradcam_nail_overlay: resolveImage(
+                backendData.explainability.gradcam_nail_overlay,
+                backendData.explainability.gradcam_overlay_url
+            ),
+            feature_importance_plot: resolveImage(
+                backendData.explainability.feature_importance_plot,
+                backendData.explainability.feature_importance_plot_url
+            )
+        } : undefined,
         preprocessing: backendData.preprocessing ? {
             tone_cluster: backendData.preprocessing.tone_cluster,
-            original_image_base64: backendData.preprocessing.original_image_base64,
-            preprocessed_image_base64: backendData.preprocessing.preprocessed_image_base64
+            original_image_base64: resolveImage(
+                backendData.preprocessing.original_image_base64,
+                backendData.preprocessing.original_image_url
+            ),
+            preprocessed_image_base64: resolveImage(
+                backendData.preprocessing.preprocessed_image_base64,
+                backendData.preprocessing.preprocessed_image_url
+            )
         } : undefined,
         segmentation: backendData.segmentation ? {
-            roi_image_base64: backendData.segmentation.roi_image_base64
+            roi_image_base64: resolveImage(
+                backendData.segmentation.roi_image_base64,
+                backendData.segmentation.roi_image_url
+            )
         } : undefined,
         imageUrl
     };
 }
 
+/**
+ * Use the inline base64 image if the backend embedded one, else its download URL
+ */
+function resolveImage(base64Image?: string, imageUrl?: string): string | undefined {
+    if (base64Image) return base64Image;
+    return imageUrl ? `${API_BASE_URL}${imageUrl}` : undefined;
+}
+
 /**
  * Determine feature direction from contribution value
  */